@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+
+# Compares the memory footprint and the diff time of the file trees with the classes used before they
+# were made compact (`__dict__` instances, `datetime` modification dates, children sorted on every call)
+# and with the slotted classes (one instance per file in a dictionary) used before they were stored in columns.
+#
+# usage: python3 -m benchmarks.file_tree [<file count>]
+
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from src.collections.file_tree import FilesystemNode
+
+from typing import Optional
+
+
+class LegacyLeaf :
+
+    def __init__(self, name: str, extension: str, modification: datetime) :
+        self.name = name
+        self.extension = extension
+        self.modification = modification
+        self.metadata = None
+
+
+class LegacyNode :
+
+    def __init__(self, name: str) :
+        self.name = name
+        self.subfolders: dict[str, LegacyNode] = {}
+        self.files: dict[str, LegacyLeaf] = {}
+        self.file_count = 0
+
+    def list_files(self) :
+        res = list(self.files.values())
+        res.sort(key = lambda n: n.name)
+        return res
+
+    def list_folders(self) :
+        res = list(self.subfolders.values())
+        res.sort(key = lambda n: n.name)
+        return res
+
+    def push_file(self, path: str, filename: str, extension: str, modification: datetime) :
+        node = self
+        for folder in path.split('/') :
+            node.file_count += 1
+            if folder not in node.subfolders :
+                node.subfolders[folder] = LegacyNode(folder)
+            node = node.subfolders[folder]
+        if filename not in node.files :
+            node.file_count += 1
+        node.files[filename] = LegacyLeaf(filename, extension, modification)
+
+
+class SlottedLeaf :
+    __slots__ = ('name', 'extension', 'modification', 'size', 'metadata')
+
+    def __init__(self, name: str, extension: str, modification: int, size: int = 0) :
+        self.name = sys.intern(name)
+        self.extension = sys.intern(extension)
+        self.modification = modification
+        self.size = size
+        self.metadata = None
+
+
+class SlottedNode :
+    __slots__ = ('name', 'subfolders', 'files', 'file_count', '_sorted_files', '_sorted_folders')
+
+    def __init__(self, name: str) :
+        self.name = sys.intern(name)
+        self.subfolders: dict[str, SlottedNode] = {}
+        self.files: dict[str, SlottedLeaf] = {}
+        self.file_count = 0
+        self._sorted_files = None
+        self._sorted_folders = None
+
+    def list_files(self) :
+        if self._sorted_files is None :
+            self._sorted_files = sorted(self.files.values(), key = lambda n: n.name)
+        return self._sorted_files
+
+    def list_folders(self) :
+        if self._sorted_folders is None :
+            self._sorted_folders = sorted(self.subfolders.values(), key = lambda n: n.name)
+        return self._sorted_folders
+
+    def push_file(self, path: str, filename: str, extension: str, modification: int) :
+        node = self
+        for folder in path.split('/') :
+            node.file_count += 1
+            if folder not in node.subfolders :
+                node.subfolders[folder] = SlottedNode(folder)
+                node._sorted_folders = None
+            node = node.subfolders[folder]
+        if filename not in node.files :
+            node.file_count += 1
+        leaf = SlottedLeaf(filename, extension, modification)
+        node.files[leaf.name] = leaf
+        node._sorted_files = None
+
+
+FILES_PER_ALBUM  = 12
+ALBUMS_PER_ARTIST = 5
+
+
+def synthetic_entries(count: int, extension: str) :
+    base_ns = 1_700_000_000_000_000_000
+    for i in range(count) :
+        album = i // FILES_PER_ALBUM
+        artist = album // ALBUMS_PER_ARTIST
+        yield (f"Artist {artist:05d}/Album {album:06d}", f"{i % FILES_PER_ALBUM:02d} - Track number {i}", extension, base_ns + i * 1_000_000_007)
+
+
+def build(node_class, count: int, root: str, extension: str, legacy: bool) :
+    res = node_class(root)
+    for path, filename, ext, mtime_ns in synthetic_entries(count, extension) :
+        modification = datetime.fromtimestamp(mtime_ns // 1_000_000_000, tz = timezone.utc) if legacy else mtime_ns
+        res.push_file(path, filename, ext, modification)
+    # The columns are sorted on the first read of each node
+    if isinstance(res, FilesystemNode) :
+        res.freeze()
+    return res
+
+
+# Same access pattern as `process_leaves` and `process_nodes`
+def merge_join(src_node, dst_node) -> int :
+    res = 0
+    src_files = src_node.list_files()
+    dst_files = dst_node.list_files()
+    i_src = 0
+    i_dst = 0
+    while i_src < len(src_files) and i_dst < len(dst_files) :
+        if src_files[i_src].name == dst_files[i_dst].name :
+            res += src_files[i_src].modification > dst_files[i_dst].modification
+            i_src += 1
+            i_dst += 1
+        elif src_files[i_src].name < dst_files[i_dst].name :
+            i_src += 1
+        else :
+            i_dst += 1
+    src_folders = src_node.list_folders()
+    dst_folders = dst_node.list_folders()
+    i_src = 0
+    i_dst = 0
+    while i_src < len(src_folders) and i_dst < len(dst_folders) :
+        if src_folders[i_src].name == dst_folders[i_dst].name :
+            res += merge_join(src_folders[i_src], dst_folders[i_dst])
+            i_src += 1
+            i_dst += 1
+        elif src_folders[i_src].name < dst_folders[i_dst].name :
+            i_src += 1
+        else :
+            i_dst += 1
+    return res
+
+
+# Same access pattern as `process_leaves` on the columns of the nodes
+def merge_join_columns(src_node: FilesystemNode, dst_node: FilesystemNode) -> int :
+    res = 0
+    src_modifications = src_node.modifications()
+    dst_modifications = dst_node.modifications()
+    if src_node.same_files(dst_node) :
+        res += sum(1 for src_mtime, dst_mtime in zip(src_modifications, dst_modifications) if src_mtime > dst_mtime)
+        return res + merge_join_folders(src_node, dst_node)
+    src_names = src_node.names()
+    dst_names = dst_node.names()
+    src_present = src_node.present()
+    dst_present = dst_node.present()
+    i_src = 0
+    i_dst = 0
+    while i_src < len(src_names) and i_dst < len(dst_names) :
+        if not src_present[i_src] :
+            i_src += 1
+            continue
+        if not dst_present[i_dst] :
+            i_dst += 1
+            continue
+        if src_names[i_src] == dst_names[i_dst] :
+            res += src_modifications[i_src] > dst_modifications[i_dst]
+            i_src += 1
+            i_dst += 1
+        elif src_names[i_src] < dst_names[i_dst] :
+            i_src += 1
+        else :
+            i_dst += 1
+    return res + merge_join_folders(src_node, dst_node)
+
+
+def merge_join_folders(src_node: FilesystemNode, dst_node: FilesystemNode) -> int :
+    res = 0
+    src_folders = src_node.list_folders()
+    dst_folders = dst_node.list_folders()
+    i_src = 0
+    i_dst = 0
+    while i_src < len(src_folders) and i_dst < len(dst_folders) :
+        if src_folders[i_src].name == dst_folders[i_dst].name :
+            res += merge_join_columns(src_folders[i_src], dst_folders[i_dst])
+            i_src += 1
+            i_dst += 1
+        elif src_folders[i_src].name < dst_folders[i_dst].name :
+            i_src += 1
+        else :
+            i_dst += 1
+    return res
+
+
+def measure(label: str, node_class, count: int, legacy: bool, runs: int = 3) :
+    tracemalloc.start()
+    tree = build(node_class, count, '/source', 'flac', legacy)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tree
+
+    start = time.perf_counter()
+    src = build(node_class, count, '/source', 'flac', legacy)
+    dst = build(node_class, count, '/destination', 'mp3', legacy)
+    build_time = time.perf_counter() - start
+
+    diff_time: Optional[float] = None
+    for _ in range(runs) :
+        start = time.perf_counter()
+        (merge_join_columns if node_class is FilesystemNode else merge_join)(src, dst)
+        elapsed = time.perf_counter() - start
+        diff_time = elapsed if diff_time is None else min(diff_time, elapsed)
+
+    print(f"{label:8} build {build_time:8.3f}s   diff {diff_time:8.3f}s   memory per tree {memory / 1024 / 1024:10.1f} MiB")
+
+
+def main() :
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    print(f"Two trees of {count} files")
+    measure('legacy', LegacyNode, count, True)
+    measure('slotted', SlottedNode, count, False)
+    measure('columns', FilesystemNode, count, False)
+
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+# Compares the per-file cost of reading the Convert-Keep tag with mutagen and with the scanner of
+# `src.metadata.keep_scanner`, on tagged files with a cover (which the scanner skips without reading it).
+# The files are read from the page cache, so this mostly measures the parsing.
+#
+# usage: python3 -m benchmarks.keep_scanner [<files per format>]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import ID3, APIC, TIT2, TPE1
+from mutagen.mp4 import MP4, MP4Cover
+
+from benchmarks.library import KEEP_VALUES, WRITERS
+from src.collections.file_tree import FilesystemLeaf
+from src.metadata.keep_scanner import UnsupportedLayout, scan_keep
+from src.metadata.parsing import read_raw_keep_mutagen
+
+from typing import Callable, Optional
+
+
+COVER_SIZE = 200 * 1024
+
+
+def add_common_tags(path: str, extension: str, cover: bytes) :
+    if extension == 'flac' :
+        audio = FLAC(path)
+        audio['TITLE'] = 'Title'
+        audio['ARTIST'] = 'Artist'
+        picture = Picture()
+        picture.type = 3
+        picture.mime = 'image/jpeg'
+        picture.data = cover
+        audio.add_picture(picture)
+        audio.save()
+    elif extension == 'm4a' :
+        audio = MP4(path)
+        audio['\xa9nam'] = [ 'Title' ]
+        audio['\xa9ART'] = [ 'Artist' ]
+        audio['covr'] = [ MP4Cover(cover, imageformat = MP4Cover.FORMAT_JPEG) ]
+        audio.save()
+    else :
+        # The cover comes before the Convert-Keep frame, which the scanner has to skip
+        tags = ID3(path)
+        keep = tags.getall('TXXX')
+        tags.delall('TXXX')
+        tags.add(TIT2(encoding = 3, text = [ 'Title' ]))
+        tags.add(TPE1(encoding = 3, text = [ 'Artist' ]))
+        tags.add(APIC(encoding = 3, mime = 'image/jpeg', type = 3, desc = '', data = cover))
+        for frame in keep :
+            tags.add(frame)
+        tags.save(path, v2_version = 4)
+
+
+def decode(keep) -> Optional[str] :
+    if isinstance(keep, bytes) :
+        return keep.decode('utf-8').strip()
+    return keep
+
+
+def scanner(path: str, leaf: FilesystemLeaf) :
+    try :
+        return scan_keep(os.path.join(path, leaf.filename()), leaf.extension)
+    except UnsupportedLayout :
+        return read_raw_keep_mutagen(path, leaf)
+
+
+def measure(reader: Callable, path: str, leaves: "list[FilesystemLeaf]", runs: int = 3) -> "tuple[float, list[Optional[str]]]" :
+    best: Optional[float] = None
+    values: "list[Optional[str]]" = []
+    for _ in range(runs) :
+        start = time.perf_counter()
+        values = [ decode(reader(path, leaf)) for leaf in leaves ]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best / len(leaves), values)
+
+
+def main() :
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    root = tempfile.mkdtemp(prefix = 'mp3conv-keep-')
+    cover = os.urandom(COVER_SIZE)
+    try :
+        print(f"{count} files per format, with a {COVER_SIZE // 1024} KiB cover")
+        print(f"{'format':<8}{'mutagen (us)':>14}{'scanner (us)':>14}{'speedup':>10}")
+        for extension, writer in WRITERS.items() :
+            leaves = []
+            for i in range(count) :
+                name = f"track{i:05d}"
+                filepath = os.path.join(root, f"{name}.{extension}")
+                writer(filepath, KEEP_VALUES[i % len(KEEP_VALUES)])
+                add_common_tags(filepath, extension, cover)
+                leaves.append(FilesystemLeaf(name, extension, 0))
+            mutagen_time, expected = measure(read_raw_keep_mutagen, root, leaves)
+            scanner_time, values = measure(scanner, root, leaves)
+            if values != expected :
+                print(f"{extension} : the scanner and mutagen disagree", file = sys.stderr)
+                sys.exit(1)
+            print(f"{extension:<8}{mutagen_time * 1e6:>14.1f}{scanner_time * 1e6:>14.1f}{mutagen_time / scanner_time:>9.1f}x")
+    finally :
+        shutil.rmtree(root, ignore_errors = True)
+
+
+if __name__ == '__main__' :
+    main()
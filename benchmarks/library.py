@@ -0,0 +1,126 @@
+
+# Generation of synthetic music libraries for the benchmarks. The audio files are tiny but valid enough
+# for mutagen, and carry Convert-Keep tags in the formats expected by `src.metadata.parsing`.
+
+import os
+import random
+import struct
+
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3, TXXX
+from mutagen.mp4 import MP4, MP4FreeForm
+
+from typing import Final, Optional, Sequence
+
+
+MP3_FRAME = b'\xff\xfb\x90\x64' + bytes(413)
+
+KEEP_VALUES = [ None, 'always', 'bonus', 'archive', 'skip' ]
+
+
+def _atom(kind: bytes, data: bytes) -> bytes :
+    return struct.pack('>I', 8 + len(data)) + kind + data
+
+
+def write_flac(path: str, keep: Optional[str]) :
+    # STREAMINFO : 4096 samples blocks, 44.1kHz, 2 channels, 16 bits, no MD5
+    streaminfo = struct.pack('>HH', 4096, 4096) + bytes(6) + bytes([0x0A, 0xC4, 0x42, 0xF0]) + bytes(4) + bytes(16)
+    with open(path, 'wb') as f :
+        f.write(b'fLaC' + bytes([0x80, 0, 0, len(streaminfo)]) + streaminfo)
+    if keep is not None :
+        audio = FLAC(path)
+        audio['CONVERT-KEEP'] = keep
+        audio.save()
+
+
+def write_m4a(path: str, keep: Optional[str]) :
+    mvhd = _atom(b'mvhd', bytes(12) + struct.pack('>II', 1000, 0) + bytes(80))
+    with open(path, 'wb') as f :
+        f.write(_atom(b'ftyp', b'M4A \0\0\0\0M4A mp42isom') + _atom(b'moov', mvhd) + _atom(b'mdat', b''))
+    if keep is not None :
+        audio = MP4(path)
+        audio['----:com.apple.iTunes:Convert-Keep'] = [ MP4FreeForm(keep.encode('utf-8')) ]
+        audio.save()
+
+
+def write_mp3(path: str, keep: Optional[str]) :
+    with open(path, 'wb') as f :
+        f.write(MP3_FRAME * 10)
+    tags = ID3()
+    if keep is not None :
+        tags.add(TXXX(encoding = 3, desc = 'Convert-Keep', text = [ keep ]))
+    tags.save(path)
+
+
+WRITERS = {
+    'flac': write_flac,
+    'm4a':  write_m4a,
+    'mp3':  write_mp3,
+}
+
+
+DEFAULT_MIX = { 'flac': 0.6, 'm4a': 0.2, 'mp3': 0.2 }
+
+
+class LibrarySpec :
+
+    def __init__(self, files: int, depth: int = 2, files_per_dir: int = 12, mix: "Optional[dict[str, float]]" = None,
+                 changed: float = 0.0, new: float = 0.0, deleted: float = 0.0, seed: int = 0) :
+        self.files: Final[int] = files
+        self.depth: Final[int] = depth
+        self.files_per_dir: Final[int] = files_per_dir
+        self.mix: Final[dict[str, float]] = DEFAULT_MIX if mix is None else mix
+        self.changed: Final[float] = changed
+        self.new: Final[float] = new
+        self.deleted: Final[float] = deleted
+        self.seed: Final[int] = seed
+
+
+def _relative_path(index: int, spec: LibrarySpec) -> str :
+    directory = index // spec.files_per_dir
+    parts = []
+    for level in range(spec.depth) :
+        parts.append(f"Level{spec.depth - level} {directory % 10:d}" if level < spec.depth - 1 else f"Album {directory:06d}")
+        directory //= 10
+    parts.reverse()
+    return os.path.join(*parts, f"{index % spec.files_per_dir:02d} - Track {index}")
+
+
+def _pick_extension(rng: random.Random, mix: "dict[str, float]") -> str :
+    extensions: Sequence[str] = list(mix.keys())
+    return rng.choices(extensions, weights = [ mix[ext] for ext in extensions ])[0]
+
+
+# Creates `source` and `destination` as if a conversion had been run, then applies the requested changes to the source :
+# - `changed` : fraction of the source files whose modification date is newer than their output
+# - `new`     : fraction of source files (relative to `files`) that have no output
+# - `deleted` : fraction of outputs whose source was removed
+def generate_library(root: str, spec: LibrarySpec) -> "tuple[str, str]" :
+    rng = random.Random(spec.seed)
+    source = os.path.join(root, 'source')
+    destination = os.path.join(root, 'destination')
+    new_count = int(spec.files * spec.new)
+
+    for index in range(spec.files + new_count) :
+        relpath = _relative_path(index, spec)
+        extension = _pick_extension(rng, spec.mix)
+        source_file = os.path.join(source, f"{relpath}.{extension}")
+        os.makedirs(os.path.dirname(source_file), exist_ok = True)
+        WRITERS[extension](source_file, rng.choice(KEEP_VALUES))
+        source_mtime = os.stat(source_file).st_mtime_ns
+        if index >= spec.files :
+            continue
+
+        dest_file = os.path.join(destination, f"{relpath}.mp3")
+        os.makedirs(os.path.dirname(dest_file), exist_ok = True)
+        write_mp3(dest_file, None)
+        os.utime(dest_file, ns = (source_mtime, source_mtime + 10_000_000_000))
+
+        roll = rng.random()
+        if roll < spec.deleted :
+            os.remove(source_file)
+        elif roll < spec.deleted + spec.changed :
+            os.utime(source_file, ns = (source_mtime, source_mtime + 20_000_000_000))
+
+    os.makedirs(destination, exist_ok = True)
+    return (source, destination)
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+# Generates a synthetic library and measures the time and peak RSS of each phase of a conversion :
+# scan of both trees, tag parsing, tree diff and application of the patches (with a stub ffmpeg).
+#
+# usage: python3 -m benchmarks.suite [--files <n>] [--depth <n>] [--mix flac=0.6,m4a=0.2,mp3=0.2]
+#                                    [--changed <fraction>] [--new <fraction>] [--deleted <fraction>]
+#                                    [--jobs <n>] [--stub-delay <seconds>] [--keep <dir>]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import itertools
+
+from benchmarks.library import LibrarySpec, generate_library
+
+from src.options import options as prog_options
+from src.metrics import ConversionMetrics
+from src.metadata.keep import ConvertKeep
+from src.metadata.parsing import read_metadata
+from src.conversion import INPUT_EXTENSIONS, PlanningContext, process, walk_source_leaves
+from src.profiles import OutputProfile
+from src.execution import PatchExecutor
+from src.utils.directory_analyser import scan_directory
+
+from typing import Callable, Optional, Tuple
+
+
+STUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ffmpeg_stub')
+
+
+def reset_peak_rss() :
+    # Resets VmHWM on Linux, other platforms only report the peak of the whole process
+    try :
+        with open('/proc/self/clear_refs', 'w') as f :
+            f.write('5')
+    except OSError :
+        pass
+
+
+def peak_rss_mib() -> float :
+    try :
+        with open('/proc/self/status') as f :
+            for line in f :
+                if line.startswith('VmHWM:') :
+                    return int(line.split()[1]) / 1024
+    except OSError :
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(results: "list[Tuple[str, float, float]]", phase: str, func: Callable) :
+    reset_peak_rss()
+    start = time.perf_counter()
+    res = func()
+    results.append((phase, time.perf_counter() - start, peak_rss_mib()))
+    return res
+
+
+def read_all_metadata(source_files) -> int :
+    counters = ConversionMetrics().convert_tags
+    count = 0
+    for path, leaf in walk_source_leaves(source_files) :
+        read_metadata(path, leaf, ConvertKeep.ALWAYS, counters)
+        count += 1
+    return count
+
+
+def apply_all(patches, jobs: int, io_jobs: int) -> int :
+    applied = itertools.count()
+    with PatchExecutor(jobs, on_done = lambda p, duration: next(applied), io_jobs = io_jobs) as executor :
+        for p in patches :
+            executor.submit(p)
+    return next(applied)
+
+
+def parse_mix(repr: str) -> "dict[str, float]" :
+    res = {}
+    for part in repr.split(',') :
+        ext, _, weight = part.partition('=')
+        res[ext] = float(weight)
+    return res
+
+
+def main() :
+    parser = argparse.ArgumentParser(description = 'Per-phase benchmark of the converter on a synthetic library')
+    parser.add_argument('--files', type = int, default = 2000)
+    parser.add_argument('--depth', type = int, default = 2)
+    parser.add_argument('--mix', type = parse_mix, default = None)
+    parser.add_argument('--changed', type = float, default = 0.05)
+    parser.add_argument('--new', type = float, default = 0.05)
+    parser.add_argument('--deleted', type = float, default = 0.02)
+    parser.add_argument('--jobs', type = int, default = os.cpu_count() or 1)
+    parser.add_argument('--io-jobs', type = int, default = 4)
+    parser.add_argument('--stub-delay', type = float, default = 0.0)
+    parser.add_argument('--keep', metavar = 'DIR', default = None, help = 'generate the library in DIR and keep it')
+    args = parser.parse_args()
+
+    root: Optional[str] = args.keep
+    if root is None :
+        root = tempfile.mkdtemp(prefix = 'mp3conv-bench-')
+    os.environ['PATH'] = STUB_DIR + os.pathsep + os.environ.get('PATH', '')
+    os.environ['FFMPEG_STUB_DELAY'] = str(args.stub_delay)
+    prog_options.jobs = args.jobs
+
+    try :
+        spec = LibrarySpec(args.files, depth = args.depth, mix = args.mix, changed = args.changed, new = args.new, deleted = args.deleted)
+        start = time.perf_counter()
+        source, destination = generate_library(root, spec)
+        print(f"Generated {args.files} files in {root} ({time.perf_counter() - start:.1f}s)")
+
+        profile = OutputProfile(destination)
+        results: "list[Tuple[str, float, float]]" = []
+        source_files = measure(results, 'scan source', lambda: scan_directory(source, INPUT_EXTENSIONS))
+        dest_files = measure(results, 'scan destination', lambda: scan_directory(destination, [ profile.extension ]))
+        measure(results, 'read_metadata', lambda: read_all_metadata(source_files))
+        prog_options.keep_treshold = ConvertKeep.lowest()
+        patches = measure(results, 'process', lambda: list(process(source_files, dest_files, PlanningContext(ConversionMetrics(), profile))))
+        measure(results, 'apply', lambda: apply_all(patches, args.jobs, args.io_jobs))
+
+        print(f"{len(patches)} patches")
+        print(f"{'phase':<20}{'time (s)':>12}{'peak RSS (MiB)':>18}")
+        for phase, duration, rss in results :
+            print(f"{phase:<20}{duration:>12.3f}{rss:>18.1f}")
+    finally :
+        if args.keep is None :
+            shutil.rmtree(root, ignore_errors = True)
+
+
+if __name__ == '__main__' :
+    main()
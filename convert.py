@@ -5,13 +5,19 @@ import sys
 from collections import deque
 
 from src.options import options as prog_options
-from src.conversion import conversion
+from src.conversion import collapse_subpaths, conversion
+from src.execution import SCHEDULES
 from src.metrics import ExitStatus
 from src.metadata.keep import ConvertKeep
+from src.metrics_server import MetricsServer
+from src.profiles import CODECS, parse_profile
+from src.watch import watch
+from src.worker import Worker
 
 
 def help() :
-    print(f"{sys.argv[0]} [--dry-run] [--no-remove] [--keep-threshold <keep>] [--default-keep <keep>] [--prometheus-metrics] [--metrics-path <dir>] <source> <destination>")
+    print(f"{sys.argv[0]} [--dry-run] [--no-remove] [--keep-threshold <keep>] [--default-keep <keep>] [--no-keep-tags] [--prometheus-metrics] [--metrics-path <dir>] [--jobs <n>] [--io-jobs <n>] [--batch-size <n>] [--schedule <policy>] [--verify-destination] [--fingerprint] [--link] [--profile <dir>:<codec>:<quality>]... [--only <subpath>]... [--coordinator <queue>] [--tag-cache <file>] [--metadata-workers <n>] [--watch] [--metrics-port <port>] <source> <destination>")
+    print(f"{sys.argv[0]} --worker <queue> [--jobs <n>]")
 
 
 def main() :
@@ -22,6 +28,22 @@ def main() :
         help()
         sys.exit(0)
 
+    if len(args) > 1 and args[0] == '--worker' :
+        args.popleft()
+        queue_dir = args.popleft()
+        if len(args) > 1 and args[0] == '--jobs' :
+            args.popleft()
+            jobs_repr = args.popleft()
+            if not jobs_repr.isdigit() or int(jobs_repr) < 1 :
+                print(f"Bad number of jobs : {jobs_repr}")
+                sys.exit(1)
+            prog_options.jobs = int(jobs_repr)
+        if len(args) != 0 :
+            help()
+            sys.exit(1)
+        Worker(queue_dir, prog_options.jobs).run()
+        return
+
     if len(args) > 0 and args[0] == '--dry-run' :
         prog_options.dry_run = True
         args.popleft()
@@ -48,6 +70,10 @@ def main() :
             sys.exit(1)
         prog_options.default_keep = keep
     
+    if len(args) > 0 and args[0] == '--no-keep-tags' :
+        args.popleft()
+        prog_options.keep_tags = False
+    
     if len(args) > 0 and args[0] == '--prometheus-metrics' :
         args.popleft()
         prog_options.metrics_enabled = True
@@ -55,6 +81,97 @@ def main() :
     if len(args) > 1 and args[0] == '--metrics-path' :
         args.popleft()
         prog_options.matrics_path = args.popleft()
+    
+    if len(args) > 1 and args[0] == '--jobs' :
+        args.popleft()
+        jobs_repr = args.popleft()
+        if not jobs_repr.isdigit() or int(jobs_repr) < 1 :
+            print(f"Bad number of jobs : {jobs_repr}")
+            sys.exit(1)
+        prog_options.jobs = int(jobs_repr)
+    
+    if len(args) > 1 and args[0] == '--io-jobs' :
+        args.popleft()
+        jobs_repr = args.popleft()
+        if not jobs_repr.isdigit() or int(jobs_repr) < 1 :
+            print(f"Bad number of I/O jobs : {jobs_repr}")
+            sys.exit(1)
+        prog_options.io_jobs = int(jobs_repr)
+    
+    if len(args) > 1 and args[0] == '--batch-size' :
+        args.popleft()
+        batch_repr = args.popleft()
+        if not batch_repr.isdigit() or int(batch_repr) < 1 :
+            print(f"Bad batch size : {batch_repr}")
+            sys.exit(1)
+        prog_options.batch_size = int(batch_repr)
+    
+    if len(args) > 1 and args[0] == '--schedule' :
+        args.popleft()
+        schedule_repr = args.popleft().lower()
+        if schedule_repr not in SCHEDULES :
+            print(f"Bad schedule : {schedule_repr} (expected one of {', '.join(SCHEDULES)})")
+            sys.exit(1)
+        prog_options.schedule = schedule_repr
+    
+    if len(args) > 0 and args[0] == '--verify-destination' :
+        args.popleft()
+        prog_options.verify_destination = True
+    
+    if len(args) > 0 and args[0] == '--fingerprint' :
+        args.popleft()
+        prog_options.fingerprint = True
+    
+    if len(args) > 0 and args[0] == '--link' :
+        args.popleft()
+        prog_options.link = True
+    
+    while len(args) > 1 and args[0] == '--profile' :
+        args.popleft()
+        profile_repr = args.popleft()
+        profile = parse_profile(profile_repr)
+        if profile is None :
+            print(f"Bad profile : {profile_repr} (expected <dir>:<codec>:<quality>, with a codec among {', '.join(CODECS)})")
+            sys.exit(1)
+        prog_options.profiles.append(profile)
+    
+    while len(args) > 1 and args[0] == '--only' :
+        args.popleft()
+        only_repr = args.popleft()
+        subpath = os.path.normpath(only_repr)
+        if os.path.isabs(subpath) or subpath == '..' or subpath.startswith('../') :
+            print(f"Bad subpath : {only_repr} (expected a path relative to the source directory)")
+            sys.exit(1)
+        prog_options.only.append('' if subpath == '.' else subpath)
+    
+    if len(args) > 1 and args[0] == '--coordinator' :
+        args.popleft()
+        prog_options.coordinator = args.popleft()
+    
+    if len(args) > 1 and args[0] == '--tag-cache' :
+        args.popleft()
+        cache_repr = args.popleft()
+        prog_options.tag_cache_path = None if cache_repr.lower() == 'none' else cache_repr
+    
+    if len(args) > 1 and args[0] == '--metadata-workers' :
+        args.popleft()
+        workers_repr = args.popleft()
+        if not workers_repr.isdigit() or int(workers_repr) < 1 :
+            print(f"Bad number of metadata workers : {workers_repr}")
+            sys.exit(1)
+        prog_options.metadata_workers = int(workers_repr)
+    
+    if len(args) > 0 and args[0] == '--watch' :
+        args.popleft()
+        prog_options.watch = True
+    
+    if len(args) > 1 and args[0] == '--metrics-port' :
+        args.popleft()
+        port_repr = args.popleft()
+        if not port_repr.isdigit() or not 0 < int(port_repr) < 65536 :
+            print(f"Bad metrics port : {port_repr}")
+            sys.exit(1)
+        prog_options.metrics_port = int(port_repr)
 
     
     if len(args) != 2 :
@@ -69,7 +186,28 @@ def main() :
     if dest_dir.endswith('/') :
         dest_dir = dest_dir[:-1]
 
-    metrics = conversion(source_dir, dest_dir)
+    if prog_options.watch :
+        if len(prog_options.only) > 0 :
+            print('The run cannot be restricted to subpaths in watch mode')
+            sys.exit(1)
+        server = None
+        if prog_options.metrics_port is not None :
+            server = MetricsServer('127.0.0.1', prog_options.metrics_port)
+            server.start()
+        try :
+            watch(source_dir, dest_dir, server)
+        except KeyboardInterrupt :
+            pass
+        finally :
+            if server is not None :
+                server.stop()
+        return
+
+    subpaths = None
+    if len(prog_options.only) > 0 :
+        subpaths = collapse_subpaths(prog_options.only)
+
+    metrics = conversion(source_dir, dest_dir, subpaths)
 
     print()
     if not prog_options.metrics_enabled :
@@ -1,75 +1,238 @@
-
-from datetime import datetime
+import sys
+import threading
+from array import array
+from operator import itemgetter
 
 from src.metadata.keep import ConvertKeep
 
-from typing import Final, Optional, Sequence, Callable
+from typing import Final, Iterator, Optional, Sequence, Callable, Tuple
 
 
 class LeafMetadata :
+    __slots__ = ('keep',)
 
     def __init__(self, keep: ConvertKeep) :
         self.keep: Final[ConvertKeep] = keep
 
 
+# The metadata of a leaf is stored in its node as the value of its keep level, 0 if it was not read
+_METADATA: "list[Optional[LeafMetadata]]" = [ None ] * (max(k.value for k in ConvertKeep) + 1)
+for _keep in ConvertKeep :
+    _METADATA[_keep.value] = LeafMetadata(_keep)
+
+# The extensions of the leaves are stored as indexes in this table, which only grows. The code 0 marks the files that were dropped.
+_EXTENSIONS: "list[str]" = [ '' ]
+_EXTENSION_CODES: "dict[str, int]" = {}
+_extensions_lock = threading.Lock()
+
+# Stride of the columns of a node : (modification, size, end of the name) and (extension code, keep level)
+_NUMBERS = 3
+_FLAGS   = 2
+
+
+def _extension_code(extension: str) -> int :
+    res = _EXTENSION_CODES.get(extension)
+    if res is None :
+        with _extensions_lock :
+            res = _EXTENSION_CODES.get(extension)
+            if res is None :
+                if len(_EXTENSIONS) > 0xff :
+                    raise ValueError(f"Too many extensions in the file trees : {extension}")
+                res = len(_EXTENSIONS)
+                _EXTENSIONS.append(sys.intern(extension))
+                _EXTENSION_CODES[_EXTENSIONS[res]] = res
+    return res
+
+
+# A file of a tree. The leaves returned by a node are views on its columns, created on demand : the same file may be
+# represented by several instances, which are equal and share their metadata. They must not be kept after a file is added to the node.
 class FilesystemLeaf :
+    __slots__ = ('name', 'extension', 'modification', 'size', '_node', '_index', '_metadata')
 
-    def __init__(self, name: str, extension: str, modification: datetime) :
+    # The modification time is expressed in nanoseconds since the epoch, the size (in bytes) is 0 if unknown
+    def __init__(self, name: str, extension: str, modification: int, size: int = 0, node: "Optional[FilesystemNode]" = None, index: int = -1) :
         self.name: Final[str] = name
         self.extension: Final[str] = extension
-        self.modification: Final[datetime] = modification
-        self.metadata: Optional[LeafMetadata] = None
+        self.modification: Final[int] = modification
+        self.size: Final[int] = size
+        self._node = node
+        self._index = index
+        self._metadata: Optional[LeafMetadata] = None
+
+    @property
+    def metadata(self) -> Optional[LeafMetadata] :
+        if self._node is None :
+            return self._metadata
+        return _METADATA[self._node._flags[self._index * _FLAGS + 1]]
+
+    @metadata.setter
+    def metadata(self, metadata: Optional[LeafMetadata]) :
+        if self._node is None :
+            self._metadata = metadata
+        else :
+            self._node._flags[self._index * _FLAGS + 1] = 0 if metadata is None else metadata.keep.value
 
     def filename(self) -> str :
         return f"{self.name}.{self.extension}"
 
+    def __eq__(self, other: object) -> bool :
+        if self._node is None or not isinstance(other, FilesystemLeaf) :
+            return self is other
+        return self._node is other._node and self._index == other._index
 
+    def __hash__(self) -> int :
+        if self._node is None :
+            return id(self)
+        return hash((id(self._node), self._index))
+
+
+# Trees can contain millions of leaves : a node stores its files in columns sorted by name rather than as one object per file.
+# The names are joined in a single string, the modification times, sizes and ends of the names are in an array of integers,
+# the extension codes and keep levels in a byte array. The files that are dropped stay in the columns, with the extension code 0.
+# The files that are added are sorted when the node is read. The sorted list of subfolders is kept until it is modified.
+# The sequences returned by the nodes must not be modified by the callers.
 class FilesystemNode :
+    __slots__ = ('name', 'subfolders', 'file_count', '_names', '_numbers', '_flags', '_dropped', '_added', '_sorted_folders')
 
     def __init__(self, name: str) :
-        self.name = name
+        self.name = sys.intern(name)
         self.subfolders: dict[str, FilesystemNode] = {}
-        self.files: dict[str, FilesystemLeaf] = {}
         self.file_count = 0
-    
+        self._names = ''
+        self._numbers = array('q')
+        self._flags = bytearray()
+        self._dropped = 0
+        # Rows (name, extension code, modification, size, keep level) that are not in the columns yet
+        self._added: "Optional[list[Tuple[str, int, int, int, int]]]" = None
+        self._sorted_folders: "Optional[list[FilesystemNode]]" = None
+
+    # When a name was added several times, the last entry wins
+    def _seal(self) :
+        rows = self._added
+        self._added = None
+        if self._flags :
+            rows = self._rows() + rows
+        rows.sort(key = itemgetter(0))
+        count = len(rows)
+        rows = [ row for i, row in enumerate(rows) if i + 1 == len(rows) or rows[i + 1][0] != row[0] ]
+        self.file_count -= count - len(rows)
+        self._names = '\0'.join(row[0] for row in rows)
+        self._numbers = array('q')
+        self._flags = bytearray()
+        self._dropped = 0
+        end = -1
+        for name, extension, modification, size, keep in rows :
+            end += len(name) + 1
+            self._numbers.extend((modification, size, end))
+            self._flags.extend((extension, keep))
+
+    def _rows(self) -> "list[Tuple[str, int, int, int, int]]" :
+        names = self._names.split('\0')
+        return [
+            (name, self._flags[i * _FLAGS], self._numbers[i * _NUMBERS], self._numbers[i * _NUMBERS + 1], self._flags[i * _FLAGS + 1])
+            for i, name in enumerate(names) if self._flags[i * _FLAGS] != 0
+        ]
+
+    # Sorts the files that were added to the nodes of the tree, which is otherwise done when a node is read
+    def freeze(self) :
+        if self._added is not None :
+            self._seal()
+        for child in self.subfolders.values() :
+            child.freeze()
+
+    def _name(self, i: int) -> str :
+        return self._names[(self._numbers[i * _NUMBERS - 1] + 1 if i > 0 else 0):self._numbers[i * _NUMBERS + 2]]
+
+    def _index(self, name: str) -> int :
+        if self._added is not None :
+            self._seal()
+        low = 0
+        high = len(self._flags) // _FLAGS
+        while low < high :
+            middle = (low + high) // 2
+            if self._name(middle) < name :
+                low = middle + 1
+            else :
+                high = middle
+        if low < len(self._flags) // _FLAGS and self._flags[low * _FLAGS] != 0 and self._name(low) == name :
+            return low
+        return -1
+
+    # The names of all the entries of the node, including the dropped ones, their positions are the indexes of the other accessors
+    def names(self) -> "Sequence[str]" :
+        if self._added is not None :
+            self._seal()
+        return self._names.split('\0') if len(self._flags) > 0 else []
+
+    # True if both nodes contain files with the same names, which is the common case when comparing a source and a destination
+    def same_files(self, other: "FilesystemNode") -> bool :
+        if self._added is not None :
+            self._seal()
+        if other._added is not None :
+            other._seal()
+        return self._dropped == 0 and other._dropped == 0 and self._names == other._names
+
+    # Copies of the columns, for the same entries as `names` : the files that were dropped are 0 in `present`
+    def present(self) -> "Sequence[int]" :
+        return self._flags[0::_FLAGS]
+
+    def modifications(self) -> "Sequence[int]" :
+        return self._numbers[0::_NUMBERS]
+
+    def leaf(self, i: int, name: Optional[str] = None) -> FilesystemLeaf :
+        numbers = self._numbers
+        return FilesystemLeaf(self._name(i) if name is None else name, _EXTENSIONS[self._flags[i * _FLAGS]], numbers[i * _NUMBERS], numbers[i * _NUMBERS + 1], self, i)
+
+    def get_leaf(self, name: str) -> Optional[FilesystemLeaf] :
+        i = self._index(name)
+        return None if i < 0 else self.leaf(i, name)
+
     def list_files(self) -> "Sequence[FilesystemLeaf]" :
-        res = list(self.files.values())
-        res.sort(key = lambda n: n.name)
-        return res
-    
+        return list(self.iter_files())
+
+    def iter_files(self) -> "Iterator[FilesystemLeaf]" :
+        for i, name in enumerate(self.names()) :
+            if self._flags[i * _FLAGS] != 0 :
+                yield self.leaf(i, name)
+
     def list_folders(self) -> "Sequence[FilesystemNode]" :
-        res = list(self.subfolders.values())
-        res.sort(key = lambda n: n.name)
-        return res
+        if self._sorted_folders is None :
+            self._sorted_folders = sorted(self.subfolders.values(), key = lambda n: n.name)
+        return self._sorted_folders
 
     def drop_file(self, name: str) -> bool :
-        if name not in self.files :
+        i = self._index(name)
+        if i < 0 :
             return False
-        del self.files[name]
+        self._flags[i * _FLAGS] = 0
+        self._dropped += 1
         self.file_count -= 1
         return True
-    
+
     def drop_folder(self, name: str) -> bool :
         if name not in self.subfolders :
             return False
         del self.subfolders[name]
+        self._sorted_folders = None
         return True
 
     def _add_subfolder(self, name: str) -> "FilesystemNode" :
         self.file_count += 1
         if name not in self.subfolders :
             res = FilesystemNode(name)
-            self.subfolders[name] = res
+            self.subfolders[res.name] = res
+            self._sorted_folders = None
             return res
         return self.subfolders[name]
-    
-    def _add_file(self, filename: str, extension: str, modification: datetime) :
-        if filename not in self.files :
-            self.file_count += 1
-        self.files[filename] = FilesystemLeaf(filename, extension, modification)
-
-    def push_file(self, path: str, filename: str, extension: str, modification: datetime) :
-        folders = path.split('/')
+
+    def _add_file(self, filename: str, extension: str, modification: int, size: int = 0) :
+        if self._added is None :
+            self._added = []
+        self._added.append((filename, _extension_code(extension), modification, size, 0))
+        self.file_count += 1
+
+    def push_file(self, path: str, filename: str, extension: str, modification: int) :
+        folders = path.split('/') if len(path) > 0 else []
         node = self
         for folder in folders :
             node = node._add_subfolder(folder)
@@ -79,22 +242,21 @@ class FilesystemNode :
         if name in self.subfolders :
             raise Exception('Tried to push a folder that already existed')
         res = FilesystemNode(name)
-        self.subfolders[name] = res
+        self.subfolders[res.name] = res
+        self._sorted_folders = None
         return res
-    
+
     def get_file(self, path: str, filename: str) -> "Optional[FilesystemLeaf]" :
-        folders = path.split('/')
+        folders = path.split('/') if len(path) > 0 else []
         node = self
         for folder in folders :
             if folder not in node.subfolders :
                 return None
             node = node.subfolders[folder]
-        if filename in node.files :
-            return node.files[filename]
-        return None
-    
-    def walk_leaves(self, func: "FilesystemLeaf[[str, str], None]") :
-        for leaf in self.files.values() :
+        return node.get_leaf(filename)
+
+    def walk_leaves(self, func: "Callable[[FilesystemLeaf], None]") :
+        for leaf in self.iter_files() :
             func(leaf)
         for child in self.subfolders.values() :
             child.walk_leaves(func)
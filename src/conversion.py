@@ -1,40 +1,81 @@
 
 import os
 import sys
+import time
+import heapq
+import signal
 import itertools
+import threading
 import traceback
-from datetime import datetime
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 
-from typing import Optional, Tuple, Iterable
+from typing import Callable, Final, Optional, Tuple, Iterable, Iterator, Sequence
 
 from src.options import options as prog_options
 from src.metrics import ConversionMetrics, ExitStatus
+from src.progress import ConversionProgress
 from src.metadata.keep import ConvertKeep
-from src.collections.file_tree import FilesystemNode, FilesystemLeaf
+from src.collections.file_tree import FilesystemNode, FilesystemLeaf, LeafMetadata
 from src.utils.directory_analyser import scan_directory
-from src.utils.print_iterator     import PrintIterator
-from src.metadata.parsing import read_metadata
-from src.patches import Patch, ClearDirPatch, ConvertPatch, CopyPatch, CreateDirPatch, RemovePatch
+from src.utils import file_ops
+from src.metadata.parsing import apply_metadata, read_audio_length, read_cached_raw_keep
+from src.metadata.prefetch import MetadataPrefetcher
+from src.metadata.keep_rules import KeepRules, load_keep_rules
+from src.metadata.fingerprint import content_fingerprint
+from src.metadata.audio_hash import audio_hash
+from src.patches import Patch, BatchConvertPatch, ClearDirPatch, ConvertPatch, CopyPatch, CreateDirPatch, MovePatch, RemoteConvertPatch, RemovePatch, RetagPatch, TouchPatch
+from src.execution import PatchExecutor, SCHEDULES
+from src.storage.manifest import DestinationManifest
+from src.storage.journal import RunJournal
+from src.storage.tag_cache import TagCache
+from src.storage.work_queue import WorkQueue
+from src.moves import MoveCandidates, find_moves
+from src.profiles import OutputProfile
 
 
 INPUT_EXTENSIONS = ['flac', 'm4a', 'mp3']
-OUTPUT_EXTENSION = 'mp3'
 
+# Bounds how far the planning can get ahead of the application of the patches
+PENDING_PATCHES_PER_JOB = 64
 
-def remove_file(leaf: FilesystemLeaf, parent: FilesystemNode, path: str) -> Patch :
-    res = RemovePatch(os.path.join(path, leaf.filename()))
+
+# Outputs that may be moved to the new location of their source are not removed
+def remove_file(leaf: FilesystemLeaf, parent: FilesystemNode, path: str, ctx: "PlanningContext") -> Iterable[Patch] :
+    dest_file = os.path.join(path, leaf.filename())
     parent.drop_file(leaf.name)
-    return res
+    if ctx.moves is not None and ctx.moves.is_reserved(dest_file) :
+        return []
+    return [ RemovePatch(dest_file) ]
 
-def convert_file(leaf: FilesystemLeaf, source_folder: str, dest_folder: str, dest_dt: Optional[datetime] = None) -> Iterable[Patch] :
+# With fingerprints enabled, a source that is newer than its output is only converted again if its content changed,
+# otherwise the output is touched so that the source is not fingerprinted again by the next runs
+def convert_file(leaf: FilesystemLeaf, source_folder: str, dest_folder: str, ctx: "PlanningContext", dest_mtime: Optional[int] = None) -> Iterable[Patch] :
     source_file = os.path.join(source_folder, leaf.filename())
-    if dest_dt != None and dest_dt >= leaf.modification :
+    if dest_mtime != None and dest_mtime >= leaf.modification :
         return []
-    if leaf.extension == OUTPUT_EXTENSION :
-        return [ CopyPatch(source_file, dest_folder, dest_dt is not None) ]
-    dest_file = os.path.join(dest_folder, f"{leaf.name}.{OUTPUT_EXTENSION}")
-    return [ ConvertPatch(source_file, dest_file, dest_dt is not None) ]
+    dest_file = os.path.join(dest_folder, f"{leaf.name}.{ctx.profile.extension}")
+    fingerprint = None
+    if prog_options.fingerprint :
+        fingerprint = content_fingerprint(source_file)
+        if dest_mtime is not None and ctx.manifest is not None and ctx.manifest.lookup(dest_file) == (source_file, fingerprint) :
+            ctx.metrics.unchanged_files.incr(leaf.extension)
+            return [ TouchPatch(source_file, dest_file, fingerprint, leaf.size, leaf.modification) ]
+    if dest_mtime is None and ctx.moves is not None :
+        old_file = ctx.moves.claim(dest_file)
+        if old_file is not None :
+            return [ MovePatch(old_file, dest_file, source_file, fingerprint, leaf.size, leaf.modification) ]
+    if ctx.profile.copies(leaf.extension) :
+        return [ CopyPatch(source_file, dest_folder, dest_mtime is not None, fingerprint, prog_options.link, source_size = leaf.size, source_mtime = leaf.modification) ]
+    # If the audio of the source did not change since it was converted, only its tags were modified
+    if dest_mtime is not None and ctx.manifest is not None and ctx.profile.codec.id3 :
+        recorded_hash = ctx.manifest.audio_hash(dest_file)
+        if recorded_hash is not None :
+            current_hash = timed_call(ctx.metrics, 'metadata', audio_hash, source_file)
+            if current_hash == recorded_hash :
+                return [ RetagPatch(source_file, dest_file, current_hash, fingerprint, leaf.size, leaf.modification) ]
+    # The duration is only read from the headers, it is used to estimate the progress of the run
+    duration = timed_call(ctx.metrics, 'metadata', read_audio_length, source_file)
+    return [ ConvertPatch(source_file, dest_file, ctx.profile, dest_mtime is not None, fingerprint, source_size = leaf.size, source_mtime = leaf.modification, source_duration = duration) ]
 
 
 def add_directory(name: str, node: FilesystemNode, path: str) -> Tuple[FilesystemNode, Optional[Patch]] :
@@ -46,67 +87,220 @@ def add_directory(name: str, node: FilesystemNode, path: str) -> Tuple[Filesyste
     return (res_node, res_patch)
     
 
-def recursive_remove(node: FilesystemNode, parent: FilesystemNode, path: str) -> Iterable[Patch] :
+# The directory is only created if at least one patch is applied in it
+def with_directory(mkdir_patch: Optional[Patch], patches: "Iterator[Patch]") -> "Iterator[Patch]" :
+    first = next(patches, None)
+    if first is None :
+        return
+    if mkdir_patch is not None :
+        yield mkdir_patch
+    yield first
+    yield from patches
+
+
+def recursive_remove(node: FilesystemNode, parent: FilesystemNode, path: str, ctx: "PlanningContext") -> Iterable[Patch] :
     subfolder_path = os.path.join(path, node.name)
     res = itertools.chain(
-        (remove_file(file, node, subfolder_path) for file in list(node.files.values())),
-        itertools.chain.from_iterable(recursive_remove(node, parent, subfolder_path) for node in list(node.subfolders.values())),
-        [ ClearDirPatch(os.path.join(path, node.name)) ]
+        itertools.chain.from_iterable(remove_file(file, node, subfolder_path, ctx) for file in node.list_files()),
+        itertools.chain.from_iterable(recursive_remove(child, node, subfolder_path, ctx) for child in list(node.subfolders.values())),
+        clear_directory(subfolder_path, ctx)
     )
     parent.drop_folder(node.name)
     return res
 
 
+# While outputs may be moved out of a directory, it is only cleared at the end of the plan
+def clear_directory(path: str, ctx: "PlanningContext") -> "Iterator[Patch]" :
+    patch = ClearDirPatch(path)
+    if ctx.moves is not None and len(ctx.moves) > 0 :
+        ctx.moves.defer(patch)
+        return
+    yield patch
+
+
+
+# The trees of the destination of a profile are processed with a context of their own, the metadata of the sources is shared
+class PlanningContext :
+
+    # With `lazy_keep`, the tag of a source whose output is up to date is not read
+    def __init__(self, metrics: ConversionMetrics, profile: OutputProfile, tag_cache: Optional[TagCache] = None, prefetcher: Optional[MetadataPrefetcher] = None, manifest: Optional[DestinationManifest] = None, moves: Optional[MoveCandidates] = None, lazy_keep: bool = False, keep_rules: Optional[KeepRules] = None) :
+        self.metrics = metrics
+        self.profile = profile
+        self.tag_cache = tag_cache
+        self.prefetcher = prefetcher
+        self.manifest = manifest
+        self.moves = moves
+        self.lazy_keep = lazy_keep
+        self.keep_rules = keep_rules
+
+    # The Convert-Keep tag of a file takes precedence over the keep rules, which take precedence over the default value
+    def read_metadata(self, path: str, leaf: FilesystemLeaf) :
+        start = time.perf_counter()
+        default_keep = prog_options.default_keep
+        if self.keep_rules is not None :
+            rule_keep = self.keep_rules.lookup(path, leaf.filename())
+            if rule_keep is not None :
+                self.metrics.keep_rules.incr(rule_keep.name.lower())
+                default_keep = rule_keep
+        if not prog_options.keep_tags :
+            leaf.metadata = LeafMetadata(default_keep)
+            self.metrics.add_phase_time('metadata', time.perf_counter() - start)
+            return
+        if self.prefetcher is None :
+            raw_keep = read_cached_raw_keep(path, leaf, self.tag_cache)
+        else :
+            raw_keep = self.prefetcher.read(path, leaf)
+        apply_metadata(path, leaf, raw_keep, default_keep, self.metrics.convert_tags)
+        self.metrics.evaluated_files += 1
+        self.metrics.add_phase_time('metadata', time.perf_counter() - start)
+
+    # Files under the threshold are dropped from the source tree, as if they did not exist.
+    # The metadata is only read once, even if the directory is processed for several profiles.
+    def keeps(self, path: str, leaf: FilesystemLeaf, node: FilesystemNode) -> bool :
+        if prog_options.keep_treshold == ConvertKeep.lowest() :
+            return True
+        if leaf.metadata is None :
+            self.read_metadata(path, leaf)
+        if leaf.metadata is None or leaf.metadata.keep <= prog_options.keep_treshold :
+            return True
+        if node.drop_file(leaf.name) :
+            self.metrics.ignored_files.incr(leaf.extension)
+            print(f"IGNORE ({leaf.metadata.keep.name.lower()}) {os.path.join(path, leaf.filename())}")
+        return False
+
+
 
 # Leaf
 # - Source exists, destination doesn't => cp/ffmpeg
 # - Source exists, destination exists  => cp/ffmpeg if source strictly older than destination
 # - Destination exists, source doesn't => if can_remove, rm
-
-def process_leaves(src_node: FilesystemNode, dst_node: FilesystemNode, metrics: ConversionMetrics, src_base_path: Optional[str], dst_base_path: Optional[str]) -> "list[Patch]" :
-    res: list[Patch] = []
-
-    if prog_options.keep_treshold != ConvertKeep.lowest() :
-        for leaf in src_node.list_files() :
-            read_metadata(src_base_path, leaf, prog_options.default_keep, metrics.convert_tags)
-            if leaf.metadata is None or leaf.metadata.keep <= prog_options.keep_treshold :
-                continue
-            metrics.ignored_files.incr(leaf.extension)
-            print(f"IGNORE ({leaf.metadata.keep.name.lower()}) {os.path.join(src_base_path, leaf.filename())}")
-            src_node.drop_file(leaf.name)
-    
-    src_file_entries = src_node.list_files()
-    dst_file_entries = dst_node.list_files()
+# A source that is under the threshold is handled as if it did not exist. Its tag is only read if the decision depends on it :
+# an output that is newer than its source was already checked against the same settings (editing a tag updates the modification date).
+
+# A source that exists in the destination tree, and whose output is not known to be up to date
+def update_file(src_entry: FilesystemLeaf, dst_entry: FilesystemLeaf, src_node: FilesystemNode, dst_node: FilesystemNode, ctx: PlanningContext, src_base_path: Optional[str], dst_base_path: Optional[str]) -> "Iterator[Patch]" :
+    if ctx.keeps(src_base_path, src_entry, src_node) :
+        yield from convert_file(src_entry, src_base_path, dst_base_path, ctx, dst_entry.modification)
+    elif prog_options.can_remove :
+        yield from remove_file(dst_entry, dst_node, dst_base_path, ctx)
+
+
+# The files are merged on the columns of the nodes, the leaves are only created for the files that are acted upon
+def process_leaves(src_node: FilesystemNode, dst_node: FilesystemNode, ctx: PlanningContext, src_base_path: Optional[str], dst_base_path: Optional[str]) -> "Iterator[Patch]" :
+    src_modifications = src_node.modifications()
+    dst_modifications = dst_node.modifications()
+
+    # Directories whose files are all in both trees, the common case of an incremental run
+    if src_node.same_files(dst_node) :
+        if ctx.lazy_keep :
+            matched = [ i for i, (src_mtime, dst_mtime) in enumerate(zip(src_modifications, dst_modifications)) if dst_mtime < src_mtime ]
+        else :
+            matched = range(len(src_modifications))
+        for i in matched :
+            yield from update_file(src_node.leaf(i), dst_node.leaf(i), src_node, dst_node, ctx, src_base_path, dst_base_path)
+        return
+
+    src_names = src_node.names()
+    dst_names = dst_node.names()
+    src_present = src_node.present()
+    dst_present = dst_node.present()
     i_src = 0
     i_dst = 0
-
-    while i_src < len(src_file_entries) and i_dst < len(dst_file_entries) :
-        src_entry = src_file_entries[i_src]
-        dst_entry = dst_file_entries[i_dst]
-        if src_entry.name == dst_entry.name :
-            res.extend(convert_file(src_entry, src_base_path, dst_base_path, dst_entry.modification))
+    while i_src < len(src_names) and i_dst < len(dst_names) :
+        if not src_present[i_src] :
+            i_src += 1
+            continue
+        if not dst_present[i_dst] :
+            i_dst += 1
+            continue
+        src_name = src_names[i_src]
+        dst_name = dst_names[i_dst]
+        if src_name == dst_name :
+            if not ctx.lazy_keep or dst_modifications[i_dst] < src_modifications[i_src] :
+                yield from update_file(src_node.leaf(i_src, src_name), dst_node.leaf(i_dst, dst_name), src_node, dst_node, ctx, src_base_path, dst_base_path)
             i_src += 1
             i_dst += 1
-        elif src_entry.name < dst_entry.name : # input file doesn't exist in the destination tree
-            res.extend(convert_file(src_entry, src_base_path, dst_base_path))
+        elif src_name < dst_name : # input file doesn't exist in the destination tree
+            src_entry = src_node.leaf(i_src, src_name)
+            if ctx.keeps(src_base_path, src_entry, src_node) :
+                yield from convert_file(src_entry, src_base_path, dst_base_path, ctx)
             i_src += 1
-        else :                                         # output file doesn't exist in the source tree
+        else :                     # output file doesn't exist in the source tree
             if prog_options.can_remove :
-                res.append(remove_file(dst_entry, dst_node, dst_base_path))
+                yield from remove_file(dst_node.leaf(i_dst, dst_name), dst_node, dst_base_path, ctx)
             i_dst += 1
     
     # remaining files that exist only in the source tree
-    while i_src < len(src_file_entries) :
-        res.extend(convert_file(src_file_entries[i_src], src_base_path, dst_base_path))
+    while i_src < len(src_names) :
+        if src_present[i_src] :
+            src_entry = src_node.leaf(i_src, src_names[i_src])
+            if ctx.keeps(src_base_path, src_entry, src_node) :
+                yield from convert_file(src_entry, src_base_path, dst_base_path, ctx)
         i_src += 1
     
     # remaining files that exist only in the destination tree
     if prog_options.can_remove :
-        while i_dst < len(dst_file_entries) :
-            res.append(remove_file(dst_file_entries[i_dst], dst_node, dst_base_path))
+        while i_dst < len(dst_names) :
+            if dst_present[i_dst] :
+                yield from remove_file(dst_node.leaf(i_dst, dst_names[i_dst]), dst_node, dst_base_path, ctx)
             i_dst += 1
-    
-    return res
+
+
+# In coordinator mode, the conversions are handed to the workers through the queue, the other patches are applied locally
+def distribute_conversions(patches: "Iterator[Patch]", queue: WorkQueue) -> "Iterator[Patch]" :
+    for patch in patches :
+        if isinstance(patch, ConvertPatch) :
+            yield RemoteConvertPatch(queue, [ patch ])
+        elif isinstance(patch, BatchConvertPatch) :
+            yield RemoteConvertPatch(queue, patch.conversions)
+        else :
+            yield patch
+
+
+# The conversions of a directory are grouped by batches of sources, the other patches are not delayed.
+# The conversions of a source for several profiles are always in the same batch, so that it is only decoded once.
+def batch_conversions(patches: "Iterator[Patch]", profiles: int = 1) -> "Iterator[Patch]" :
+    if prog_options.batch_size <= 1 and profiles <= 1 :
+        yield from patches
+        return
+    batch: "list[ConvertPatch]" = []
+    sources: "set[str]" = set()
+    for p in patches :
+        if not isinstance(p, ConvertPatch) :
+            yield p
+            continue
+        if len(batch) > 0 and p.source_file not in sources :
+            if len(sources) >= prog_options.batch_size or os.path.dirname(p.source_file) != os.path.dirname(batch[0].source_file) :
+                yield make_batch(batch)
+                batch = []
+                sources = set()
+        batch.append(p)
+        sources.add(p.source_file)
+    if len(batch) > 0 :
+        yield make_batch(batch)
+
+
+def make_batch(conversions: "list[ConvertPatch]") -> Patch :
+    if len(conversions) == 1 :
+        return conversions[0]
+    return BatchConvertPatch(conversions)
+
+
+# The plans of the profiles are merged in the order of the sources, so that the conversions of a source are close to each other.
+# The patches that are not about a source keep their place relative to the previous ones of their plan.
+def merge_plans(plans: "Sequence[Iterator[Patch]]", order: "dict[str, int]") -> "Iterator[Patch]" :
+    if len(plans) == 1 :
+        return plans[0]
+
+    def positioned(index: int, plan: "Iterator[Patch]") -> "Iterator[Tuple[int, int, int, Patch]]" :
+        position = -1
+        for seq, p in enumerate(plan) :
+            source = p.source()
+            if source is not None :
+                position = max(position, order.get(source, position))
+            yield (position, index, seq, p)
+
+    return (p for _, _, _, p in heapq.merge(*(positioned(i, plan) for i, plan in enumerate(plans))))
 
 
 
@@ -115,9 +309,7 @@ def process_leaves(src_node: FilesystemNode, dst_node: FilesystemNode, metrics:
 # - Source exists, destination exists  => keep going
 # - Destination exists, source doesn't => if can_remove, rm recursively (only files)
 
-def process_nodes(src_node: FilesystemNode, dst_node: FilesystemNode, metrics: ConversionMetrics, src_base_path: Optional[str], dst_base_path: Optional[str]) -> "list[Patch]" :
-    res: list[Patch] = []
-
+def process_nodes(src_node: FilesystemNode, dst_node: FilesystemNode, ctx: PlanningContext, src_base_path: Optional[str], dst_base_path: Optional[str]) -> "Iterator[Patch]" :
     src_folder_entries = src_node.list_folders()
     dst_folder_entries = dst_node.list_folders()
     i_src = 0
@@ -129,7 +321,7 @@ def process_nodes(src_node: FilesystemNode, dst_node: FilesystemNode, metrics: C
         mkdir_patch = None
         if src_entry.name > dst_entry.name : # output folder doesn't exist in the source tree
             if prog_options.can_remove :
-                res.extend(recursive_remove(dst_entry, dst_node, dst_base_path))
+                yield from recursive_remove(dst_entry, dst_node, dst_base_path, ctx)
             i_dst += 1
             continue
         if src_entry.name < dst_entry.name : # input folder doesn't exist in the destination tree
@@ -137,87 +329,408 @@ def process_nodes(src_node: FilesystemNode, dst_node: FilesystemNode, metrics: C
         else :
             i_dst += 1
         i_src += 1
-        patches = process(src_entry, dst_entry, metrics, src_base_path, dst_base_path)
-        if len(patches) > 0 :
-            if mkdir_patch is not None :
-                res.append(mkdir_patch)
-            res.extend(patches)
+        yield from with_directory(mkdir_patch, process(src_entry, dst_entry, ctx, src_base_path, dst_base_path))
     
     # remaining folders that exist only in the source tree
     while i_src < len(src_folder_entries) :
         src_node = src_folder_entries[i_src]
         dst_node, mkdir_patch = add_directory(src_node.name, dst_node, dst_base_path)
-        patches = process(src_node, dst_node, metrics, src_base_path, dst_base_path)
-        if len(patches) > 0 :
-            if mkdir_patch is not None :
-                res.append(mkdir_patch)
-            res.extend(patches)
+        yield from with_directory(mkdir_patch, process(src_node, dst_node, ctx, src_base_path, dst_base_path))
         i_src += 1
     
     # remaining folders that exist only in the destination tree
     if prog_options.can_remove :
         while i_dst < len(dst_folder_entries) :
-            res.extend(recursive_remove(dst_folder_entries[i_dst], dst_node, dst_base_path))
+            yield from recursive_remove(dst_folder_entries[i_dst], dst_node, dst_base_path, ctx)
             i_dst += 1
-    
-    return res
 
 
 
-def process(src_node: FilesystemNode, dst_node: FilesystemNode, metrics: ConversionMetrics, src_base_path: Optional[str] = None, dst_base_path: Optional[str] = None) -> "list[Patch]" :
+def process(src_node: FilesystemNode, dst_node: FilesystemNode, ctx: PlanningContext, src_base_path: Optional[str] = None, dst_base_path: Optional[str] = None) -> "Iterator[Patch]" :
     src_subfolder_path = src_node.name if src_base_path is None else os.path.join(src_base_path, src_node.name)
     dst_subfolder_path = dst_node.name if dst_base_path is None else os.path.join(dst_base_path, dst_node.name)
-    return list(itertools.chain(
-        # Files
-        process_leaves(src_node, dst_node, metrics, src_subfolder_path, dst_subfolder_path),
-        # Subfolders
-        process_nodes(src_node, dst_node, metrics, src_subfolder_path, dst_subfolder_path)
-    ))
+    # Files
+    yield from process_leaves(src_node, dst_node, ctx, src_subfolder_path, dst_subfolder_path)
+    # Subfolders
+    yield from process_nodes(src_node, dst_node, ctx, src_subfolder_path, dst_subfolder_path)
+
+
+# An output profile, with the manifest and the journal of its destination directory
+class Destination :
+
+    def __init__(self, profile: OutputProfile, readonly: bool = False) :
+        self.profile  : Final[OutputProfile] = profile
+        self.manifest : Final[DestinationManifest] = DestinationManifest(profile.dest_dir, readonly = readonly)
+        self.journal  : Final[RunJournal] = RunJournal(profile.dest_dir)
+        # Whether the tags of the sources with an up-to-date output can be left unread
+        self.lazy_keep = False
+
+    def contains(self, path: str) -> bool :
+        return path == self.profile.dest_dir or path.startswith(os.path.join(self.profile.dest_dir, ''))
+
 
+# The destination in which a file is written (the most specific one if destinations are nested)
+def destination_of(destinations: "Sequence[Destination]", path: str) -> Destination :
+    return max((dest for dest in destinations if dest.contains(path)), key = lambda dest: len(dest.profile.dest_dir))
 
-def compute_patches(source_dir: str, dest_dir: str, metrics: ConversionMetrics) -> "list[Patch]" :
-    source_files = scan_directory(source_dir, INPUT_EXTENSIONS)
-    print('Found', source_files.file_count, 'input files')
-    source_files.walk_leaves(lambda node: metrics.input_files.incr(node.extension))
 
-    dest_files = scan_directory(dest_dir, [OUTPUT_EXTENSION])
-    print('Found', dest_files.file_count, 'files in the destination directory')
-    dest_files.walk_leaves(lambda node: metrics.output_files.incr(node.extension))
+def scan_destination(dest: Destination) -> FilesystemNode :
+    if not prog_options.verify_destination and dest.manifest.is_trusted() :
+        print('Reading destination files from the manifest of', dest.profile.dest_dir)
+        return dest.manifest.build_tree()
+    # The directory of a new profile is only created when the patches are applied
+    if not os.path.isdir(dest.profile.dest_dir) :
+        return FilesystemNode(dest.profile.dest_dir)
+    res = scan_directory(dest.profile.dest_dir, [dest.profile.extension])
+    if not prog_options.dry_run :
+        dest.manifest.reset(res)
+    return res
+
+
+# Source files in the order in which `process` reads their metadata
+def walk_source_leaves(node: FilesystemNode, base_path: Optional[str] = None) -> "Iterable[Tuple[str, FilesystemLeaf]]" :
+    path = node.name if base_path is None else os.path.join(base_path, node.name)
+    for leaf in node.list_files() :
+        yield (path, leaf)
+    for child in node.list_folders() :
+        yield from walk_source_leaves(child, path)
+
+
+# Source files whose metadata is read when the tags of the sources with an up-to-date output are not, in the same order.
+# The corresponding nodes of the destinations are None where a directory does not exist.
+def walk_stale_leaves(node: FilesystemNode, dest_nodes: "Sequence[Optional[FilesystemNode]]", base_path: Optional[str] = None) -> "Iterable[Tuple[str, FilesystemLeaf]]" :
+    path = node.name if base_path is None else os.path.join(base_path, node.name)
+    for leaf in node.list_files() :
+        for dest_node in dest_nodes :
+            output = None if dest_node is None else dest_node.get_leaf(leaf.name)
+            if output is None or output.modification < leaf.modification :
+                yield (path, leaf)
+                break
+    for child in node.list_folders() :
+        yield from walk_stale_leaves(child, [ None if dest_node is None else dest_node.subfolders.get(child.name) for dest_node in dest_nodes ], path)
+
+
+def timed_call(metrics: ConversionMetrics, phase: str, func: Callable, *args) :
+    start = time.perf_counter()
+    try :
+        return func(*args)
+    finally :
+        metrics.add_phase_time(phase, time.perf_counter() - start)
+
+
+# Only counts the time spent computing the elements
+def timed_iter(metrics: ConversionMetrics, phase: str, it: "Iterator[Patch]") -> "Iterator[Patch]" :
+    while True :
+        start = time.perf_counter()
+        p = next(it, None)
+        metrics.add_phase_time(phase, time.perf_counter() - start)
+        if p is None :
+            return
+        yield p
+
+
+# Returns the trees of a subpath in each destination, along with the (shared) tree of the subpath in the source
+def scan_subtree(source_dir: str, destinations: "Sequence[Destination]", subpath: str, metrics: ConversionMetrics) -> "list[Tuple[FilesystemNode, FilesystemNode]]" :
+    source_path = os.path.normpath(os.path.join(source_dir, subpath))
+    dest_paths = [ os.path.normpath(os.path.join(dest.profile.dest_dir, subpath)) for dest in destinations ]
+    with ThreadPoolExecutor(max_workers = 1 + len(destinations)) as pool :
+        source_scan = pool.submit(timed_call, metrics, 'scan_source', scan_directory, source_path, INPUT_EXTENSIONS) if os.path.isdir(source_path) else None
+        dest_scans = [
+            pool.submit(timed_call, metrics, 'scan_destination', scan_directory, dest_path, [dest.profile.extension]) if os.path.isdir(dest_path) else None
+            for dest, dest_path in zip(destinations, dest_paths)
+        ]
+        source_files = FilesystemNode(source_path) if source_scan is None else source_scan.result()
+        return [
+            (source_files, FilesystemNode(dest_path) if dest_scan is None else dest_scan.result())
+            for dest_path, dest_scan in zip(dest_paths, dest_scans)
+        ]
+
+
+# Processes a subtree whose root may not exist in the source or destination directory
+def process_subtree(src_node: FilesystemNode, dst_node: FilesystemNode, ctx: PlanningContext) -> "Iterator[Patch]" :
+    res = process(src_node, dst_node, ctx)
+    if prog_options.can_remove and not os.path.isdir(src_node.name) and os.path.isdir(dst_node.name) :
+        res = itertools.chain(res, clear_directory(dst_node.name, ctx))
+    missing_dir = dst_node.name
+    while not os.path.isdir(missing_dir) :
+        res = with_directory(CreateDirPatch(missing_dir), iter(res))
+        missing_dir = os.path.dirname(missing_dir)
+    return res
+
+
+def plan_destination(trees: "Sequence[Tuple[FilesystemNode, FilesystemNode]]", ctx: PlanningContext) -> "Iterator[Patch]" :
+    for source_files, dest_files in trees :
+        yield from timed_iter(ctx.metrics, 'diff', process_subtree(source_files, dest_files, ctx))
+    if ctx.moves is not None :
+        yield from ctx.moves.finish()
+
+
+# Removes the subpaths that are contained in other ones, so that no subtree is processed twice.
+# Returns None if one of them is the whole tree.
+def collapse_subpaths(subpaths: "Iterable[str]") -> Optional[Sequence[str]] :
+    res: "list[str]" = []
+    # Sorting by components puts every path right after the paths that contain it
+    for path in sorted(set(subpaths), key = lambda p: p.split('/')) :
+        if path == '' :
+            return None
+        if len(res) > 0 and path.startswith(res[-1] + '/') :
+            continue
+        res.append(path)
+    return res
+
+
+# Patches are generated lazily, as the trees are processed.
+# If subpaths (relative to the source and destination directories) are given, only these subtrees are processed.
+# The source is scanned once and diffed against the destination of each profile.
+def compute_patches(source_dir: str, destinations: "Sequence[Destination]", metrics: ConversionMetrics, subpaths: Optional[Sequence[str]] = None, keep_rules: Optional[KeepRules] = None) -> "Iterator[Patch]" :
+    # The trees of each destination, with the corresponding source trees
+    if subpaths is None :
+        with ThreadPoolExecutor(max_workers = 1 + len(destinations)) as pool :
+            source_scan = pool.submit(timed_call, metrics, 'scan_source', scan_directory, source_dir, INPUT_EXTENSIONS)
+            dest_scans = [ pool.submit(timed_call, metrics, 'scan_destination', scan_destination, dest) for dest in destinations ]
+            trees = [ [ (source_scan.result(), dest_scan.result()) ] for dest_scan in dest_scans ]
+    else :
+        subtrees = [ scan_subtree(source_dir, destinations, subpath, metrics) for subpath in subpaths ]
+        trees = [ [ pairs[i] for pairs in subtrees ] for i in range(len(destinations)) ]
+    source_trees = [ source_files for source_files, _ in trees[0] ]
+
+    print('Found', sum(source_files.file_count for source_files in source_trees), 'input files')
+    for source_files in source_trees :
+        source_files.walk_leaves(lambda node: metrics.input_files.incr(node.extension))
+
+    print('Found', sum(dest_files.file_count for dest_trees in trees for _, dest_files in dest_trees), 'files in the destination directory' if len(destinations) == 1 else 'files in the destination directories')
+    for dest_trees in trees :
+        for _, dest_files in dest_trees :
+            dest_files.walk_leaves(lambda node: metrics.output_files.incr(node.extension))
 
     print('Processing trees and metadata')
-    return process(source_files, dest_files, metrics)
+    tag_cache = None
+    prefetcher = None
+    if prog_options.keep_treshold != ConvertKeep.lowest() and prog_options.keep_tags :
+        if prog_options.tag_cache_path is not None :
+            tag_cache = TagCache(prog_options.tag_cache_path, metrics.tag_cache)
+        if prog_options.metadata_workers > 1 :
+            if all(dest.lazy_keep for dest in destinations) :
+                source_leaves = itertools.chain.from_iterable(
+                    walk_stale_leaves(source_files, [ dest_trees[i][1] for dest_trees in trees ]) for i, source_files in enumerate(source_trees)
+                )
+            else :
+                source_leaves = itertools.chain.from_iterable(walk_source_leaves(source_files) for source_files in source_trees)
+            prefetcher = MetadataPrefetcher(source_leaves, prog_options.metadata_workers, metrics.prefetch, tag_cache)
+    complete = False
+    try :
+        plans = []
+        for dest, dest_trees in zip(destinations, trees) :
+            moves = None
+            if prog_options.can_remove :
+                moves = timed_call(metrics, 'diff', find_moves, dest_trees, dest.manifest, dest.profile.extension)
+                if len(moves) > 0 :
+                    print('Found', len(moves), 'files that may have been moved in', dest.profile.dest_dir)
+            ctx = PlanningContext(metrics, dest.profile, tag_cache, prefetcher, dest.manifest, moves, dest.lazy_keep, keep_rules)
+            plans.append(plan_destination(dest_trees, ctx))
+        order = {}
+        if len(plans) > 1 :
+            source_leaves = itertools.chain.from_iterable(walk_source_leaves(source_files) for source_files in source_trees)
+            order = { os.path.join(path, leaf.filename()): i for i, (path, leaf) in enumerate(source_leaves) }
+        yield from batch_conversions(merge_plans(plans, order), len(plans))
+        complete = True
+    finally :
+        # The diff includes the time spent reading metadata
+        metrics.add_phase_time('diff', -metrics.phases['metadata'])
+        if prefetcher is not None :
+            prefetcher.close()
+        # Only the runs over the whole library can tell which files were removed
+        if tag_cache is not None :
+            tag_cache.close(full_run = complete and subpaths is None)
 
 
 def dry_run(patches: "list[Patch]", metrics: ConversionMetrics) -> ConversionMetrics :
     print('\n --- Patch summary --- ')
     for p in patches :
-        print(p.describe())
-        metrics.patches.incr(p.get_name())
+        for part in p.parts() :
+            print(part.describe())
+            metrics.patches.incr(part.get_name())
     return metrics.end()
 
 
-def conversion(source_dir: str, dest_dir: str) -> ConversionMetrics :
+# An output may be removed by someone else once it was written, which must not make its patch fail
+def output_size(filepath: str) -> Optional[int] :
+    try :
+        return os.path.getsize(filepath)
+    except OSError :
+        return None
+
+
+def apply_patches(patches: "Iterable[Patch]", metrics: ConversionMetrics, destinations: "Sequence[Destination]") :
+    lock = threading.Lock()
+    progress = ConversionProgress() if os.isatty(sys.stdout.fileno()) else None
+
+    def on_start(p: Patch) :
+        for target in p.targets() :
+            destination_of(destinations, target).journal.start([ target ])
+        if progress is None :
+            with lock :
+                for part in p.parts() :
+                    print(part.describe())
+
+    # The parts of a patch may write to several destinations, each one updates the manifest of its own.
+    # The time taken by a batch is shared evenly between its parts. Only the parts that were applied are recorded.
+    def on_done(p: Patch, duration: float) :
+        parts = p.completed_parts()
+        for part in parts :
+            part.update_manifest(destination_of(destinations, part.targets()[0]).manifest)
+        for part in parts :
+            for target in part.targets() :
+                destination_of(destinations, target).journal.done([ target ])
+        part_duration = duration / len(p.parts())
+        for part in parts :
+            metrics.observe_patch(part.get_name(), part_duration)
+            if isinstance(part, ConvertPatch) :
+                metrics.observe_conversion(part.source_size, output_size(part.dest_file), read_audio_length(part.dest_file), part_duration)
+            elif isinstance(part, CopyPatch) :
+                metrics.observe_copy(part.source_size)
+        with lock :
+            for part in parts :
+                metrics.patches.incr(part.get_name())
+        if progress is not None :
+            progress.done(p)
+
+    start = time.perf_counter()
+    priority = SCHEDULES[prog_options.schedule]
+    max_pending: Optional[int] = (prog_options.jobs + prog_options.io_jobs) * PENDING_PATCHES_PER_JOB
+    if priority is not None :
+        # Every patch has to be known before the first one is picked according to the policy
+        patches = list(patches)
+        max_pending = None
+    executor = None
+    try :
+        for dest in destinations :
+            dest.journal.open(dest.manifest.is_trusted())
+            dest.manifest.begin_run()
+        executor = PatchExecutor(prog_options.jobs, on_start, on_done, max_pending = max_pending, priority = priority, io_jobs = prog_options.io_jobs)
+        with executor :
+            for p in patches :
+                if progress is not None :
+                    progress.planned(p)
+                executor.submit(p)
+        for dest in destinations :
+            dest.manifest.end_run()
+            dest.journal.discard()
+    finally :
+        for dest in destinations :
+            dest.journal.close()
+        metrics.add_phase_time('apply', time.perf_counter() - start)
+        if executor is not None :
+            metrics.observe_lanes(executor.lane_usage())
+        file_ops.directories.close()
+        if progress is not None :
+            progress.close()
+
+
+# Raised in the main thread when the script receives SIGTERM, the patches being applied are completed but no other patch is started
+class Interrupted(BaseException) :
+    pass
+
+
+def interrupt(signum: int, frame) :
+    # A second signal must not interrupt the completion of the running patches
+    signal.signal(signum, signal.SIG_IGN)
+    raise Interrupted(signal.Signals(signum).name)
+
+
+# Removes the temporary files left by the patches that an interrupted run did not complete, and updates the manifest
+def recover_interrupted_run(dest: Destination) :
+    state = dest.journal.recover()
+    if state is None :
+        return
+    print('Recovering from an interrupted run in', dest.profile.dest_dir)
+    for path in state.unfinished :
+        file_ops.remove_part(os.path.join(dest.profile.dest_dir, path))
+    dest.manifest.recover(state.unfinished, state.trusted)
+
+
+def keep_settings_repr(keep_rules: Optional[KeepRules]) -> str :
+    return ':'.join([
+        prog_options.keep_treshold.name.lower(),
+        prog_options.default_keep.name.lower(),
+        'tags' if prog_options.keep_tags else 'no-tags',
+        'no-rules' if keep_rules is None else keep_rules.digest
+    ])
+
+
+# Once every source of the library was checked against the settings (and the outputs of the ignored ones removed),
+# the tags of the sources whose output is up to date won't have to be read by the next runs
+def record_keep_settings(destinations: "Sequence[Destination]", keep_settings: str, subpaths: Optional[Sequence[str]], metrics: ConversionMetrics) :
+    if subpaths is not None or not prog_options.can_remove or metrics.status != ExitStatus.SUCCESS :
+        return
+    for dest in destinations :
+        if not dest.lazy_keep :
+            dest.manifest.set_keep_settings(keep_settings)
+
+
+def conversion(source_dir: str, dest_dir: str, subpaths: Optional[Sequence[str]] = None) -> ConversionMetrics :
     metrics = ConversionMetrics()
-
+    profiles = [ OutputProfile(dest_dir) ] + prog_options.profiles
+    # The manifests that were opened are closed even if the setup fails
+    destinations: "list[Destination]" = []
+    patches: "Optional[Iterable[Patch]]" = None
+
+    previous_handler = None
+    if threading.current_thread() is threading.main_thread() :
+        previous_handler = signal.signal(signal.SIGTERM, interrupt)
     try:
-        patches = compute_patches(source_dir, dest_dir, metrics)
-
-        if len(patches) == 0 :
-            print("Nothing to do")
-            return metrics.end()
+        if not prog_options.dry_run :
+            for profile in profiles[1:] :
+                os.makedirs(profile.dest_dir, exist_ok = True)
+        for profile in profiles :
+            destinations.append(Destination(profile, readonly = prog_options.dry_run))
+        # The outputs written with other settings may not match the tags of their sources
+        keep_rules = load_keep_rules(source_dir)
+        keep_settings = keep_settings_repr(keep_rules)
+        for dest in destinations :
+            dest.lazy_keep = dest.manifest.keep_settings() == keep_settings
+            if not dest.lazy_keep and not prog_options.dry_run :
+                dest.manifest.set_keep_settings(None)
+        patches = compute_patches(source_dir, destinations, metrics, subpaths, keep_rules)
+        if prog_options.coordinator is not None and not prog_options.dry_run :
+            queue = WorkQueue(prog_options.coordinator)
+            queue.reset()
+            patches = distribute_conversions(patches, queue)
+
+        if not prog_options.dry_run :
+            for dest in destinations :
+                recover_interrupted_run(dest)
 
         if prog_options.dry_run :
+            # The whole plan is computed first, so that the logs of the planning are not mixed with the summary
+            patches = list(patches)
+            if len(patches) == 0 :
+                print("Nothing to do")
+                return metrics.end()
             return dry_run(patches, metrics)
-        
-        print('Applying patches')
 
-        patches_it = tqdm(patches, desc='Progress', unit='patch') if os.isatty(sys.stdout.fileno()) else PrintIterator(patches, lambda x: print(x.describe()))
+        first = next(patches, None)
+        if first is None :
+            print("Nothing to do")
+            record_keep_settings(destinations, keep_settings, subpaths, metrics)
+            return metrics.end()
         
-        for p in patches_it :
-            p.apply()
-            metrics.patches.incr(p.get_name())
+        print('Applying patches')
+        apply_patches(itertools.chain([ first ], patches), metrics, destinations)
+        record_keep_settings(destinations, keep_settings, subpaths, metrics)
+    except Interrupted as e :
+        print(f"Interrupted by {e}, the run will resume from this point next time", file = sys.stderr)
+        metrics.status = ExitStatus.ERROR
+        metrics.interrupted = True
     except Exception :
         metrics.status = ExitStatus.ERROR
         traceback.print_exc(file = sys.stderr)
+    finally :
+        if previous_handler is not None :
+            signal.signal(signal.SIGTERM, previous_handler)
+        if patches is not None and not isinstance(patches, list) :
+            patches.close()
+        for dest in destinations :
+            dest.manifest.close()
     
     return metrics.end()
@@ -0,0 +1,2 @@
+from .executor import PatchExecutor
+from .schedule import SCHEDULES, SchedulePriority
@@ -0,0 +1,227 @@
+
+import os
+import time
+import heapq
+import threading
+
+from src.patches import Patch, BatchConvertPatch, ClearDirPatch, ConvertPatch, CreateDirPatch, PartialPatchError, RemoteConvertPatch
+
+from typing import Callable, Optional, Tuple
+
+
+ENCODE_LANE = 'encode'
+IO_LANE     = 'io'
+
+
+# Conversions keep the CPUs busy (or wait for a worker of the queue), the other patches mostly wait for the storage
+def patch_lane(patch: Patch) -> str :
+    if isinstance(patch, (ConvertPatch, BatchConvertPatch, RemoteConvertPatch)) :
+        return ENCODE_LANE
+    return IO_LANE
+
+
+class _Task :
+    __slots__ = ('patch', 'seq', 'priority', 'lane', 'parents', 'waiting', 'dependents', 'done')
+
+    def __init__(self, patch: Patch, seq: int, priority: float, lane: "_Lane") :
+        self.patch = patch
+        self.seq = seq
+        self.priority = priority
+        self.lane = lane
+        self.parents: list[str] = []
+        self.waiting = 0
+        self.dependents: "list[_Task]" = []
+        self.done = False
+
+
+# A pool of threads with its own queue of ready patches
+class _Lane :
+
+    def __init__(self, name: str, jobs: int) :
+        self.name = name
+        self.jobs = max(1, jobs)
+        self.ready: "list[Tuple[float, int, _Task]]" = []
+        # Time spent applying patches, summed over the threads of the lane
+        self.busy_sec = 0.0
+
+
+# Applies patches on pools of worker threads while preserving the ordering the planner relies on.
+# Patches must be submitted in planning order, dependencies are derived from their targets :
+# - a patch writing in a directory waits for the `CreateDirPatch` of this directory (if any)
+# - a `ClearDirPatch` waits for every patch previously submitted in the directory it clears
+# With `io_jobs`, the conversions and the other patches are applied by separate pools (lanes), which drain concurrently :
+# quick copies and removals don't wait behind long conversions, and the storage works while the CPUs encode.
+# The dependencies between patches hold across the lanes.
+class PatchExecutor :
+
+    # `on_done` receives the patch and the time it took to apply it, in seconds.
+    # It also receives the patches that raised a `PartialPatchError`, before the error stops the executor, for the parts that were applied.
+    # `submit` blocks while there are `max_pending` patches that were submitted but not applied yet.
+    # Among the patches of a lane that are ready, those with the lowest `priority` are applied first (by default, the first submitted).
+    def __init__(self, jobs: int, on_start: Optional[Callable[[Patch], None]] = None, on_done: Optional[Callable[[Patch, float], None]] = None, max_pending: Optional[int] = None, priority: Optional[Callable[[Patch], float]] = None, io_jobs: Optional[int] = None) :
+        self._lanes: dict[str, _Lane] = { ENCODE_LANE: _Lane(ENCODE_LANE, jobs) }
+        if io_jobs is not None :
+            self._lanes[IO_LANE] = _Lane(IO_LANE, io_jobs)
+        self._max_pending = max_pending
+        self._priority = priority
+        self._on_start = on_start
+        self._on_done = on_done
+        self._lock = threading.Condition()
+        self._mkdirs: dict[str, _Task] = {}
+        self._children: "dict[str, set[_Task]]" = {}
+        self._seq = 0
+        self._pending = 0
+        self._running = 0
+        self._alive = 0
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._workers: list[threading.Thread] = []
+
+    def __enter__(self) -> "PatchExecutor" :
+        for lane in self._lanes.values() :
+            for i in range(lane.jobs) :
+                worker = threading.Thread(target=self._work, args=(lane,), name=f"{lane.name}-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+                with self._lock :
+                    self._alive += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb) :
+        if exc_value is not None :
+            self._fail(exc_value)
+            self._wait()
+        else :
+            self.join()
+
+    def submit(self, patch: Patch) :
+        with self._lock :
+            while self._error is None and self._max_pending is not None and self._pending >= self._max_pending :
+                self._lock.wait()
+            if self._error is not None :
+                return
+            task = _Task(patch, self._seq, 0.0 if self._priority is None else self._priority(patch), self._lanes.get(patch_lane(patch), self._lanes[ENCODE_LANE]))
+            self._seq += 1
+            deps: "set[_Task]" = set()
+            for target in patch.targets() :
+                parent = os.path.dirname(target)
+                if parent in self._mkdirs :
+                    deps.add(self._mkdirs[parent])
+                if isinstance(patch, ClearDirPatch) :
+                    deps.update(self._children.get(target, ()))
+                if parent not in task.parents :
+                    task.parents.append(parent)
+                    self._children.setdefault(parent, set()).add(task)
+            if isinstance(patch, CreateDirPatch) :
+                self._mkdirs[patch.directory_path] = task
+            for dep in deps :
+                dep.dependents.append(task)
+            task.waiting = len(deps)
+            self._pending += 1
+            if task.waiting == 0 :
+                self._push_ready(task)
+
+    # The number of threads of each lane and the time they spent applying patches, once the executor is closed
+    def lane_usage(self) -> "dict[str, Tuple[int, float]]" :
+        with self._lock :
+            return { lane.name: (lane.jobs, lane.busy_sec) for lane in self._lanes.values() }
+
+    def join(self) :
+        try :
+            self._wait()
+        except BaseException as e :
+            # Interrupted while waiting (e.g. by a signal handler), the patches being applied are still completed
+            self._fail(e)
+            self._wait()
+            raise
+        if self._error is not None :
+            raise self._error
+
+    # Waits on the condition rather than joining the threads, since `Thread.join` cannot be safely retried after being interrupted
+    def _wait(self) :
+        with self._lock :
+            self._closed = True
+            self._lock.notify_all()
+            while self._alive > 0 :
+                self._lock.wait()
+        self._workers.clear()
+
+    def _fail(self, error: BaseException) :
+        with self._lock :
+            if self._error is None :
+                self._error = error
+            self._lock.notify_all()
+
+    # The threads of all the lanes wait on the same condition
+    def _push_ready(self, task: _Task) :
+        heapq.heappush(task.lane.ready, (task.priority, task.seq, task))
+        self._lock.notify_all()
+
+    def _finished(self) -> bool :
+        if self._error is not None :
+            return self._running == 0
+        return self._closed and self._pending == 0
+
+    def _next_task(self, lane: _Lane) -> Optional[_Task] :
+        with self._lock :
+            while True :
+                if self._finished() :
+                    self._lock.notify_all()
+                    return None
+                if self._error is None and len(lane.ready) > 0 :
+                    _, _, task = heapq.heappop(lane.ready)
+                    self._running += 1
+                    return task
+                self._lock.wait()
+
+    def _complete(self, task: _Task, error: Optional[BaseException], busy_sec: float) :
+        with self._lock :
+            task.lane.busy_sec += busy_sec
+            self._running -= 1
+            self._pending -= 1
+            if error is not None :
+                if self._error is None :
+                    self._error = error
+                self._lock.notify_all()
+                return
+            task.done = True
+            self._lock.notify_all()
+            for parent in task.parents :
+                siblings = self._children[parent]
+                siblings.discard(task)
+                if len(siblings) == 0 :
+                    del self._children[parent]
+            if isinstance(task.patch, CreateDirPatch) :
+                del self._mkdirs[task.patch.directory_path]
+            for dependent in task.dependents :
+                dependent.waiting -= 1
+                if dependent.waiting == 0 :
+                    self._push_ready(dependent)
+            if self._finished() :
+                self._lock.notify_all()
+
+    def _work(self, lane: _Lane) :
+        while True :
+            task = self._next_task(lane)
+            if task is None :
+                with self._lock :
+                    self._alive -= 1
+                    self._lock.notify_all()
+                return
+            error = None
+            busy_start = time.perf_counter()
+            try :
+                if self._on_start is not None :
+                    self._on_start(task.patch)
+                start = time.perf_counter()
+                try :
+                    task.patch.apply()
+                except PartialPatchError :
+                    if self._on_done is not None :
+                        self._on_done(task.patch, time.perf_counter() - start)
+                    raise
+                if self._on_done is not None :
+                    self._on_done(task.patch, time.perf_counter() - start)
+            except BaseException as e :
+                error = e
+            self._complete(task, error, time.perf_counter() - busy_start)
@@ -0,0 +1,43 @@
+
+from src.patches import Patch, BatchConvertPatch, ConvertPatch, CopyPatch, RemoteConvertPatch
+
+from typing import Callable, Optional, Sequence
+
+
+# A priority is computed for each patch when it is submitted, the ready patches with the lowest priority are applied first.
+# Patches with the same priority are applied in the order of the plan.
+SchedulePriority = Callable[[Patch], float]
+
+# Patches that do not write a file (directories, removals) are cheap and may unlock others, they are applied first
+STRUCTURAL_PRIORITY = float('-inf')
+
+
+def _file_patches(patch: Patch) -> "Sequence[Patch]" :
+    if isinstance(patch, (BatchConvertPatch, RemoteConvertPatch)) :
+        return patch.conversions
+    if isinstance(patch, (ConvertPatch, CopyPatch)) :
+        return [ patch ]
+    return []
+
+
+# The size of the source is used as an estimation of the duration of the conversion
+def longest_first(patch: Patch) -> float :
+    files = _file_patches(patch)
+    if len(files) == 0 :
+        return STRUCTURAL_PRIORITY
+    return -sum(p.source_size for p in files)
+
+
+def newest_first(patch: Patch) -> float :
+    files = _file_patches(patch)
+    if len(files) == 0 :
+        return STRUCTURAL_PRIORITY
+    return -max(p.source_mtime for p in files)
+
+
+# `tree` keeps the order of the plan, which is the order of the source tree
+SCHEDULES: "dict[str, Optional[SchedulePriority]]" = {
+    'tree':    None,
+    'longest': longest_first,
+    'newest':  newest_first
+}
@@ -0,0 +1,141 @@
+
+import os
+import hashlib
+
+from typing import BinaryIO, Optional, Tuple
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _syncsafe(data: bytes) -> int :
+    res = 0
+    for b in data :
+        res = res * 128 + (b & 0x7f)
+    return res
+
+
+def hash_range(f: BinaryIO, start: int, end: int, digest) :
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0 :
+        chunk = f.read(min(HASH_CHUNK_SIZE, remaining))
+        if len(chunk) == 0 :
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+
+
+# The MD5 of the decoded audio is stored by the encoder in the STREAMINFO block, which is always the first one
+def _flac_hash(f: BinaryIO) -> Optional[str] :
+    header = f.read(42)
+    if len(header) < 42 or header[0:4] != b'fLaC' or header[4] & 0x7f != 0 :
+        return None
+    md5 = header[26:42]
+    if md5 == bytes(16) :
+        return None
+    return f"flac-md5:{md5.hex()}"
+
+
+# Offset of the first audio frame, after the chain of metadata blocks, or None if the file could not be parsed
+def flac_metadata_end(f: BinaryIO) -> Optional[int] :
+    f.seek(0)
+    if f.read(4) != b'fLaC' :
+        return None
+    offset = 4
+    while True :
+        f.seek(offset)
+        header = f.read(4)
+        if len(header) < 4 :
+            return None
+        offset += 4 + int.from_bytes(header[1:4], 'big')
+        if header[0] & 0x80 :
+            return offset
+
+
+# The audio frames are located between the ID3v2 tag (at the beginning) and the ID3v1 and APEv2 tags (at the end)
+def mp3_audio_range(f: BinaryIO, size: int) -> Tuple[int, int] :
+    f.seek(0)
+    start = 0
+    header = f.read(10)
+    if len(header) == 10 and header[0:3] == b'ID3' :
+        start = 10 + _syncsafe(header[6:10])
+        if header[5] & 0x10 :
+            start += 10
+    end = size
+    if end - start >= 128 :
+        f.seek(end - 128)
+        if f.read(3) == b'TAG' :
+            end -= 128
+    if end - start >= 32 :
+        f.seek(end - 32)
+        footer = f.read(32)
+        if footer[0:8] == b'APETAGEX' :
+            end -= int.from_bytes(footer[12:16], 'little')
+            if int.from_bytes(footer[20:24], 'little') & 0x80000000 :
+                end -= 32
+    return (start, end)
+
+
+def _mp3_hash(f: BinaryIO, size: int) -> Optional[str] :
+    start, end = mp3_audio_range(f, size)
+    if end <= start :
+        return None
+    digest = hashlib.blake2b(digest_size = 16)
+    hash_range(f, start, end, digest)
+    return f"mp3:{digest.hexdigest()}"
+
+
+# Returns the (type, start of the content, end) of the top-level atoms of an MP4 file, or None if the file could not be parsed
+def mp4_atoms(f: BinaryIO, size: int) -> "Optional[list[Tuple[bytes, int, int]]]" :
+    res = []
+    offset = 0
+    while offset + 8 <= size :
+        f.seek(offset)
+        header = f.read(8)
+        atom_size = int.from_bytes(header[0:4], 'big')
+        header_size = 8
+        if atom_size == 1 :
+            atom_size = int.from_bytes(f.read(8), 'big')
+            header_size = 16
+        elif atom_size == 0 :
+            atom_size = size - offset
+        if atom_size < header_size :
+            return None
+        res.append((header[4:8], offset + header_size, min(offset + atom_size, size)))
+        offset += atom_size
+    return res
+
+
+# The audio samples are stored in the `mdat` atoms, the tags are in the `moov` atom
+def _mp4_hash(f: BinaryIO, size: int) -> Optional[str] :
+    atoms = mp4_atoms(f, size)
+    if atoms is None :
+        return None
+    digest = hashlib.blake2b(digest_size = 16)
+    found = False
+    for atom_type, start, end in atoms :
+        if atom_type == b'mdat' :
+            hash_range(f, start, end, digest)
+            found = True
+    if not found :
+        return None
+    return f"mp4:{digest.hexdigest()}"
+
+
+# Identity of the audio content of a file, which does not change when its tags are edited.
+# Returns None if the format is not supported or if the file could not be parsed.
+def audio_hash(filepath: str) -> Optional[str] :
+    extension = os.path.splitext(filepath)[1][1:].lower()
+    try :
+        with open(filepath, 'rb') as f :
+            size = os.fstat(f.fileno()).st_size
+            if extension == 'flac' :
+                return _flac_hash(f)
+            if extension == 'mp3' :
+                return _mp3_hash(f, size)
+            if extension == 'm4a' :
+                return _mp4_hash(f, size)
+    except OSError :
+        return None
+    return None
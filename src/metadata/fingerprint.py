@@ -0,0 +1,49 @@
+import os
+import hashlib
+
+from src.metadata.audio_hash import flac_metadata_end, hash_range, mp3_audio_range, mp4_atoms
+
+from typing import BinaryIO, Optional, Tuple
+
+
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+
+# Ranges of the file that contain its tags : the chain of metadata blocks of FLAC files, the ID3v2 tag and the ID3v1 and APEv2 tags
+# of MP3 files, every atom but the audio samples of MP4 files. Returns None if the format is not supported or the file could not be parsed.
+def _metadata_ranges(f: BinaryIO, extension: str, size: int) -> "Optional[list[Tuple[int, int]]]" :
+    if extension == 'flac' :
+        end = flac_metadata_end(f)
+        return None if end is None else [ (0, min(end, size)) ]
+    if extension == 'mp3' :
+        start, end = mp3_audio_range(f, size)
+        return None if end <= start else [ (0, start), (end, size) ]
+    if extension == 'm4a' :
+        atoms = mp4_atoms(f, size)
+        return None if atoms is None else [ (start, end) for atom_type, start, end in atoms if atom_type != b'mdat' ]
+    return None
+
+
+# Cheap identity of the content of a file : its size, a hash of all its tags and of its first, middle and last blocks.
+# Taggers often rewrite the tags in place, in the padding, so the tags are hashed entirely rather than sampled.
+# The files that could not be parsed are hashed entirely.
+def content_fingerprint(filepath: str) -> str :
+    digest = hashlib.blake2b(digest_size = 16)
+    extension = os.path.splitext(filepath)[1][1:].lower()
+    with open(filepath, 'rb') as f :
+        size = os.fstat(f.fileno()).st_size
+        ranges = _metadata_ranges(f, extension, size)
+        if ranges is None :
+            hash_range(f, 0, size, digest)
+            return f"{size}:{digest.hexdigest()}"
+        for start, end in ranges :
+            digest.update(f"{start}-{end}:".encode())
+            hash_range(f, start, end, digest)
+        offsets = [ 0 ]
+        if size > FINGERPRINT_BLOCK_SIZE :
+            offsets.append((size - FINGERPRINT_BLOCK_SIZE) // 2)
+            offsets.append(size - FINGERPRINT_BLOCK_SIZE)
+        for offset in offsets :
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+    return f"{size}:{digest.hexdigest()}"
@@ -0,0 +1,104 @@
+
+import os
+import re
+import fnmatch
+import hashlib
+
+from src.metadata.keep import ConvertKeep
+
+from typing import Final, Optional, Tuple
+
+
+KEEP_RULES_FILENAME = '.mp3conv-keep'
+
+
+# Keep levels given to the files of the source library by a file at its root, for the libraries whose files can't be tagged.
+# Each line gives a level and a path or a pattern, relative to the source directory, for example :
+#   skip    Artist/Album/03 - Interlude.flac
+#   archive Artist/Live Album
+#   bonus   */Instrumentals/*
+#   archive *(Remix)*
+# A path applies to a file or to everything under a directory, the deepest one wins.
+# A pattern (a line with a `*` or a `?`) is matched against the whole path of the files, the last one that matches wins.
+# Paths take precedence over patterns.
+class KeepRules :
+
+    def __init__(self, root: str, paths: "dict[str, ConvertKeep]", patterns: "list[Tuple[str, ConvertKeep]]", digest: str) :
+        self.root   : Final[str] = root
+        self.digest : Final[str] = digest
+        self._paths : Final[dict[str, ConvertKeep]] = paths
+        self._prefix: Final[str] = os.path.join(root, '')
+        self._levels: Final[list[ConvertKeep]] = [ level for _, level in reversed(patterns) ]
+        # A single expression for all the patterns, its first alternative is the last pattern.
+        # Brackets are common in the names of albums, they are not character classes.
+        self._regex = None
+        # Most files match no pattern : a pattern can only match if the path contains one of its literal parts
+        self._prefilter = None
+        if len(patterns) > 0 :
+            self._regex = re.compile('|'.join(
+                f"(?P<r{i}>{fnmatch.translate(pattern.replace('[', '[[]'))})" for i, (pattern, _) in enumerate(reversed(patterns))
+            ))
+            literals = [ max(re.split(r'[*?]', pattern), key = len) for pattern, _ in patterns ]
+            if all(len(literal) > 0 for literal in literals) :
+                self._prefilter = re.compile('|'.join(re.escape(literal) for literal in sorted(set(literals))))
+        # The files of a directory are looked up one after the other, the level given by a path to the directory is kept
+        self._last_dir: Optional[Tuple[str, str, Optional[ConvertKeep]]] = None
+
+    def _directory(self, path: str) -> "Tuple[str, str, Optional[ConvertKeep]]" :
+        if self._last_dir is None or self._last_dir[0] != path :
+            if path.startswith(self._prefix) :
+                relative = path[len(self._prefix):]
+            else :
+                relative = os.path.relpath(path, self.root)
+                relative = '' if relative == '.' else relative
+            level = None
+            current = relative
+            while level is None :
+                level = self._paths.get(current)
+                if current == '' :
+                    break
+                current = os.path.dirname(current)
+            self._last_dir = (path, relative, level)
+        return self._last_dir
+
+    # `path` is the directory of the file, under the root
+    def lookup(self, path: str, filename: str) -> Optional[ConvertKeep] :
+        _, relative_dir, level = self._directory(path)
+        relpath = filename if relative_dir == '' else f"{relative_dir}/{filename}"
+        level = self._paths.get(relpath, level)
+        if level is not None :
+            return level
+        if self._regex is None or (self._prefilter is not None and self._prefilter.search(relpath) is None) :
+            return None
+        match = self._regex.match(relpath)
+        if match is None :
+            return None
+        return self._levels[int(match.lastgroup[1:])]
+
+
+# Returns None if the source directory has no keep rules, the lines that can't be parsed are ignored
+def load_keep_rules(source_dir: str) -> Optional[KeepRules] :
+    filepath = os.path.join(source_dir, KEEP_RULES_FILENAME)
+    try :
+        with open(filepath, 'rb') as f :
+            content = f.read()
+    except FileNotFoundError :
+        return None
+    paths: "dict[str, ConvertKeep]" = {}
+    patterns: "list[Tuple[str, ConvertKeep]]" = []
+    for number, line in enumerate(content.decode('utf-8').splitlines(), start = 1) :
+        line = line.strip()
+        if line == '' or line.startswith('#') :
+            continue
+        parts = line.split(None, 1)
+        level = ConvertKeep.parse(parts[0])
+        if len(parts) < 2 or level is None :
+            print(f"Bad keep rule : {line} ({filepath}:{number})")
+            continue
+        target = parts[1].strip()
+        if '*' in target or '?' in target :
+            patterns.append((target, level))
+        else :
+            target = os.path.normpath(target)
+            paths['' if target == '.' else target] = level
+    return KeepRules(source_dir, paths, patterns, hashlib.blake2b(content, digest_size = 8).hexdigest())
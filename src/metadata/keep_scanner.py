@@ -0,0 +1,211 @@
+
+import os
+import struct
+
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+
+# Raised when a file uses a feature that the scanner does not handle, the tags have to be read with mutagen
+class UnsupportedLayout(Exception) :
+    pass
+
+
+MP3_KEEP_DESCRIPTION = 'Convert-Keep'
+FLAC_KEEP_KEY        = b'convert-keep'
+MP4_KEEP_MEAN        = b'com.apple.iTunes'
+MP4_KEEP_NAME        = b'Convert-Keep'
+
+FLAC_VORBIS_COMMENT = 4
+
+# Encodings of the ID3v2 text frames, with the size of their null terminator
+ID3_ENCODINGS = {
+    0: ('latin-1',   1),
+    1: ('utf-16',    2),
+    2: ('utf-16-be', 2),
+    3: ('utf-8',     1)
+}
+
+
+def _read_exactly(f: BinaryIO, size: int) -> bytes :
+    data = f.read(size)
+    if len(data) != size :
+        raise UnsupportedLayout('truncated file')
+    return data
+
+
+def _syncsafe(data: bytes) -> int :
+    res = 0
+    for b in data :
+        if b & 0x80 :
+            raise UnsupportedLayout('bad syncsafe integer')
+        res = res * 128 + b
+    return res
+
+
+def _split_text(data: bytes, terminator_size: int) -> "list[bytes]" :
+    terminator = bytes(terminator_size)
+    res = []
+    start = 0
+    i = 0
+    while i + terminator_size <= len(data) :
+        if data[i:i+terminator_size] == terminator :
+            res.append(data[start:i])
+            start = i + terminator_size
+        i += terminator_size
+    res.append(data[start:])
+    return res
+
+
+# Only the ID3v2 tag at the beginning of the file is read, frame by frame, until the TXXX frame is found
+def _scan_mp3(f: BinaryIO) -> Optional[str] :
+    header = f.read(10)
+    if len(header) < 10 or header[0:3] != b'ID3' :
+        return None
+    version = header[3]
+    flags = header[5]
+    # Unsynchronisation and extended headers are rare, ID3v2.2 frames have other identifiers
+    if version not in (3, 4) or flags & 0xc0 :
+        raise UnsupportedLayout(f"ID3v2.{version} tag with flags {flags:#x}")
+    remaining = _syncsafe(header[6:10])
+    while remaining >= 10 :
+        frame_header = _read_exactly(f, 10)
+        remaining -= 10
+        frame_id = frame_header[0:4]
+        if frame_id[0] == 0 :
+            return None # padding
+        frame_size = _syncsafe(frame_header[4:8]) if version == 4 else struct.unpack('>I', frame_header[4:8])[0]
+        if frame_size > remaining :
+            raise UnsupportedLayout('frame larger than the tag')
+        remaining -= frame_size
+        if frame_id != b'TXXX' :
+            f.seek(frame_size, os.SEEK_CUR)
+            continue
+        # Compressed, encrypted or unsynchronised frames (and grouping identifiers in ID3v2.3)
+        if frame_header[9] & (0x4f if version == 4 else 0xe0) :
+            raise UnsupportedLayout('encoded frame')
+        data = _read_exactly(f, frame_size)
+        if len(data) == 0 or data[0] not in ID3_ENCODINGS :
+            raise UnsupportedLayout('bad text encoding')
+        encoding, terminator_size = ID3_ENCODINGS[data[0]]
+        parts = _split_text(data[1:], terminator_size)
+        if len(parts) < 2 :
+            continue
+        description = parts[0].decode(encoding, errors = 'replace')
+        if description != MP3_KEEP_DESCRIPTION :
+            continue
+        # UTF-16 values have their own BOM, the first value is the one mutagen would return
+        return parts[1].decode(encoding, errors = 'replace')
+    return None
+
+
+# The metadata blocks are skipped until the VORBIS_COMMENT block (the pictures are never read)
+def _scan_flac(f: BinaryIO) -> Optional[str] :
+    if f.read(4) != b'fLaC' :
+        raise UnsupportedLayout('FLAC stream with a leading tag')
+    last = False
+    while not last :
+        header = _read_exactly(f, 4)
+        last = bool(header[0] & 0x80)
+        block_type = header[0] & 0x7f
+        block_size = int.from_bytes(header[1:4], 'big')
+        if block_type != FLAC_VORBIS_COMMENT :
+            f.seek(block_size, os.SEEK_CUR)
+            continue
+        data = _read_exactly(f, block_size)
+        vendor_size = struct.unpack_from('<I', data, 0)[0]
+        offset = 4 + vendor_size
+        count = struct.unpack_from('<I', data, offset)[0]
+        offset += 4
+        for _ in range(count) :
+            size = struct.unpack_from('<I', data, offset)[0]
+            offset += 4
+            comment = data[offset:offset+size]
+            offset += size
+            key, sep, value = comment.partition(b'=')
+            if sep and key.lower() == FLAC_KEEP_KEY :
+                return value.decode('utf-8', errors = 'replace')
+        return None
+    return None
+
+
+# Yields the type, position of the content and size of the content of the atoms in a range of the file
+def _atoms(f: BinaryIO, start: int, end: int) -> "Iterator[Tuple[bytes, int, int]]" :
+    offset = start
+    while offset + 8 <= end :
+        f.seek(offset)
+        header = _read_exactly(f, 8)
+        size = struct.unpack('>I', header[0:4])[0]
+        header_size = 8
+        if size == 1 :
+            size = struct.unpack('>Q', _read_exactly(f, 8))[0]
+            header_size = 16
+        elif size == 0 :
+            size = end - offset
+        if size < header_size or offset + size > end :
+            raise UnsupportedLayout('bad atom size')
+        yield (header[4:8], offset + header_size, size - header_size)
+        offset += size
+
+
+def _find_atom(f: BinaryIO, kind: bytes, start: int, end: int) -> "Optional[Tuple[int, int]]" :
+    for atom_kind, content, size in _atoms(f, start, end) :
+        if atom_kind == kind :
+            return (content, size)
+    return None
+
+
+# Only the atoms on the path to the tags are visited, the audio data and the sample tables are skipped
+def _scan_mpeg4(f: BinaryIO) -> Optional[bytes] :
+    end = f.seek(0, os.SEEK_END)
+    position = (0, end)
+    for kind in (b'moov', b'udta', b'meta') :
+        found = _find_atom(f, kind, position[0], position[0] + position[1])
+        if found is None :
+            return None
+        position = found
+    # The `meta` atom is a full atom (with a version and flags) in MP4 files, but not in QuickTime files
+    content, size = position
+    f.seek(content + 4)
+    if size < 12 or f.read(4) == b'hdlr' :
+        raise UnsupportedLayout('QuickTime meta atom')
+    ilst = _find_atom(f, b'ilst', content + 4, content + size)
+    if ilst is None :
+        return None
+    for kind, item, item_size in _atoms(f, ilst[0], ilst[0] + ilst[1]) :
+        if kind != b'----' :
+            continue
+        mean = None
+        name = None
+        for child, child_content, child_size in _atoms(f, item, item + item_size) :
+            # `mean` and `name` are full atoms, `data` has a type and a locale before the value
+            if child == b'mean' or child == b'name' :
+                f.seek(child_content + 4)
+                value = _read_exactly(f, child_size - 4)
+                if child == b'mean' :
+                    mean = value
+                else :
+                    name = value
+            elif child == b'data' and mean == MP4_KEEP_MEAN and name == MP4_KEEP_NAME :
+                f.seek(child_content + 8)
+                return _read_exactly(f, child_size - 8)
+    return None
+
+
+SCANNERS = {
+    'mp3':  _scan_mp3,
+    'flac': _scan_flac,
+    'm4a':  _scan_mpeg4
+}
+
+
+# Reads the raw Convert-Keep value of a file without building a mutagen object.
+# Raises UnsupportedLayout if the file has to be parsed with mutagen.
+def scan_keep(filepath: str, extension: str) -> "Optional[str|bytes]" :
+    scanner = SCANNERS.get(extension)
+    if scanner is None :
+        raise UnsupportedLayout(f"unsupported extension : {extension}")
+    with open(filepath, 'rb') as f :
+        try :
+            return scanner(f)
+        except struct.error as e :
+            raise UnsupportedLayout(str(e))
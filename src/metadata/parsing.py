@@ -1,6 +1,7 @@
 
 import os
 import functools
+import mutagen
 from mutagen.mp3 import MP3
 from mutagen.mp4 import MP4
 from mutagen.flac import FLAC
@@ -8,6 +9,8 @@ from io import BytesIO
 
 from src.metrics import MetadataCounters
 from src.collections.file_tree import ConvertKeep, LeafMetadata, FilesystemLeaf
+from src.storage.tag_cache import TagCache
+from src.metadata.keep_scanner import UnsupportedLayout, scan_keep
 
 from typing import Optional
 
@@ -70,28 +73,73 @@ def metadata_flac(path: str, leaf: FilesystemLeaf) :
     return res
 
 
-def read_metadata(path: str, leaf: FilesystemLeaf, default_keep: ConvertKeep, metrics: MetadataCounters) :
+METADATA_READERS = {
+    'mp3':  metadata_mp3,
+    'flac': metadata_flac,
+    'm4a':  metadata_mpeg4,
+}
+
+
+# Uses mutagen, which handles every layout of the tags but parses much more than needed
+def read_raw_keep_mutagen(path: str, leaf: FilesystemLeaf) -> "Optional[str|bytes]" :
     raw = RawMetadata()
-    if leaf.extension == 'mp3' :
-        raw = metadata_mp3(path, leaf)
-    elif leaf.extension == 'flac' :
-        raw = metadata_flac(path, leaf)
-    elif leaf.extension == 'm4a' :
-        raw = metadata_mpeg4(path, leaf)
-    else :
+    if leaf.extension in METADATA_READERS :
+        raw = METADATA_READERS[leaf.extension](path, leaf)
+    return raw.keep
+
+
+# Only performs I/O, can be called from any thread.
+# The tag is read by the scanner, which only reads the parts of the file leading to it, unless the file is unusual.
+def read_raw_keep(path: str, leaf: FilesystemLeaf) -> Optional[str] :
+    keep: "Optional[str|bytes]"
+    try :
+        keep = scan_keep(os.path.join(path, leaf.filename()), leaf.extension)
+    except UnsupportedLayout :
+        keep = read_raw_keep_mutagen(path, leaf)
+    
+    if isinstance(keep, bytes) :
+        return keep.decode('utf-8').strip()
+    return keep
+
+
+def read_cached_raw_keep(path: str, leaf: FilesystemLeaf, cache: Optional[TagCache]) -> Optional[str] :
+    if cache is None :
+        return read_raw_keep(path, leaf)
+    stat = os.stat(os.path.join(path, leaf.filename()))
+    found, keep = cache.lookup(stat)
+    if found :
+        return keep
+    keep = read_raw_keep(path, leaf)
+    cache.store(stat, keep)
+    return keep
+
+
+def read_metadata(path: str, leaf: FilesystemLeaf, default_keep: ConvertKeep, metrics: MetadataCounters, cache: Optional[TagCache] = None) :
+    apply_metadata(path, leaf, read_cached_raw_keep(path, leaf, cache), default_keep, metrics)
+
+
+def apply_metadata(path: str, leaf: FilesystemLeaf, raw_keep: Optional[str], default_keep: ConvertKeep, metrics: MetadataCounters) :
+    if leaf.extension not in METADATA_READERS :
         print(f"Unsupported extension for metadata parsing : {leaf.extension}")
     
     keep: ConvertKeep = default_keep
-    if raw.keep is not None :
-        if isinstance(raw.keep, bytes) :
-            raw.keep = raw.keep.decode('utf-8')
-            raw.keep = raw.keep.strip()
-        parsed_keep = ConvertKeep.parse(raw.keep)
+    if raw_keep is not None :
+        parsed_keep = ConvertKeep.parse(raw_keep)
         if parsed_keep is None :
-            print(f"Bad Convert-Keep tag : {raw.keep}, ({os.path.join(path, leaf.filename())})")
+            print(f"Bad Convert-Keep tag : {raw_keep}, ({os.path.join(path, leaf.filename())})")
         else :
             keep = parsed_keep
             metrics.incr(keep.name.lower())
     
     leaf.metadata = LeafMetadata(keep)
 
+
+# Returns None if the file could not be parsed
+def read_audio_length(filepath: str) -> Optional[float] :
+    try :
+        audio = mutagen.File(filepath)
+    except Exception :
+        return None
+    if audio is None or audio.info is None :
+        return None
+    return audio.info.length
@@ -0,0 +1,69 @@
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from src.collections.file_tree import FilesystemLeaf
+from src.metadata.parsing import read_cached_raw_keep
+from src.metrics import MetadataCounters
+from src.storage.tag_cache import TagCache
+
+from typing import Final, Iterable, Iterator, Optional, Tuple
+
+
+# Reads the raw Convert-Keep values of the source files in a pool of threads, ahead of the tree diff.
+# The entries must be given in the order in which the diff will request them. The window is counted from the last entry
+# that was read : at most `window` entries past it are read in advance. The diff may skip entries (e.g. when the tag
+# of a source is not needed for any of the destinations), the values that were not read are dropped once the reads
+# are `window` entries past them. The files that are not in the window are read synchronously.
+class MetadataPrefetcher :
+
+    # The counters count the reads served by the pool ('hit') and the synchronous reads ('fallback')
+    def __init__(self, entries: "Iterable[Tuple[str, FilesystemLeaf]]", workers: int, counters: MetadataCounters, cache: Optional[TagCache] = None, window: Optional[int] = None) :
+        self.window: Final[int] = workers * 16 if window is None else window
+        self._entries: "Iterator[Tuple[str, FilesystemLeaf]]" = iter(entries)
+        self._cache = cache
+        self._counters = counters
+        self._pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'metadata')
+        self._futures: "dict[FilesystemLeaf, Tuple[int, Future]]" = {}
+        self._order: "deque[Tuple[int, FilesystemLeaf]]" = deque()
+        self._submitted = 0
+        self._position = 0
+        self._fill()
+
+    def _fill(self) :
+        while self._submitted - self._position < self.window :
+            entry = next(self._entries, None)
+            if entry is None :
+                return
+            path, leaf = entry
+            self._futures[leaf] = (self._submitted, self._pool.submit(read_cached_raw_keep, path, leaf, self._cache))
+            self._order.append((self._submitted, leaf))
+            self._submitted += 1
+
+    # The entries that are far behind the last read are not expected anymore
+    def _drop_passed(self) :
+        while len(self._order) > 0 and self._order[0][0] < self._position - self.window :
+            _, leaf = self._order.popleft()
+            entry = self._futures.pop(leaf, None)
+            if entry is not None :
+                entry[1].cancel()
+
+    # Returns the raw Convert-Keep value of the file, exceptions raised by the reader are raised here
+    def read(self, path: str, leaf: FilesystemLeaf) -> Optional[str] :
+        entry = self._futures.pop(leaf, None)
+        if entry is None :
+            self._counters.incr('fallback')
+            return read_cached_raw_keep(path, leaf, self._cache)
+        self._counters.incr('hit')
+        position, future = entry
+        self._position = max(self._position, position + 1)
+        self._drop_passed()
+        self._fill()
+        return future.result()
+
+    def close(self) :
+        for _, future in self._futures.values() :
+            future.cancel()
+        self._futures.clear()
+        self._order.clear()
+        self._pool.shutdown(wait = True)
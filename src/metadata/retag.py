@@ -0,0 +1,86 @@
+
+import os
+from mutagen.easyid3 import EasyID3
+from mutagen.easymp4 import EasyMP4
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3, ID3NoHeaderError, APIC, COMM, TXXX, PictureType
+from mutagen.mp4 import MP4, MP4Cover
+
+from typing import Iterable, Tuple
+
+
+MP4_FREEFORM_PREFIX = '----:com.apple.iTunes:'
+
+# Tags that ffmpeg writes to comment frames rather than to user-defined text frames
+COMMENT_KEYS = { 'comment', 'description' }
+
+
+def _group(pairs: "Iterable[Tuple[str, str]]") -> "dict[str, Tuple[str, list[str]]]" :
+    res: "dict[str, Tuple[str, list[str]]]" = {}
+    for key, value in pairs :
+        res.setdefault(key.lower(), (key, []))[1].append(value)
+    return res
+
+
+def _read_flac(source_file: str) -> "Tuple[list[Tuple[str, list[str]]], list[APIC]]" :
+    flac = FLAC(source_file)
+    tags = list(_group(flac.tags or []).values())
+    pictures = [ APIC(encoding=3, mime=p.mime, type=p.type, desc=p.desc, data=p.data) for p in flac.pictures ]
+    return tags, pictures
+
+
+def _read_mpeg4(source_file: str) -> "Tuple[list[Tuple[str, list[str]]], list[APIC]]" :
+    easy = EasyMP4(source_file)
+    tags = [ (key, list(values)) for key, values in (easy.tags or {}).items() ]
+    raw = MP4(source_file).tags or {}
+    for key, values in raw.items() :
+        if key.startswith(MP4_FREEFORM_PREFIX) :
+            tags.append((key[len(MP4_FREEFORM_PREFIX):], [ bytes(v).decode(errors='replace') for v in values ]))
+    pictures = []
+    for cover in raw.get('covr', []) :
+        mime = 'image/png' if cover.imageformat == MP4Cover.FORMAT_PNG else 'image/jpeg'
+        pictures.append(APIC(encoding=3, mime=mime, type=PictureType.COVER_FRONT, desc='', data=bytes(cover)))
+    return tags, pictures
+
+
+TAG_READERS = {
+    'flac': _read_flac,
+    'm4a':  _read_mpeg4
+}
+
+
+# Replaces the ID3 tags of an MP3 file with the tags and cover of its source, mapped like ffmpeg does during a conversion
+def copy_tags(source_file: str, dest_file: str) :
+    extension = os.path.splitext(source_file)[1][1:].lower()
+    reader = TAG_READERS.get(extension)
+    if reader is None :
+        raise ValueError(f"Cannot read the tags of {source_file}")
+    tags, pictures = reader(source_file)
+
+    # The frame naming the encoder describes the audio stream of the output, not its source
+    try :
+        encoder = ID3(dest_file).getall('TSSE')
+    except ID3NoHeaderError :
+        encoder = []
+
+    easy = EasyID3()
+    frames = []
+    for key, values in tags :
+        if key.lower() in COMMENT_KEYS :
+            frames.append(COMM(encoding=3, lang='eng', desc='', text=values))
+            continue
+        if key.lower() in EasyID3.valid_keys :
+            try :
+                easy[key.lower()] = values
+                continue
+            except ValueError :
+                pass
+        frames.append(TXXX(encoding=3, desc=key, text=values))
+    easy.save(dest_file)
+
+    if len(frames) + len(pictures) + len(encoder) == 0 :
+        return
+    id3 = ID3(dest_file)
+    for frame in frames + pictures + encoder :
+        id3.add(frame)
+    id3.save()
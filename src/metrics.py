@@ -2,9 +2,11 @@
 
 import sys
 import time
+import bisect
+import threading
 from enum import Enum
 
-from typing import Final, TextIO
+from typing import Final, Optional, Sequence, TextIO
 
 
 class ExitStatus(Enum) :
@@ -31,22 +33,119 @@ class MetadataCounters :
 			self.counters[mdata] = 1
 
 
+class Histogram :
+
+	def __init__(self, buckets: Sequence[float]) :
+		self.buckets: Final[Sequence[float]] = buckets
+		self.counts = [ 0 for _ in buckets ]
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value: float) :
+		i = bisect.bisect_left(self.buckets, value)
+		if i < len(self.counts) :
+			self.counts[i] += 1
+		self.sum += value
+		self.count += 1
+
+	def print(self, name: str, labels: str, out: TextIO) :
+		prefix = '' if len(labels) == 0 else f"{labels},"
+		cumulated = 0
+		for bound, count in zip(self.buckets, self.counts) :
+			cumulated += count
+			print(f"{name}_bucket{{{prefix}le=\"{bound}\"}} {cumulated}",                                       file = out)
+		print(f"{name}_bucket{{{prefix}le=\"+Inf\"}} {self.count}",                                           file = out)
+		suffix = '' if len(labels) == 0 else f"{{{labels}}}"
+		print(f"{name}_sum{suffix} {self.sum}",                                                            file = out)
+		print(f"{name}_count{suffix} {self.count}",                                                        file = out)
+
+
+DURATION_BUCKETS = [ 0.001, 0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600 ]
+BYTES_BUCKETS    = [ 100_000, 1_000_000, 5_000_000, 10_000_000, 25_000_000, 50_000_000, 100_000_000, 250_000_000, 500_000_000, 1_000_000_000 ]
+REALTIME_BUCKETS = [ 1, 2, 5, 10, 20, 50, 100, 200, 500 ]
+
+
 class ConversionMetrics :
 
 	def __init__(self) :
 		self.status = ExitStatus.SUCCESS
+		self.interrupted = False
 		self.start_time_sec: Final[float] = time.time()
 		self.input_files = MetadataCounters('mp3', 'flac', 'm4a')
 		self.output_files = MetadataCounters('mp3')
 		self.convert_tags = MetadataCounters('always', 'bonus', 'archive', 'skip')
-		self.patches = MetadataCounters('convert', 'copy', 'mkdir', 'rmdir', 'remove')
+		self.tag_cache = MetadataCounters('hit', 'miss')
+		# Tags read ahead by the pool of the prefetcher, and tags it did not have which were read synchronously
+		self.prefetch = MetadataCounters('hit', 'fallback')
+		self.keep_rules = MetadataCounters('always', 'bonus', 'archive', 'skip')
+		self.patches = MetadataCounters('convert', 'copy', 'move', 'retag', 'touch', 'mkdir', 'rmdir', 'remove')
 		self.ignored_files = MetadataCounters('mp3', 'flac', 'm4a')
+		# Source files whose Convert-Keep tag was read during the run
+		self.evaluated_files = 0
+		self.unchanged_files = MetadataCounters('mp3', 'flac', 'm4a')
+		self.phases: dict[str, float] = { phase: 0.0 for phase in ['scan_source', 'scan_destination', 'metadata', 'diff', 'apply'] }
+		self.patch_durations: dict[str, Histogram] = { patch_type: Histogram(DURATION_BUCKETS) for patch_type in self.patches.counters }
+		self.convert_input_bytes = Histogram(BYTES_BUCKETS)
+		self.convert_output_bytes = Histogram(BYTES_BUCKETS)
+		self.convert_realtime_factor = Histogram(REALTIME_BUCKETS)
+		self.processed_bytes = 0
+		self.processed_audio_sec = 0.0
+		# Number of threads and time spent applying patches of each lane of the executor
+		self.lanes: dict[str, tuple[int, float]] = {}
+		self._lock = threading.Lock()
 		self._end_time_sec = 0.0
 	
 	def end(self) -> "ConversionMetrics" :
 		self._end_time_sec = time.time()
 		return self
 	
+	def add_phase_time(self, phase: str, duration_sec: float) :
+		with self._lock :
+			self.phases[phase] = self.phases.get(phase, 0.0) + duration_sec
+
+	def observe_patch(self, patch_type: str, duration_sec: float) :
+		with self._lock :
+			if patch_type not in self.patch_durations :
+				self.patch_durations[patch_type] = Histogram(DURATION_BUCKETS)
+			self.patch_durations[patch_type].observe(duration_sec)
+
+	# The audio length is unknown if it could not be read from the output
+	def observe_conversion(self, input_bytes: int, output_bytes: Optional[int], audio_length_sec: Optional[float], duration_sec: float) :
+		with self._lock :
+			self.convert_input_bytes.observe(input_bytes)
+			if output_bytes is not None :
+				self.convert_output_bytes.observe(output_bytes)
+			self.processed_bytes += input_bytes
+			if audio_length_sec is not None :
+				self.processed_audio_sec += audio_length_sec
+			if audio_length_sec is not None and duration_sec > 0 :
+				self.convert_realtime_factor.observe(audio_length_sec / duration_sec)
+
+	def observe_lanes(self, usage: "dict[str, tuple[int, float]]") :
+		with self._lock :
+			for lane, (jobs, busy_sec) in usage.items() :
+				previous_jobs, previous_busy_sec = self.lanes.get(lane, (0, 0.0))
+				self.lanes[lane] = (max(jobs, previous_jobs), previous_busy_sec + busy_sec)
+
+	# Part of the time spent applying the patches during which the threads of a lane were busy
+	def get_occupancy(self, lane: str) -> float :
+		jobs, busy_sec = self.lanes[lane]
+		duration = self.phases['apply']
+		if duration <= 0 :
+			return 0.0
+		return busy_sec / (jobs * duration)
+
+	def observe_copy(self, size_bytes: int) :
+		with self._lock :
+			self.processed_bytes += size_bytes
+
+	# Throughputs are computed over the time spent applying the patches
+	def get_throughput(self) -> "tuple[float, float]" :
+		duration = self.phases['apply']
+		if duration <= 0 :
+			return (0.0, 0.0)
+		return (self.processed_bytes / duration, self.processed_audio_sec / duration)
+
 	def get_duration(self) -> float :
 		return self._end_time_sec - self.start_time_sec
 	
@@ -56,15 +155,35 @@ class ConversionMetrics :
 			if count > 0 :
 				print(f"  - {count} {ext}")
 		print(f"Found {sum(self.output_files.counters.values())} files in destination directory")
-		print(f"Performed {self.patches.counters['convert']} conversions, {self.patches.counters['copy']} copies and {self.patches.counters['remove']} removals in {int(self.get_duration() * 1000)}ms")
+		print(f"Performed {self.patches.counters['convert']} conversions, {self.patches.counters['copy']} copies, {self.patches.counters['move']} moves, {self.patches.counters['retag']} retags and {self.patches.counters['remove']} removals in {int(self.get_duration() * 1000)}ms")
 		print(f"Ignored {sum(self.ignored_files.counters.values())} files")
-		print('Done' if self.status == ExitStatus.SUCCESS else 'Error')
+		if self.evaluated_files > 0 :
+			prefetched = ''
+			if sum(self.prefetch.counters.values()) > 0 :
+				prefetched = f" ({self.prefetch.counters['hit']} read ahead, {self.prefetch.counters['fallback']} synchronously)"
+			print(f"Evaluated the Convert-Keep tag of {self.evaluated_files} files{prefetched}")
+		if self.processed_bytes > 0 :
+			bytes_rate, audio_rate = self.get_throughput()
+			print(f"Read {self.processed_bytes / 1_048_576:.1f} MiB ({bytes_rate / 1_048_576:.1f} MiB/s) and encoded {int(self.processed_audio_sec)}s of audio ({audio_rate:.1f}s/s)")
+		if len(self.lanes) > 0 :
+			print('Occupancy of the workers :', ', '.join(f"{int(self.get_occupancy(lane) * 100)}% of {jobs} {lane} jobs" for lane, (jobs, _) in self.lanes.items()))
+		unchanged = sum(self.unchanged_files.counters.values())
+		if unchanged > 0 :
+			print(f"Skipped {unchanged} files whose content did not change")
+		if self.interrupted :
+			print('Interrupted')
+		else :
+			print('Done' if self.status == ExitStatus.SUCCESS else 'Error')
 
 	def print(self, out: TextIO = sys.stdout) :
 		print('# TYPE mp3conv_exit_status counter',                                                          file = out)
 		print('# HELP mp3conv_exit_status Status of the last run (0=OK, 1=ERROR).',                          file = out)
 		print(f"mp3conv_exit_status {self.status.value}",                                                    file = out)
 
+		print('# TYPE mp3conv_interrupted gauge',                                                            file = out)
+		print('# HELP mp3conv_interrupted Whether the last run was interrupted before its end (0=NO, 1=YES).', file = out)
+		print(f"mp3conv_interrupted {int(self.interrupted)}",                                                 file = out)
+
 		print('# TYPE mp3conv_start_time counter',                                                           file = out)
 		print('# HELP mp3conv_start_time Timestamp of the last run of the converter.',                       file = out)
 		print(f"mp3conv_start_time {self.start_time_sec}",                                                   file = out)
@@ -73,6 +192,26 @@ class ConversionMetrics :
 		print('# HELP mp3conv_run_time Total run time of the conversion.',                                   file = out)
 		print(f"mp3conv_run_time {self.get_duration()}",                                                     file = out)
 
+		print('# TYPE mp3conv_phase_duration_seconds gauge',                                                 file = out)
+		print('# HELP mp3conv_phase_duration_seconds Time spent in each phase of the conversion.',           file = out)
+		for phase, duration in self.phases.items() :
+			print(f"mp3conv_phase_duration_seconds{{phase=\"{phase}\"}} {duration}",                            file = out)
+
+		print('# TYPE mp3conv_lane_jobs gauge',                                                              file = out)
+		print('# HELP mp3conv_lane_jobs Number of threads of each lane of the executor.',                     file = out)
+		for lane, (jobs, _) in self.lanes.items() :
+			print(f"mp3conv_lane_jobs{{lane=\"{lane}\"}} {jobs}",                                                file = out)
+
+		print('# TYPE mp3conv_lane_busy_seconds gauge',                                                      file = out)
+		print('# HELP mp3conv_lane_busy_seconds Time spent applying patches by the threads of each lane.',   file = out)
+		for lane, (_, busy_sec) in self.lanes.items() :
+			print(f"mp3conv_lane_busy_seconds{{lane=\"{lane}\"}} {busy_sec}",                                 file = out)
+
+		print('# TYPE mp3conv_lane_occupancy_ratio gauge',                                                   file = out)
+		print('# HELP mp3conv_lane_occupancy_ratio Part of the application of the patches during which the threads of each lane were busy.', file = out)
+		for lane in self.lanes :
+			print(f"mp3conv_lane_occupancy_ratio{{lane=\"{lane}\"}} {self.get_occupancy(lane)}",               file = out)
+
 		print('# TYPE mp3conv_input_files gauge',                                                            file = out)
 		print('# HELP mp3conv_input_files Count of files in the input directory.',                           file = out)
 		for ext, count in self.input_files.counters.items() :
@@ -84,20 +223,78 @@ class ConversionMetrics :
 			print(f"mp3conv_output_files{{extension=\"{ext}\"}} {count}",                                    file = out)
 
 		print('# TYPE mp3conv_convert_tags gauge',                                                           file = out)
-		print('# HELP mp3conv_convert_tags Count of conversion tags found in input files.',                  file = out)
+		print('# HELP mp3conv_convert_tags Count of conversion tags found in the input files evaluated during the run.', file = out)
 		for tag, count in self.convert_tags.counters.items() :
 			print(f"mp3conv_convert_tags{{convert_tag=\"{tag}\"}} {count}",                                  file = out)
 
+		print('# TYPE mp3conv_keep_evaluated_files gauge',                                                   file = out)
+		print('# HELP mp3conv_keep_evaluated_files Count of input files whose conversion tag was evaluated during the run.', file = out)
+		print(f"mp3conv_keep_evaluated_files {self.evaluated_files}",                                        file = out)
+
+		print('# TYPE mp3conv_keep_rules gauge',                                                             file = out)
+		print('# HELP mp3conv_keep_rules Count of input files matched by the keep rules of the source directory, by level.', file = out)
+		for level, count in self.keep_rules.counters.items() :
+			print(f"mp3conv_keep_rules{{level=\"{level}\"}} {count}",                                   file = out)
+
+		print('# TYPE mp3conv_tag_cache gauge',                                                              file = out)
+		print('# HELP mp3conv_tag_cache Count of Convert-Keep tag lookups in the tag cache, by result.',     file = out)
+		for result, count in self.tag_cache.counters.items() :
+			print(f"mp3conv_tag_cache{{result=\"{result}\"}} {count}",                                        file = out)
+
+		print('# TYPE mp3conv_metadata_prefetch gauge',                                                      file = out)
+		print('# HELP mp3conv_metadata_prefetch Count of Convert-Keep tags read ahead by the prefetcher (hit) or synchronously (fallback).', file = out)
+		for result, count in self.prefetch.counters.items() :
+			print(f"mp3conv_metadata_prefetch{{result=\"{result}\"}} {count}",                              file = out)
+
 		print('# TYPE mp3conv_ignored_files gauge',                                                          file = out)
 		print('# HELP mp3conv_ignored_files Number of files ignored by the script.',                         file = out)
 		for ext, count in self.ignored_files.counters.items() :
 			print(f"mp3conv_ignored_files{{extension=\"{ext}\"}} {count}",                                   file = out)
 
+		print('# TYPE mp3conv_unchanged_files gauge',                                                        file = out)
+		print('# HELP mp3conv_unchanged_files Files newer than their output but with the same fingerprint.', file = out)
+		for ext, count in self.unchanged_files.counters.items() :
+			print(f"mp3conv_unchanged_files{{extension=\"{ext}\"}} {count}",                                 file = out)
+
 		print('# TYPE mp3conv_patches gauge',                                                                file = out)
 		print('# HELP mp3conv_patches Count of patches applied by the script.',                              file = out)
 		for patch_type, count in self.patches.counters.items() :
 			print(f"mp3conv_patches{{pach_type=\"{patch_type}\"}} {count}",                                  file = out)
 
+		print('# TYPE mp3conv_patch_duration_seconds histogram',                                             file = out)
+		print('# HELP mp3conv_patch_duration_seconds Time taken to apply each patch, by type.',              file = out)
+		for patch_type, histogram in self.patch_durations.items() :
+			histogram.print('mp3conv_patch_duration_seconds', f"patch_type=\"{patch_type}\"", out)
+
+		bytes_rate, audio_rate = self.get_throughput()
+		print('# TYPE mp3conv_processed_bytes counter',                                                      file = out)
+		print('# HELP mp3conv_processed_bytes Size of the source files that were converted or copied.',     file = out)
+		print(f"mp3conv_processed_bytes {self.processed_bytes}",                                             file = out)
+
+		print('# TYPE mp3conv_processed_audio_seconds counter',                                              file = out)
+		print('# HELP mp3conv_processed_audio_seconds Duration of the audio that was encoded.',              file = out)
+		print(f"mp3conv_processed_audio_seconds {self.processed_audio_sec}",                                 file = out)
+
+		print('# TYPE mp3conv_throughput_bytes_per_second gauge',                                            file = out)
+		print('# HELP mp3conv_throughput_bytes_per_second Source bytes processed per second of the apply phase.', file = out)
+		print(f"mp3conv_throughput_bytes_per_second {bytes_rate}",                                           file = out)
+
+		print('# TYPE mp3conv_throughput_audio_seconds_per_second gauge',                                    file = out)
+		print('# HELP mp3conv_throughput_audio_seconds_per_second Seconds of audio encoded per second of the apply phase.', file = out)
+		print(f"mp3conv_throughput_audio_seconds_per_second {audio_rate}",                                   file = out)
+
+		print('# TYPE mp3conv_convert_input_bytes histogram',                                                file = out)
+		print('# HELP mp3conv_convert_input_bytes Size of the source files of the conversions.',             file = out)
+		self.convert_input_bytes.print('mp3conv_convert_input_bytes', '', out)
+
+		print('# TYPE mp3conv_convert_output_bytes histogram',                                               file = out)
+		print('# HELP mp3conv_convert_output_bytes Size of the files produced by the conversions.',          file = out)
+		self.convert_output_bytes.print('mp3conv_convert_output_bytes', '', out)
+
+		print('# TYPE mp3conv_convert_realtime_factor histogram',                                            file = out)
+		print('# HELP mp3conv_convert_realtime_factor Audio duration divided by encoding time.',             file = out)
+		self.convert_realtime_factor.print('mp3conv_convert_realtime_factor', '', out)
+
 		
 		
 
@@ -0,0 +1,56 @@
+
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.metrics import ConversionMetrics
+
+from typing import Optional
+
+
+# Serves the metrics of the last conversion on `/metrics`, in the Prometheus text format
+class MetricsServer :
+
+    def __init__(self, address: str, port: int) :
+        self._lock = threading.Lock()
+        self._metrics: Optional[ConversionMetrics] = None
+        server = self
+
+        class Handler(BaseHTTPRequestHandler) :
+
+            def do_GET(self) :
+                if self.path != '/metrics' :
+                    self.send_error(404)
+                    return
+                body = server.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) :
+                pass
+
+        self._httpd = ThreadingHTTPServer((address, port), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self) :
+        self._thread.start()
+
+    def publish(self, metrics: ConversionMetrics) :
+        with self._lock :
+            self._metrics = metrics
+
+    def render(self) -> str :
+        with self._lock :
+            metrics = self._metrics
+        if metrics is None :
+            return ''
+        out = io.StringIO()
+        metrics.print(out)
+        return out.getvalue()
+
+    def stop(self) :
+        self._httpd.shutdown()
+        self._httpd.server_close()
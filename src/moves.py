@@ -0,0 +1,83 @@
+
+import os
+
+from src.collections.file_tree import FilesystemNode, FilesystemLeaf
+from src.patches import Patch, RemovePatch
+from src.storage.manifest import DestinationManifest
+
+from typing import Iterable, Optional, Sequence, Tuple
+
+
+def _walk(node: FilesystemNode, path: str = '') -> "Iterable[Tuple[str, FilesystemLeaf]]" :
+    for leaf in node.iter_files() :
+        yield (path, leaf)
+    for child in node.subfolders.values() :
+        yield from _walk(child, os.path.join(path, child.name))
+
+
+# Outputs whose source disappeared, matched to new sources with the same size and modification time
+# (which moving or renaming a file preserves). A matched output is moved instead of being removed,
+# and the new source is not converted.
+class MoveCandidates :
+
+    def __init__(self) :
+        self._claims: dict[str, str] = {}
+        self._pending: set[str] = set()
+        self._moved: set[str] = set()
+        self._deferred: list[Patch] = []
+
+    def add(self, old_file: str, dest_file: str) :
+        self._claims[dest_file] = old_file
+        self._pending.add(old_file)
+
+    def __len__(self) -> int :
+        return len(self._claims)
+
+    # Returns the output to move to `dest_file`, if any
+    def claim(self, dest_file: str) -> Optional[str] :
+        old_file = self._claims.pop(dest_file, None)
+        if old_file is not None :
+            self._pending.discard(old_file)
+            self._moved.add(old_file)
+        return old_file
+
+    # Outputs that were moved are not removed, the removal of those that may still be moved is left to `finish`
+    def is_reserved(self, old_file: str) -> bool :
+        return old_file in self._pending or old_file in self._moved
+
+    # Directories may only be cleared once the files they contain have been moved
+    def defer(self, patch: Patch) :
+        self._deferred.append(patch)
+
+    # The outputs that were not moved after all (e.g. if the new source is ignored) are removed
+    def finish(self) -> "Iterable[Patch]" :
+        for old_file in sorted(self._pending) :
+            yield RemovePatch(old_file)
+        self._pending.clear()
+        yield from self._deferred
+        self._deferred.clear()
+
+
+def find_moves(trees: "Sequence[Tuple[FilesystemNode, FilesystemNode]]", manifest: DestinationManifest, output_extension: str) -> MoveCandidates :
+    res = MoveCandidates()
+    orphans: "dict[Tuple[int, int], list[str]]" = {}
+    for source_files, dest_files in trees :
+        for path, leaf in _walk(dest_files) :
+            if source_files.get_file(path, leaf.name) is not None :
+                continue
+            dest_file = os.path.join(dest_files.name, path, leaf.filename())
+            identity = manifest.source_identity(dest_file)
+            if identity is not None :
+                orphans.setdefault(identity, []).append(dest_file)
+    if len(orphans) == 0 :
+        return res
+    for source_files, dest_files in trees :
+        for path, leaf in _walk(source_files) :
+            if dest_files.get_file(path, leaf.name) is not None :
+                continue
+            candidates = orphans.get((leaf.size, leaf.modification))
+            # Ambiguous matches are ignored
+            if candidates is None or len(candidates) != 1 :
+                continue
+            res.add(candidates.pop(), os.path.join(dest_files.name, path, f"{leaf.name}.{output_extension}"))
+    return res
@@ -1,5 +1,11 @@
 
+import os
+
 from src.metadata.keep import ConvertKeep
+from src.storage.tag_cache import default_tag_cache_path
+from src.profiles import OutputProfile
+
+from typing import Optional
 
 
 class ProgramOptions :
@@ -9,6 +15,28 @@ class ProgramOptions :
         self.dry_run:    bool           = False
         self.default_keep:  ConvertKeep = ConvertKeep.ALWAYS
         self.keep_treshold: ConvertKeep = ConvertKeep.lowest()
+        # Whether the Convert-Keep tags are read, or only the keep rules of the source directory
+        self.keep_tags: bool = True
+        self.verify_destination: bool   = False
+        self.fingerprint:        bool   = False
+        self.link:               bool   = False
+        # Destinations converted in addition to the main one
+        self.profiles: "list[OutputProfile]" = []
+        # Subtrees (relative to the source and destination directories) to which the run is restricted
+        self.only: "list[str]" = []
+        self.tag_cache_path: Optional[str] = default_tag_cache_path()
+        self.metadata_workers: int = 8
+        # Execution
+        # Conversions are applied by `jobs` threads, the other patches (copies, removals, ...) by `io_jobs` threads
+        self.jobs: int = os.cpu_count() or 1
+        self.io_jobs: int = 4
+        self.batch_size: int = 1
+        self.schedule:   str = 'tree'
+        # Shared directory through which the conversions are handed to workers
+        self.coordinator: Optional[str] = None
+        # Watch mode
+        self.watch:        bool          = False
+        self.metrics_port: Optional[int] = None
         # Prometheus metrics
         self.metrics_enabled: bool = False
         self.matrics_path:    str  = '/var/lib/node_exporter/textfile_collector'
@@ -1,8 +1,11 @@
-
-from .base       import Patch
-from .clear_dir  import ClearDirPatch
-from .convert    import ConvertPatch
-from .copy       import CopyPatch
-from .create_dir import CreateDirPatch
-from .remove     import RemovePatch
-
+from .base          import Patch, PartialPatchError
+from .batch_convert import BatchConvertPatch, BatchConversionError
+from .clear_dir     import ClearDirPatch
+from .convert       import ConvertPatch
+from .copy          import CopyPatch
+from .create_dir    import CreateDirPatch
+from .move          import MovePatch
+from .remote_convert import RemoteConvertPatch, RemoteConversionError
+from .remove        import RemovePatch
+from .retag         import RetagPatch
+from .touch         import TouchPatch
@@ -1,6 +1,10 @@
 
 from abc import ABC, abstractmethod
 
+from src.storage.manifest import DestinationManifest
+
+from typing import Optional, Sequence
+
 
 class Patch(ABC) :
 
@@ -8,6 +12,25 @@ class Patch(ABC) :
     def apply(self) :
         pass
 
+    def update_manifest(self, manifest: DestinationManifest) :
+        pass
+
+    # The patches that are applied together by this one, each of them is logged and counted separately
+    def parts(self) -> "Sequence[Patch]" :
+        return [ self ]
+
+    # The parts that were applied, which are only some of them when the patch raised a `PartialPatchError`
+    def completed_parts(self) -> "Sequence[Patch]" :
+        return self.parts()
+
+    # The source file the patch writes an output for, if any
+    def source(self) -> Optional[str] :
+        return None
+
+    @abstractmethod
+    def targets(self) -> "Sequence[str]" :
+        pass
+
     @abstractmethod
     def get_name(self) -> str :
         pass
@@ -15,3 +38,8 @@ class Patch(ABC) :
     @abstractmethod
     def describe(self) -> str :
         pass
+
+
+# Raised by a patch whose parts are applied separately when some of them failed, the other parts were applied
+class PartialPatchError(Exception) :
+    pass
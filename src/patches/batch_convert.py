@@ -0,0 +1,107 @@
+
+import os
+import subprocess
+
+from .base import Patch, PartialPatchError
+from .convert import ConvertPatch
+from src.utils import file_ops
+from src.storage.manifest import DestinationManifest
+
+from typing import Final, Optional, Sequence
+
+
+class BatchConversionError(PartialPatchError) :
+
+    def __init__(self, failures: "Sequence[tuple[ConvertPatch, BaseException]]") :
+        self.failures: Final[Sequence[tuple[ConvertPatch, BaseException]]] = failures
+        lines = [ f"{len(failures)} conversion(s) failed :" ]
+        for conversion, error in failures :
+            lines.append(f"  - {conversion.source_file} : {error_summary(error)}")
+        super().__init__('\n'.join(lines))
+
+
+def error_summary(error: BaseException) -> str :
+    if isinstance(error, subprocess.CalledProcessError) and error.stderr :
+        stderr = error.stderr.decode(errors = 'replace').strip().splitlines()
+        if len(stderr) > 0 :
+            return stderr[-1]
+    return str(error)
+
+
+# Converts several files with a single ffmpeg process, which saves its startup time for short tracks.
+# The conversions of a source for several output profiles share the decoding of this source.
+# If the batch fails, the files are converted again one by one so that the failures are reported per file,
+# the conversions that succeed are kept.
+class BatchConvertPatch(Patch) :
+
+    def __init__(self, conversions: "Sequence[ConvertPatch]") :
+        self.conversions : Final[Sequence[ConvertPatch]] = conversions
+        self.completed: "list[ConvertPatch]" = []
+
+    def apply(self) :
+        # A source converted for several profiles is only decoded and hashed once, ffmpeg encodes it to each output
+        inputs: "dict[str, ConvertPatch]" = {}
+        hashes: "dict[str, Optional[str]]" = {}
+        for conversion in self.conversions :
+            inputs.setdefault(conversion.source_file, conversion)
+            if not conversion.hashes_audio() :
+                continue
+            if conversion.source_file not in hashes :
+                conversion.hash_audio()
+                hashes[conversion.source_file] = conversion.audio_hash
+            conversion.audio_hash = hashes[conversion.source_file]
+        indexes = { source_file: i for i, source_file in enumerate(inputs) }
+        command = ['ffmpeg', '-y']
+        for source_file in inputs :
+            command += ['-i', source_file]
+        for conversion in self.conversions :
+            command += [*conversion.profile.output_args(indexes[conversion.source_file]), conversion.dest_file + file_ops.PART_SUFFIX]
+        try :
+            subprocess.run(command, check=True, capture_output=True, start_new_session=True)
+            for conversion in self.conversions :
+                file_ops.commit_part(conversion.dest_file)
+                self.completed.append(conversion)
+        except subprocess.CalledProcessError :
+            self._remove_parts()
+            self._apply_separately()
+        except BaseException :
+            self._remove_parts()
+            raise
+
+    def _remove_parts(self) :
+        for conversion in self.conversions :
+            file_ops.remove_part(conversion.dest_file)
+
+    def _apply_separately(self) :
+        failures = []
+        for conversion in self.conversions :
+            try :
+                conversion.apply()
+                self.completed.append(conversion)
+            except Exception as e :
+                failures.append((conversion, e))
+        if len(failures) > 0 :
+            raise BatchConversionError(failures)
+
+    def parts(self) -> "Sequence[Patch]" :
+        return self.conversions
+
+    def completed_parts(self) -> "Sequence[Patch]" :
+        return self.completed
+
+    def update_manifest(self, manifest: DestinationManifest) :
+        for conversion in self.conversions :
+            conversion.update_manifest(manifest)
+
+    def targets(self) -> "Sequence[str]" :
+        return [ conversion.dest_file for conversion in self.conversions ]
+
+    def get_name(self) -> str :
+        return 'convert'
+
+    def describe(self) -> str :
+        sources = len(set(conversion.source_file for conversion in self.conversions))
+        res = f"CONVERT {sources} files in {os.path.dirname(self.conversions[0].source_file)}"
+        if sources != len(self.conversions) :
+            return f"{res} ({len(self.conversions)} outputs)"
+        return res
@@ -1,9 +1,8 @@
 
-import os
-
 from .base import Patch
+from src.utils import file_ops
 
-from typing import Final
+from typing import Final, Sequence
 
 
 class ClearDirPatch(Patch) :
@@ -13,10 +12,13 @@ class ClearDirPatch(Patch) :
 
     def apply(self) :
         try:
-            os.rmdir(self.dir_path)
+            file_ops.remove_directory(self.dir_path)
         except Exception :
             pass
 
+    def targets(self) -> "Sequence[str]" :
+        return [ self.dir_path ]
+
     def get_name(self) -> str :
         return 'rmdir'
 
@@ -2,26 +2,67 @@
 import subprocess
 
 from .base import Patch
+from src.utils import file_ops
+from src.metadata.audio_hash import audio_hash
+from src.storage.manifest import DestinationManifest
+from src.profiles import OutputProfile
 
-from typing import Final
+from typing import Final, Optional, Sequence
 
 
 class ConvertPatch(Patch) :
 
-    def __init__(self, source_file: str, dest_file: str, update: bool = False) :
+    # The size (in bytes), modification time (in nanoseconds) and duration (in seconds) of the source are only used
+    # to schedule the patch and to estimate the progress of the run
+    def __init__(self, source_file: str, dest_file: str, profile: OutputProfile, update: bool = False, fingerprint: Optional[str] = None, source_size: int = 0, source_mtime: int = 0, source_duration: Optional[float] = None) :
         self.source_file : Final[str] = source_file
         self.dest_file   : Final[str] = dest_file
+        self.profile : Final[OutputProfile] = profile
         self.update : Final[bool] = update
+        self.fingerprint : Final[Optional[str]] = fingerprint
+        self.source_size  : Final[int] = source_size
+        self.source_mtime : Final[int] = source_mtime
+        self.source_duration : Final[Optional[float]] = source_duration
+        # Computed when the source is read, so that the next runs can tell whether only its tags changed
+        self.audio_hash : Optional[str] = None
+    
+    # The hash is only used to rewrite the tags of an output when the audio of its source did not change, which is only done
+    # for the profiles with ID3 tags. It reads MP3 and M4A sources in full (FLAC sources store it in their header).
+    def hashes_audio(self) -> bool :
+        return self.profile.codec.id3
+
+    def hash_audio(self) :
+        if self.hashes_audio() :
+            self.audio_hash = audio_hash(self.source_file)
     
     def apply(self) :
-        command = ['ffmpeg', '-y', '-i', self.source_file, '-q:a', '2', self.dest_file]
-        subprocess.run(command, check=True, capture_output=True)
+        self.hash_audio()
+        # The output is written under a temporary name, the format has to be explicit.
+        # ffmpeg runs in its own session so that a signal sent to the script does not interrupt the encoding.
+        command = ['ffmpeg', '-y', '-i', self.source_file, *self.profile.output_args(0), self.dest_file + file_ops.PART_SUFFIX]
+        try :
+            subprocess.run(command, check=True, capture_output=True, start_new_session=True)
+            file_ops.commit_part(self.dest_file)
+        except BaseException :
+            file_ops.remove_part(self.dest_file)
+            raise
+    
+    def update_manifest(self, manifest: DestinationManifest) :
+        manifest.record(self.dest_file, self.source_file, self.fingerprint, self.source_size, self.source_mtime, self.audio_hash)
+    
+    def source(self) -> Optional[str] :
+        return self.source_file
+    
+    def targets(self) -> "Sequence[str]" :
+        return [ self.dest_file ]
     
     def get_name(self) -> str :
         return 'convert'
     
     def describe(self) -> str :
         res = f"CONVERT {self.source_file}"
+        if self.profile.label is not None :
+            res = f"{res} [{self.profile.label}]"
         if self.update :
             return f"{res} (update)"
         return res
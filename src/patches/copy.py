@@ -1,26 +1,45 @@
 
-import subprocess
+import os
 
 from .base import Patch
+from src.utils import file_ops
+from src.storage.manifest import DestinationManifest
 
-from typing import Final
+from typing import Final, Optional, Sequence
 
 
 class CopyPatch(Patch) :
 
-    def __init__(self, source_file: str, dest_folder: str, update: bool = False) :
+    # The size (in bytes) and modification time (in nanoseconds) of the source are only used to schedule the patch
+    def __init__(self, source_file: str, dest_folder: str, update: bool = False, fingerprint: Optional[str] = None, link: bool = False, source_size: int = 0, source_mtime: int = 0) :
         self.source_file : Final[str] = source_file
         self.dest_folder : Final[str] = dest_folder
         self.update : Final[bool] = update
+        self.link : Final[bool] = link
+        self.source_size  : Final[int] = source_size
+        self.source_mtime : Final[int] = source_mtime
+        self.fingerprint : Final[Optional[str]] = fingerprint
     
     def apply(self) :
-        subprocess.run(['cp', self.source_file, self.dest_folder], check=True, capture_output=True)
+        if self.link :
+            file_ops.link_file(self.source_file, self.targets()[0])
+        else :
+            file_ops.copy_file(self.source_file, self.targets()[0])
+    
+    def update_manifest(self, manifest: DestinationManifest) :
+        manifest.record(self.targets()[0], self.source_file, self.fingerprint, self.source_size, self.source_mtime)
+    
+    def source(self) -> Optional[str] :
+        return self.source_file
+    
+    def targets(self) -> "Sequence[str]" :
+        return [ os.path.join(self.dest_folder, os.path.basename(self.source_file)) ]
     
     def get_name(self) -> str :
         return 'copy'
     
     def describe(self) -> str :
-        res = f"COPY {self.source_file}"
+        res = f"{'LINK' if self.link else 'COPY'} {self.source_file}"
         if self.update :
             return f"{res} (update)"
         return res
@@ -1,9 +1,8 @@
 
-import os
-
 from .base import Patch
+from src.utils import file_ops
 
-from typing import Final
+from typing import Final, Sequence
 
 
 class CreateDirPatch(Patch) :
@@ -12,7 +11,10 @@ class CreateDirPatch(Patch) :
         self.directory_path : Final[str] = directory_path
     
     def apply(self) :
-        os.mkdir(self.directory_path)
+        file_ops.make_directory(self.directory_path)
+
+    def targets(self) -> "Sequence[str]" :
+        return [ self.directory_path ]
 
     def get_name(self) -> str :
         return 'mkdir'
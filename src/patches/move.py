@@ -0,0 +1,40 @@
+
+from .base import Patch
+from src.utils import file_ops
+from src.storage.manifest import DestinationManifest
+
+from typing import Final, Optional, Sequence
+
+
+# Moves an output whose source was moved, instead of converting the source again
+class MovePatch(Patch) :
+
+    def __init__(self, old_file: str, dest_file: str, source_file: str, fingerprint: Optional[str] = None, source_size: int = 0, source_mtime: int = 0) :
+        self.old_file    : Final[str] = old_file
+        self.dest_file   : Final[str] = dest_file
+        self.source_file : Final[str] = source_file
+        self.fingerprint : Final[Optional[str]] = fingerprint
+        self.source_size  : Final[int] = source_size
+        self.source_mtime : Final[int] = source_mtime
+
+    def apply(self) :
+        file_ops.move_file(self.old_file, self.dest_file)
+
+    # The content of the output does not change, neither does its audio hash
+    def update_manifest(self, manifest: DestinationManifest) :
+        audio_hash = manifest.audio_hash(self.old_file)
+        manifest.forget(self.old_file)
+        manifest.record(self.dest_file, self.source_file, self.fingerprint, self.source_size, self.source_mtime, audio_hash)
+
+    # The old file is a target too, so that its directory is only cleared once it was moved
+    def source(self) -> Optional[str] :
+        return self.source_file
+
+    def targets(self) -> "Sequence[str]" :
+        return [ self.dest_file, self.old_file ]
+
+    def get_name(self) -> str :
+        return 'move'
+
+    def describe(self) -> str :
+        return f"MOVE {self.old_file} -> {self.dest_file}"
@@ -0,0 +1,90 @@
+
+import os
+
+from .base import Patch, PartialPatchError
+from .convert import ConvertPatch
+from src.utils import file_ops
+from src.storage.manifest import DestinationManifest
+from src.storage.work_queue import WorkQueue
+
+from typing import Final, Optional, Sequence, Tuple
+
+
+class RemoteConversionError(PartialPatchError) :
+
+    def __init__(self, claim: str, failures: "Sequence[Tuple[ConvertPatch, str]]") :
+        self.failures: Final[Sequence[Tuple[ConvertPatch, str]]] = failures
+        lines = [ f"{len(failures)} conversion(s) failed on {claim} :" ]
+        for conversion, error in failures :
+            lines.append(f"  - {conversion.source_file} : {error}")
+        super().__init__('\n'.join(lines))
+
+
+# Conversions (of a single source or of a batch) that are performed by a worker, possibly on another host, through a shared queue.
+# The item gives the absolute paths of the sources, which the workers must see under the same paths.
+# The outputs are written in the queue by the worker, and copied to the destination once the item is acknowledged.
+# The result of the item gives the error of each output, the outputs that were converted are kept.
+class RemoteConvertPatch(Patch) :
+
+    def __init__(self, queue: WorkQueue, conversions: "Sequence[ConvertPatch]") :
+        self.queue : Final[WorkQueue] = queue
+        self.conversions : Final[Sequence[ConvertPatch]] = conversions
+        self.completed: "list[ConvertPatch]" = []
+
+    def item(self) -> dict :
+        return {
+            'outputs': [
+                { 'source': os.path.abspath(conversion.source_file), 'codec': conversion.profile.codec_name, 'quality': conversion.profile.quality }
+                for conversion in self.conversions
+            ]
+        }
+
+    def apply(self) :
+        item_id = self.queue.publish(self.item())
+        try :
+            claim, result = self.queue.wait(item_id)
+        except BaseException :
+            self.queue.withdraw(item_id)
+            raise
+        extensions = [ conversion.profile.extension for conversion in self.conversions ]
+        # A result without the errors of the outputs (e.g. unreadable) applies its error to all of them
+        errors: "list[Optional[str]]" = result.get('errors') or [ result.get('error') ] * len(self.conversions)
+        failures: "list[Tuple[ConvertPatch, str]]" = []
+        try :
+            for index, conversion in enumerate(self.conversions) :
+                if errors[index] is not None :
+                    failures.append((conversion, errors[index]))
+                    continue
+                try :
+                    file_ops.copy_file(self.queue.output_path(item_id, claim, index, extensions[index]), conversion.dest_file)
+                except OSError as e :
+                    failures.append((conversion, str(e)))
+                    continue
+                conversion.audio_hash = result['audio_hashes'][index]
+                self.completed.append(conversion)
+        finally :
+            self.queue.discard(item_id, claim, len(self.conversions), extensions)
+        if len(failures) > 0 :
+            raise RemoteConversionError(claim, failures)
+
+    def parts(self) -> "Sequence[Patch]" :
+        return self.conversions
+
+    def completed_parts(self) -> "Sequence[Patch]" :
+        return self.completed
+
+    def update_manifest(self, manifest: DestinationManifest) :
+        for conversion in self.conversions :
+            conversion.update_manifest(manifest)
+
+    def targets(self) -> "Sequence[str]" :
+        return [ conversion.dest_file for conversion in self.conversions ]
+
+    def get_name(self) -> str :
+        return 'convert'
+
+    def describe(self) -> str :
+        if len(self.conversions) == 1 :
+            return f"{self.conversions[0].describe()} (remote)"
+        sources = len(set(conversion.source_file for conversion in self.conversions))
+        return f"CONVERT {sources} files in {os.path.dirname(self.conversions[0].source_file)} (remote, {len(self.conversions)} outputs)"
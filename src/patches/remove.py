@@ -1,9 +1,9 @@
 
-import os
-
 from .base import Patch
+from src.utils import file_ops
+from src.storage.manifest import DestinationManifest
 
-from typing import Final
+from typing import Final, Sequence
 
 
 class RemovePatch(Patch) :
@@ -12,7 +12,13 @@ class RemovePatch(Patch) :
         self.dest_file : Final[str] = dest_file
     
     def apply(self) :
-        os.remove(self.dest_file)
+        file_ops.remove_file(self.dest_file)
+    
+    def update_manifest(self, manifest: DestinationManifest) :
+        manifest.forget(self.dest_file)
+    
+    def targets(self) -> "Sequence[str]" :
+        return [ self.dest_file ]
     
     def get_name(self) -> str :
         return 'remove'
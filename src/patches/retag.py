@@ -0,0 +1,44 @@
+
+from .base import Patch
+from src.utils import file_ops
+from src.metadata.retag import copy_tags
+from src.storage.manifest import DestinationManifest
+
+from typing import Final, Optional, Sequence
+
+
+# Rewrites the tags of an output whose source only had its tags modified, instead of converting the source again.
+# The tags are written to a copy of the output, which replaces it once complete.
+class RetagPatch(Patch) :
+
+    def __init__(self, source_file: str, dest_file: str, audio_hash: str, fingerprint: Optional[str] = None, source_size: int = 0, source_mtime: int = 0) :
+        self.source_file : Final[str] = source_file
+        self.dest_file   : Final[str] = dest_file
+        self.audio_hash  : Final[str] = audio_hash
+        self.fingerprint : Final[Optional[str]] = fingerprint
+        self.source_size  : Final[int] = source_size
+        self.source_mtime : Final[int] = source_mtime
+
+    def apply(self) :
+        try :
+            file_ops.copy_to_part(self.dest_file)
+            copy_tags(self.source_file, self.dest_file + file_ops.PART_SUFFIX)
+            file_ops.commit_part(self.dest_file)
+        except BaseException :
+            file_ops.remove_part(self.dest_file)
+            raise
+
+    def update_manifest(self, manifest: DestinationManifest) :
+        manifest.record(self.dest_file, self.source_file, self.fingerprint, self.source_size, self.source_mtime, self.audio_hash)
+
+    def source(self) -> Optional[str] :
+        return self.source_file
+
+    def targets(self) -> "Sequence[str]" :
+        return [ self.dest_file ]
+
+    def get_name(self) -> str :
+        return 'retag'
+
+    def describe(self) -> str :
+        return f"RETAG {self.source_file}"
@@ -0,0 +1,41 @@
+
+import os
+import time
+
+from .base import Patch
+from src.storage.manifest import DestinationManifest
+
+from typing import Final, Optional, Sequence
+
+
+# Marks an output as up to date when its source is newer but has the same fingerprint, so that the next runs
+# skip the source on its modification date instead of computing its fingerprint again.
+# The modification date of the output is never set before the one of the source, even on coarse filesystems.
+class TouchPatch(Patch) :
+
+    def __init__(self, source_file: str, dest_file: str, fingerprint: str, source_size: int = 0, source_mtime: int = 0) :
+        self.source_file : Final[str] = source_file
+        self.dest_file   : Final[str] = dest_file
+        self.fingerprint : Final[str] = fingerprint
+        self.source_size  : Final[int] = source_size
+        self.source_mtime : Final[int] = source_mtime
+
+    def apply(self) :
+        stat = os.stat(self.dest_file)
+        os.utime(self.dest_file, ns = (stat.st_atime_ns, max(time.time_ns(), self.source_mtime)))
+
+    # The content of the output does not change, neither does its audio hash
+    def update_manifest(self, manifest: DestinationManifest) :
+        manifest.record(self.dest_file, self.source_file, self.fingerprint, self.source_size, self.source_mtime, manifest.audio_hash(self.dest_file))
+
+    def source(self) -> Optional[str] :
+        return self.source_file
+
+    def targets(self) -> "Sequence[str]" :
+        return [ self.dest_file ]
+
+    def get_name(self) -> str :
+        return 'touch'
+
+    def describe(self) -> str :
+        return f"TOUCH {self.dest_file}"
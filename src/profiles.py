@@ -0,0 +1,74 @@
+
+from typing import Callable, Final, Optional, Sequence
+
+
+class OutputCodec :
+
+    # `encoder` gives the ffmpeg options of the encoder for a quality, `muxer` is the format of the output file.
+    # Sources with one of the `copied` extensions are copied as they are rather than converted.
+    # The tags of the outputs can only be rewritten without converting the sources again if they are ID3 tags.
+    def __init__(self, extension: str, muxer: str, encoder: "Callable[[str], list[str]]", validate: "Callable[[str], bool]", cover: bool = False, copied: "Sequence[str]" = (), id3: bool = False) :
+        self.extension : Final[str] = extension
+        self.muxer     : Final[str] = muxer
+        self.encoder  : Final[Callable[[str], list[str]]] = encoder
+        self.validate : Final[Callable[[str], bool]] = validate
+        self.cover  : Final[bool] = cover
+        self.copied : Final[Sequence[str]] = copied
+        self.id3    : Final[bool] = id3
+
+
+def _bitrate(quality: str) -> bool :
+    return quality.isdigit() and 6 <= int(quality) <= 512
+
+
+# The quality is a VBR preset for MP3 (0 is the best, 9 the worst) and a bitrate in kbit/s for Opus and AAC
+CODECS: "dict[str, OutputCodec]" = {
+    'mp3':  OutputCodec('mp3', 'mp3', lambda q: ['-c:a', 'libmp3lame', '-q:a', q], lambda q: q.isdigit() and int(q) <= 9, cover = True, copied = ('mp3',), id3 = True),
+    'opus': OutputCodec('opus', 'opus', lambda q: ['-c:a', 'libopus', '-b:a', f"{q}k"], _bitrate),
+    'aac':  OutputCodec('m4a', 'ipod', lambda q: ['-c:a', 'aac', '-b:a', f"{q}k"], _bitrate)
+}
+
+DEFAULT_CODEC   = 'mp3'
+DEFAULT_QUALITY = '2'
+
+
+# A destination library, with the format of the files it contains.
+# The label distinguishes the additional profiles from the main one in the logs.
+class OutputProfile :
+
+    def __init__(self, dest_dir: str, codec: str = DEFAULT_CODEC, quality: str = DEFAULT_QUALITY, label: Optional[str] = None) :
+        self.dest_dir : Final[str] = dest_dir
+        self.codec_name : Final[str] = codec
+        self.codec    : Final[OutputCodec] = CODECS[codec]
+        self.quality  : Final[str] = quality
+        self.label    : Final[Optional[str]] = label
+
+    @property
+    def extension(self) -> str :
+        return self.codec.extension
+
+    def copies(self, extension: str) -> bool :
+        return extension in self.codec.copied
+
+    # Options of the output that encodes the input with the given index of an ffmpeg command,
+    # which takes the audio, the cover (if the format supports it) and the tags of this input
+    def output_args(self, input_index: int) -> "list[str]" :
+        res = ['-map', f"{input_index}:a:0"]
+        if self.codec.cover :
+            res += ['-map', f"{input_index}:v:0?"]
+        res += ['-map_metadata', str(input_index)]
+        return res + self.codec.encoder(self.quality) + ['-f', self.codec.muxer]
+
+
+# Parses a profile given as `<directory>:<codec>:<quality>`, returns None if it is invalid
+def parse_profile(profile_repr: str) -> Optional[OutputProfile] :
+    parts = profile_repr.rsplit(':', 2)
+    if len(parts) != 3 :
+        return None
+    dest_dir, codec, quality = parts
+    codec = codec.lower()
+    if len(dest_dir) == 0 or codec not in CODECS or not CODECS[codec].validate(quality) :
+        return None
+    dest_dir = dest_dir.rstrip('/') or '/'
+    return OutputProfile(dest_dir, codec, quality, f"{codec} {quality}")
+
@@ -0,0 +1,53 @@
+
+import time
+import threading
+from tqdm import tqdm
+
+from src.patches import Patch, ConvertPatch, CopyPatch
+
+from typing import Final, Tuple
+
+
+# Estimated cost of a patch : the size of its source, in bytes, and the duration of the audio it encodes, in seconds.
+# Patches that do not write a file are considered free.
+def patch_cost(patch: Patch) -> Tuple[int, float] :
+    size = 0
+    audio_sec = 0.0
+    for part in patch.parts() :
+        if isinstance(part, ConvertPatch) :
+            size += part.source_size
+            audio_sec += part.source_duration or 0.0
+        elif isinstance(part, CopyPatch) :
+            size += part.source_size
+    return (size, audio_sec)
+
+
+# Progress bar weighted by the cost of the patches rather than their number.
+# The plan is streamed, so the total grows as the patches are submitted and the ETA gets more accurate over time.
+class ConversionProgress :
+
+    def __init__(self) :
+        self._lock = threading.Lock()
+        self._bar = tqdm(desc = 'Progress', total = 0, unit = 'B', unit_scale = True, unit_divisor = 1024)
+        self._start: Final[float] = time.perf_counter()
+        self.planned_audio_sec = 0.0
+        self.done_audio_sec = 0.0
+
+    def planned(self, patch: Patch) :
+        size, audio_sec = patch_cost(patch)
+        with self._lock :
+            self.planned_audio_sec += audio_sec
+            self._bar.total += size
+            self._bar.refresh()
+
+    def done(self, patch: Patch) :
+        size, audio_sec = patch_cost(patch)
+        with self._lock :
+            self.done_audio_sec += audio_sec
+            elapsed = time.perf_counter() - self._start
+            audio_rate = self.done_audio_sec / elapsed if elapsed > 0 else 0.0
+            self._bar.set_postfix_str(f"audio {int(self.done_audio_sec)}/{int(self.planned_audio_sec)}s, {audio_rate:.1f}s/s", refresh = False)
+            self._bar.update(size)
+
+    def close(self) :
+        self._bar.close()
@@ -0,0 +1,86 @@
+
+import os
+import json
+import threading
+
+from typing import Final, Iterable, Optional, TextIO
+
+
+JOURNAL_FILENAME = '.mp3conv-journal'
+
+
+class JournalState :
+
+    def __init__(self, trusted: bool, unfinished: "set[str]") :
+        # Whether the manifest could be trusted when the interrupted run started
+        self.trusted: Final[bool] = trusted
+        # Targets of the patches that were started but never completed, relative to the destination directory
+        self.unfinished: Final[set[str]] = unfinished
+
+
+# Append-only log of the patches started and completed during a run, kept at the root of the destination directory.
+# It is removed when a run goes to completion, so its presence means that the previous run was interrupted.
+class RunJournal :
+
+    def __init__(self, directory: str) :
+        self.directory: Final[str] = directory
+        self.filepath: Final[str] = os.path.join(directory, JOURNAL_FILENAME)
+        self._lock = threading.Lock()
+        self._file: Optional[TextIO] = None
+
+    # Reads the journal left by an interrupted run, if any
+    def recover(self) -> Optional[JournalState] :
+        if not os.path.exists(self.filepath) :
+            return None
+        trusted = False
+        unfinished: "set[str]" = set()
+        with open(self.filepath, 'r') as f :
+            for line in f :
+                try :
+                    op, value = json.loads(line)
+                except ValueError :
+                    # The last line may have been cut by a crash
+                    continue
+                if op == 'run' :
+                    trusted = value == 'trusted'
+                elif op == 'start' :
+                    unfinished.add(value)
+                elif op == 'done' :
+                    unfinished.discard(value)
+        return JournalState(trusted, unfinished)
+
+    # The journal of a previous run is replaced, it must have been recovered first
+    def open(self, trusted: bool) :
+        self._file = open(self.filepath, 'w')
+        self._write('run', 'trusted' if trusted else 'untrusted')
+
+    def start(self, targets: "Iterable[str]") :
+        for target in targets :
+            self._write('start', self._relative(target))
+
+    def done(self, targets: "Iterable[str]") :
+        for target in targets :
+            self._write('done', self._relative(target))
+
+    def close(self) :
+        with self._lock :
+            if self._file is not None :
+                self._file.close()
+                self._file = None
+
+    def discard(self) :
+        self.close()
+        try :
+            os.remove(self.filepath)
+        except FileNotFoundError :
+            pass
+
+    def _write(self, op: str, value: str) :
+        with self._lock :
+            if self._file is None :
+                return
+            self._file.write(json.dumps([ op, value ]) + '\n')
+            self._file.flush()
+
+    def _relative(self, target: str) -> str :
+        return os.path.relpath(target, self.directory)
@@ -0,0 +1,208 @@
+
+import os
+import sqlite3
+import threading
+from stat import S_ISREG
+
+from src.collections.file_tree import FilesystemNode
+
+from typing import Final, Iterable, Optional, Tuple
+
+
+MANIFEST_FILENAME = '.mp3conv-manifest.sqlite'
+MANIFEST_VERSION  = '4'
+
+# Columns added by each version, the manifests from the previous versions are migrated in place.
+# The values of the new columns are only known for the files written from now on.
+MANIFEST_MIGRATIONS: Final[dict[str, Tuple[str, ...]]] = {
+    '2': ('source_size INTEGER', 'source_mtime INTEGER'),
+    '3': ('audio_hash TEXT',)
+}
+
+
+# Keeps track of every file written in the destination directory by the script, so that the destination
+# tree can be rebuilt without scanning the whole directory. The manifest is only trusted if the last run
+# that modified the destination directory went to completion.
+class DestinationManifest :
+
+    def __init__(self, directory: str, readonly: bool = False) :
+        self.directory: Final[str] = directory
+        self.filepath: Final[str] = os.path.join(directory, MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._trusted_run = False
+        if readonly :
+            if os.path.exists(self.filepath) :
+                self._conn = sqlite3.connect(f"file:{self.filepath}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self._conn = sqlite3.connect(self.filepath, check_same_thread=False)
+        with self._conn :
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            version = self._get_meta('version')
+            if version in MANIFEST_MIGRATIONS :
+                for migrated in sorted(v for v in MANIFEST_MIGRATIONS if int(v) >= int(version)) :
+                    for column in MANIFEST_MIGRATIONS[migrated] :
+                        self._conn.execute(f"ALTER TABLE outputs ADD COLUMN {column}")
+                self._set_meta('version', MANIFEST_VERSION)
+            elif version != MANIFEST_VERSION :
+                # Manifests from other versions are rebuilt from a scan of the destination
+                self._conn.execute('DROP TABLE IF EXISTS outputs')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS outputs (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, source TEXT, fingerprint TEXT, source_size INTEGER, source_mtime INTEGER, audio_hash TEXT)')
+
+    def close(self) :
+        if self._conn is not None :
+            self._conn.close()
+            self._conn = None
+
+    def _get_meta(self, key: str) -> Optional[str] :
+        try :
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error :
+            return None
+        return None if row is None else row[0]
+
+    def _set_meta(self, key: str, value: str) :
+        self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def is_trusted(self) -> bool :
+        if self._conn is None :
+            return False
+        with self._lock :
+            return self._get_meta('version') == MANIFEST_VERSION and self._get_meta('clean') == '1'
+
+    def build_tree(self) -> FilesystemNode :
+        res = FilesystemNode(self.directory)
+        with self._lock :
+            rows = self._conn.execute('SELECT path, mtime_ns FROM outputs').fetchall()
+        for path, mtime_ns in rows :
+            directory, filename = os.path.split(path)
+            name, extension = os.path.splitext(filename)
+            res.push_file(directory, name, extension[1:], mtime_ns)
+        res.freeze()
+        return res
+
+    # Replaces the content of the manifest with a scanned tree, the known sources of the files that were not modified are kept
+    def reset(self, tree: FilesystemNode) :
+        with self._lock, self._conn :
+            known = { row[0]: row[1:] for row in self._conn.execute('SELECT path, mtime_ns, source, fingerprint, source_size, source_mtime, audio_hash FROM outputs') }
+            rows = []
+            for path in _list_files(tree, '') :
+                mtime_ns = self._stat_mtime(path)
+                previous = known.get(path)
+                if previous is not None and previous[0] == mtime_ns :
+                    rows.append((path, mtime_ns, *previous[1:]))
+                else :
+                    rows.append((path, mtime_ns, None, None, None, None, None))
+            self._conn.execute('DELETE FROM outputs')
+            self._conn.executemany('INSERT INTO outputs (path, mtime_ns, source, fingerprint, source_size, source_mtime, audio_hash) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self._set_meta('version', MANIFEST_VERSION)
+            self._set_meta('clean', '1')
+
+    def begin_run(self) :
+        self._trusted_run = self.is_trusted()
+        with self._lock, self._conn :
+            self._set_meta('clean', '0')
+
+    # A manifest that was not trusted before the run (e.g. if only a part of the destination was processed) stays untrusted
+    def end_run(self) :
+        if not self._trusted_run :
+            return
+        with self._lock, self._conn :
+            self._set_meta('clean', '1')
+
+    # The Convert-Keep settings (threshold and default value) that every output was checked against, if they are known.
+    # As long as they don't change, the tags of the sources whose output is up to date don't have to be read again.
+    def keep_settings(self) -> Optional[str] :
+        if self._conn is None :
+            return None
+        with self._lock :
+            return self._get_meta('keep_settings')
+
+    def set_keep_settings(self, settings: Optional[str]) :
+        with self._lock, self._conn :
+            if settings is None :
+                self._conn.execute('DELETE FROM meta WHERE key = ?', ('keep_settings',))
+            else :
+                self._set_meta('keep_settings', settings)
+
+    # Brings the entries of the files touched by an interrupted run up to date with the destination directory.
+    # If the manifest was trusted when the interrupted run started, it can be trusted again afterwards.
+    def recover(self, unfinished: "Iterable[str]", trusted: bool) :
+        with self._lock, self._conn :
+            for path in unfinished :
+                try :
+                    stat = os.stat(os.path.join(self.directory, path))
+                except FileNotFoundError :
+                    self._conn.execute('DELETE FROM outputs WHERE path = ?', (path,))
+                    continue
+                if not S_ISREG(stat.st_mode) :
+                    continue
+                # Files are renamed once complete, but the source of the content is unknown, so are its fingerprint and audio hash
+                self._conn.execute('INSERT OR IGNORE INTO outputs (path, mtime_ns, source, fingerprint) VALUES (?, ?, NULL, NULL)', (path, stat.st_mtime_ns))
+                self._conn.execute('UPDATE outputs SET mtime_ns = ?, fingerprint = NULL, audio_hash = NULL WHERE path = ? AND mtime_ns != ?', (stat.st_mtime_ns, path, stat.st_mtime_ns))
+            if trusted and self._get_meta('version') == MANIFEST_VERSION :
+                self._set_meta('clean', '1')
+
+    # The fingerprint is the one of the source file before it was converted, if it was computed.
+    # The size and modification time of the source identify it if it is moved later on.
+    # The audio hash of the source tells whether only its tags changed since it was converted.
+    def record(self, dest_file: str, source_file: str, fingerprint: Optional[str] = None, source_size: Optional[int] = None, source_mtime: Optional[int] = None, audio_hash: Optional[str] = None) :
+        path = self._relative(dest_file)
+        mtime_ns = self._stat_mtime(path)
+        with self._lock, self._conn :
+            self._conn.execute(
+                'INSERT OR REPLACE INTO outputs (path, mtime_ns, source, fingerprint, source_size, source_mtime, audio_hash) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (path, mtime_ns, source_file, fingerprint, source_size, source_mtime, audio_hash)
+            )
+
+    # Returns the size and modification time of the source of an output file, if they are known
+    def source_identity(self, dest_file: str) -> Optional[Tuple[int, int]] :
+        if self._conn is None :
+            return None
+        with self._lock :
+            try :
+                row = self._conn.execute('SELECT source_size, source_mtime FROM outputs WHERE path = ?', (self._relative(dest_file),)).fetchone()
+            except sqlite3.Error :
+                return None
+        if row is None or row[0] is None or row[1] is None :
+            return None
+        return (row[0], row[1])
+
+    # Returns the audio hash of the source of an output file, if it is known
+    def audio_hash(self, dest_file: str) -> Optional[str] :
+        if self._conn is None :
+            return None
+        with self._lock :
+            try :
+                row = self._conn.execute('SELECT audio_hash FROM outputs WHERE path = ?', (self._relative(dest_file),)).fetchone()
+            except sqlite3.Error :
+                return None
+        return None if row is None else row[0]
+
+    # Returns the source and fingerprint recorded for an output file
+    def lookup(self, dest_file: str) -> Optional[Tuple[Optional[str], Optional[str]]] :
+        if self._conn is None :
+            return None
+        with self._lock :
+            try :
+                return self._conn.execute('SELECT source, fingerprint FROM outputs WHERE path = ?', (self._relative(dest_file),)).fetchone()
+            except sqlite3.Error :
+                return None
+
+    def forget(self, dest_file: str) :
+        path = self._relative(dest_file)
+        with self._lock, self._conn :
+            self._conn.execute('DELETE FROM outputs WHERE path = ?', (path,))
+
+    def _relative(self, dest_file: str) -> str :
+        return os.path.relpath(dest_file, self.directory)
+
+    def _stat_mtime(self, path: str) -> int :
+        return os.stat(os.path.join(self.directory, path)).st_mtime_ns
+
+
+def _list_files(node: FilesystemNode, path: str) -> Iterable[str] :
+    for leaf in node.iter_files() :
+        yield os.path.join(path, leaf.filename())
+    for child in node.subfolders.values() :
+        yield from _list_files(child, os.path.join(path, child.name))
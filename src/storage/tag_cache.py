@@ -0,0 +1,97 @@
+
+import os
+import sqlite3
+import threading
+
+from src.metrics import MetadataCounters
+
+from typing import Final, Optional, Tuple
+
+
+TAG_CACHE_VERSION     = '1'
+TAG_CACHE_MAX_ENTRIES = 2_000_000
+TAG_CACHE_BATCH_SIZE  = 1000
+# Number of full runs after which the entries of the files they did not see are evicted
+TAG_CACHE_KEPT_RUNS   = 3
+
+
+def default_tag_cache_path() -> str :
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'mp3conv', 'tags.sqlite')
+
+
+# Persistent cache of the raw Convert-Keep values, indexed by the identity of the files.
+# An entry is only used if the device, inode, size and modification time of the file did not change.
+# The entries of the files that were not seen by the last full runs (over the whole library) are evicted, the files were removed
+# or replaced, or their tags were not needed since (see `lazy_keep`). When the cache grows beyond its maximum size, the entries that were not used during the run are evicted first.
+class TagCache :
+
+    def __init__(self, filepath: str, counters: MetadataCounters, max_entries: int = TAG_CACHE_MAX_ENTRIES) :
+        self.filepath: Final[str] = filepath
+        self.max_entries: Final[int] = max_entries
+        self._counters = counters
+        self._lock = threading.Lock()
+        self._seen: list[Tuple[int, int]] = []
+        self._stored: list[tuple] = []
+        os.makedirs(os.path.dirname(filepath), exist_ok = True)
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        with self._conn :
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', ('version',)).fetchone()
+            if row is None or row[0] != TAG_CACHE_VERSION :
+                self._conn.execute('DROP TABLE IF EXISTS tags')
+                self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('version', TAG_CACHE_VERSION))
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS tags ('
+                'dev INTEGER, inode INTEGER, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, keep TEXT, last_run INTEGER NOT NULL, '
+                'PRIMARY KEY (dev, inode))'
+            )
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', ('run',)).fetchone()
+            self._run = 1 if row is None else int(row[0]) + 1
+            self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('run', str(self._run)))
+
+    # Returns whether the file was found in the cache, and the cached raw value of its tag
+    def lookup(self, stat: os.stat_result) -> Tuple[bool, Optional[str]] :
+        with self._lock :
+            row = self._conn.execute(
+                'SELECT keep FROM tags WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?',
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+            if row is None :
+                self._counters.incr('miss')
+                return (False, None)
+            self._counters.incr('hit')
+            self._seen.append((stat.st_dev, stat.st_ino))
+            return (True, row[0])
+
+    def store(self, stat: os.stat_result, keep: Optional[str]) :
+        with self._lock :
+            self._stored.append((stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, keep, self._run))
+            if len(self._stored) >= TAG_CACHE_BATCH_SIZE :
+                with self._conn :
+                    self._flush()
+
+    def _flush(self) :
+        self._conn.executemany('INSERT OR REPLACE INTO tags (dev, inode, size, mtime_ns, keep, last_run) VALUES (?, ?, ?, ?, ?, ?)', self._stored)
+        self._stored.clear()
+
+    # The runs restricted to a part of the library and the interrupted runs are not full runs
+    def close(self, full_run: bool = False) :
+        with self._lock, self._conn :
+            self._flush()
+            self._conn.executemany('UPDATE tags SET last_run = ? WHERE dev = ? AND inode = ?', ((self._run, dev, inode) for dev, inode in self._seen))
+            self._seen.clear()
+            if full_run :
+                row = self._conn.execute('SELECT value FROM meta WHERE key = ?', ('full_runs',)).fetchone()
+                full_runs = ([] if row is None else [ int(run) for run in row[0].split() ]) + [ self._run ]
+                full_runs = full_runs[-TAG_CACHE_KEPT_RUNS:]
+                self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('full_runs', ' '.join(str(run) for run in full_runs)))
+                if len(full_runs) == TAG_CACHE_KEPT_RUNS :
+                    self._conn.execute('DELETE FROM tags WHERE last_run < ?', (full_runs[0],))
+            count = self._conn.execute('SELECT COUNT(*) FROM tags').fetchone()[0]
+            if count > self.max_entries :
+                self._conn.execute(
+                    'DELETE FROM tags WHERE rowid IN (SELECT rowid FROM tags WHERE last_run < ? ORDER BY last_run LIMIT ?)',
+                    (self._run, count - self.max_entries)
+                )
+        self._conn.close()
@@ -0,0 +1,258 @@
+
+import os
+import json
+import time
+import shutil
+import socket
+import secrets
+import threading
+
+from typing import Final, Optional, Tuple
+
+
+# A claim that was not seen renewed for this long is considered abandoned (e.g. its worker crashed), the item is put back in the queue
+LEASE_SEC = 60.0
+# Workers renew their claims several times per lease, so that a slow filesystem does not make them expire
+RENEW_SEC = LEASE_SEC / 4
+# Interval at which the queue is polled for new items and completed items
+POLL_SEC = 0.5
+
+PENDING_DIR = 'pending'
+CLAIMED_DIR = 'claimed'
+DONE_DIR    = 'done'
+OUTPUT_DIR  = 'output'
+
+
+def _write_atomically(filepath: str, data: dict) :
+    parent, name = os.path.split(filepath)
+    tmp = os.path.join(parent, f".{name}.tmp")
+    with open(tmp, 'w') as f :
+        json.dump(data, f)
+    os.replace(tmp, filepath)
+
+
+def _read(filepath: str) -> dict :
+    with open(filepath, 'r') as f :
+        return json.load(f)
+
+
+# A queue of conversions kept in a directory shared by several hosts, which only relies on atomic renames :
+# - the coordinator publishes an item as `pending/<item>.json`
+# - a worker claims it by renaming it to `claimed/<item>.<claim>.json`, and renews its lease by updating the modification date of the file
+# - the worker writes the outputs and the result in `output/`, and acknowledges the item by renaming its claim to `done/<item>.<claim>.json`
+# - the coordinator collects the outputs and removes the files of the item
+# A claim that is not renewed expires, the item is then renamed back to `pending/` by the coordinator or by another worker.
+# The worker that lost the claim can't acknowledge it anymore, its outputs are discarded.
+# The clocks of the hosts may differ : the modification dates of the claims are only compared with the ones seen by the
+# previous polls of the same process, a claim expires once its date did not change for a lease on the local monotonic clock.
+class WorkQueue :
+
+    def __init__(self, directory: str, lease_sec: float = LEASE_SEC) :
+        self.directory : Final[str] = directory
+        self.lease_sec : Final[float] = lease_sec
+        for subdir in (PENDING_DIR, CLAIMED_DIR, DONE_DIR, OUTPUT_DIR) :
+            os.makedirs(os.path.join(directory, subdir), exist_ok = True)
+        self._lock = threading.Condition()
+        self._run = secrets.token_hex(4)
+        self._seq = 0
+        self._published: "set[str]" = set()
+        self._results: "dict[str, Tuple[str, dict]]" = {}
+        self._next_poll = 0.0
+        self._polling = False
+        # Last time the published items were seen progressing (claimed, completed or none pending), and last report of items left pending
+        self._progress_time: Optional[float] = None
+        self._report_time = 0.0
+        # Modification date of each claim when it was last seen changing, and when that was on the monotonic clock
+        self._claims_lock = threading.Lock()
+        self._claims_seen: "dict[str, Tuple[int, float]]" = {}
+
+    def _path(self, subdir: str, name: str) -> str :
+        return os.path.join(self.directory, subdir, name)
+
+    def output_path(self, item_id: str, claim: str, index: int, extension: str) -> str :
+        return self._path(OUTPUT_DIR, f"{item_id}.{claim}.{index}.{extension}")
+
+    def _result_path(self, item_id: str, claim: str) -> str :
+        return self._path(OUTPUT_DIR, f"{item_id}.{claim}.result.json")
+
+    # Removes the items left by a previous coordinator, the workers that still hold one of them won't be able to acknowledge it
+    def reset(self) :
+        for subdir in (PENDING_DIR, CLAIMED_DIR, DONE_DIR, OUTPUT_DIR) :
+            shutil.rmtree(self._path(subdir, ''), ignore_errors = True)
+            os.makedirs(self._path(subdir, ''), exist_ok = True)
+
+    # ===== Coordinator =====
+
+    # The identifiers are sorted in the order of publication, the workers claim the oldest items first
+    def publish(self, item: dict) -> str :
+        with self._lock :
+            item_id = f"{self._run}-{self._seq:09d}"
+            self._seq += 1
+            self._published.add(item_id)
+        _write_atomically(self._path(PENDING_DIR, f"{item_id}.json"), item)
+        return item_id
+
+    # Blocks until a worker acknowledged the item, returns the claim under which it was processed and its result.
+    # The queue is polled by one of the waiting threads at a time, without holding the lock : the other threads
+    # can publish and collect their results in the meantime.
+    def wait(self, item_id: str) -> "Tuple[str, dict]" :
+        while True :
+            with self._lock :
+                while item_id not in self._results :
+                    now = time.monotonic()
+                    if not self._polling and now >= self._next_poll :
+                        break
+                    self._lock.wait(None if self._polling else self._next_poll - now)
+                if item_id in self._results :
+                    self._published.discard(item_id)
+                    return self._results.pop(item_id)
+                self._polling = True
+                self._next_poll = now + POLL_SEC
+                expected = self._published.difference(self._results)
+            results: "dict[str, Tuple[str, dict]]" = {}
+            try :
+                results = self._poll(expected)
+            finally :
+                with self._lock :
+                    self._polling = False
+                    for done_id, result in results.items() :
+                        if done_id in self._published :
+                            self._results.setdefault(done_id, result)
+                    self._lock.notify_all()
+
+    def _poll(self, expected: "set[str]") -> "dict[str, Tuple[str, dict]]" :
+        res = self._collect(expected)
+        claimed = self.requeue_expired()
+        pending = 0
+        for name in os.listdir(self._path(PENDING_DIR, '')) :
+            if name.endswith('.json') and name[:-len('.json')] in expected :
+                pending += 1
+        # Without any worker on the queue, the coordinator would wait silently
+        now = time.monotonic()
+        if self._progress_time is None or pending == 0 or len(res) > 0 or any(item_id in expected for item_id in claimed) :
+            self._progress_time = now
+        elif now - self._progress_time >= self.lease_sec and now - self._report_time >= self.lease_sec :
+            self._report_time = now
+            print(f"{pending} items are waiting in {self.directory}, none was claimed for {int(now - self._progress_time)}s (is a worker running on the queue ?)")
+        return res
+
+    def _collect(self, expected: "set[str]") -> "dict[str, Tuple[str, dict]]" :
+        res: "dict[str, Tuple[str, dict]]" = {}
+        for name in os.listdir(self._path(DONE_DIR, '')) :
+            if name.startswith('.') or not name.endswith('.json') :
+                continue
+            item_id, claim = name[:-len('.json')].split('.', 1)
+            if item_id not in expected or item_id in res :
+                continue
+            try :
+                result = _read(self._result_path(item_id, claim))
+            except (OSError, ValueError) as e :
+                result = { 'error': f"unreadable result : {e}" }
+            res[item_id] = (claim, result)
+        return res
+
+    # Removes the files of an item once its outputs were collected
+    def discard(self, item_id: str, claim: str, count: int, extensions: "list[str]") :
+        for index in range(count) :
+            self._unlink(self.output_path(item_id, claim, index, extensions[index]))
+        self._unlink(self._result_path(item_id, claim))
+        self._unlink(self._path(DONE_DIR, f"{item_id}.{claim}.json"))
+
+    # Gives up on an item that was not claimed yet, returns False if it is already being processed
+    def withdraw(self, item_id: str) -> bool :
+        try :
+            os.unlink(self._path(PENDING_DIR, f"{item_id}.json"))
+        except FileNotFoundError :
+            return False
+        with self._lock :
+            self._published.discard(item_id)
+        return True
+
+    # ===== Workers =====
+
+    @staticmethod
+    def new_claim() -> str :
+        return f"{socket.gethostname().replace('.', '_')}-{os.getpid()}-{secrets.token_hex(4)}"
+
+    # Returns the identifier and the content of the oldest pending item, if any
+    def claim(self, claim: str) -> "Optional[Tuple[str, dict]]" :
+        for name in sorted(os.listdir(self._path(PENDING_DIR, ''))) :
+            if name.startswith('.') or not name.endswith('.json') :
+                continue
+            item_id = name[:-len('.json')]
+            claimed = self._path(CLAIMED_DIR, f"{item_id}.{claim}.json")
+            try :
+                os.rename(self._path(PENDING_DIR, name), claimed)
+            except FileNotFoundError :
+                continue # claimed by another worker
+            # The lease starts now, not when the item was published
+            try :
+                os.utime(claimed)
+            except FileNotFoundError :
+                continue # requeued by another host in the meantime
+            try :
+                return (item_id, _read(claimed))
+            except (OSError, ValueError) :
+                self._unlink(claimed)
+        return None
+
+    # Returns False if the claim expired and was taken back
+    def renew(self, item_id: str, claim: str) -> bool :
+        try :
+            os.utime(self._path(CLAIMED_DIR, f"{item_id}.{claim}.json"))
+            return True
+        except FileNotFoundError :
+            return False
+
+    # Puts an item back in the queue, e.g. when its worker is stopped
+    def release(self, item_id: str, claim: str) :
+        try :
+            os.rename(self._path(CLAIMED_DIR, f"{item_id}.{claim}.json"), self._path(PENDING_DIR, f"{item_id}.json"))
+        except FileNotFoundError :
+            pass
+
+    # The result must be written before the item is acknowledged. Returns False if the claim expired in the meantime.
+    def acknowledge(self, item_id: str, claim: str, result: dict) -> bool :
+        _write_atomically(self._result_path(item_id, claim), result)
+        try :
+            os.rename(self._path(CLAIMED_DIR, f"{item_id}.{claim}.json"), self._path(DONE_DIR, f"{item_id}.{claim}.json"))
+            return True
+        except FileNotFoundError :
+            self._unlink(self._result_path(item_id, claim))
+            return False
+
+    # Returns the identifiers of the items whose claims are still valid.
+    # A claim seen for the first time is valid for a whole lease, even if it was abandoned long ago.
+    def requeue_expired(self) -> "list[str]" :
+        res = []
+        with self._claims_lock :
+            now = time.monotonic()
+            names = [ name for name in os.listdir(self._path(CLAIMED_DIR, '')) if not name.startswith('.') and name.endswith('.json') ]
+            for name in set(self._claims_seen).difference(names) :
+                del self._claims_seen[name]
+            for name in names :
+                claimed = self._path(CLAIMED_DIR, name)
+                item_id = name.split('.', 1)[0]
+                try :
+                    mtime = os.stat(claimed).st_mtime_ns
+                    seen = self._claims_seen.get(name)
+                    if seen is None or seen[0] != mtime :
+                        self._claims_seen[name] = (mtime, now)
+                        res.append(item_id)
+                        continue
+                    if now - seen[1] <= self.lease_sec :
+                        res.append(item_id)
+                        continue
+                    os.rename(claimed, self._path(PENDING_DIR, f"{item_id}.json"))
+                    del self._claims_seen[name]
+                    print(f"Claim {name[len(item_id)+1:-len('.json')]} on {item_id} expired, the item is back in the queue")
+                except FileNotFoundError :
+                    pass # acknowledged or requeued by someone else in the meantime
+        return res
+
+    @staticmethod
+    def _unlink(filepath: str) :
+        try :
+            os.unlink(filepath)
+        except FileNotFoundError :
+            pass
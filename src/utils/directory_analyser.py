@@ -1,10 +1,10 @@
 
-import re
+import os
 import logging
-import subprocess
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from typing import Sequence
+from typing import Optional, Sequence, Tuple
 
 from src.collections.file_tree import FilesystemNode
 
@@ -12,48 +12,87 @@ from src.collections.file_tree import FilesystemNode
 logger = logging.getLogger(__name__)
 
 
-def __make_extension_filter(extensions: Sequence[str]) -> Sequence[str] :
-    if len(extensions) == 0 :
-        return []
-    res = ['-name', f"*.{extensions[0]}"]
-    for ext in extensions[1:] :
-        res.extend(['-o', '-name', f"*.{ext}"])
-    return res
+SCAN_WORKERS = 8
 
 
-find_line_reg = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\.\d+ ([+-]\d{4}) (.+)/([^/]+)\.([^/.]+)')
+class _DirectoryScan :
 
-def scan_directory(directory: str, extensions: Sequence[str]) :
-    command = ['find', directory, '-type', 'f', '-a', '(', *__make_extension_filter(extensions), ')', '-printf', '%TF %TT %Tz %p\\n']
-    r = subprocess.run(command, check=True, capture_output=True)
+    def __init__(self, extensions: Sequence[str], pool: ThreadPoolExecutor) :
+        # When several files only differ by their extension, the first extension in the list wins
+        self.extensions_weight = {
+            ext: len(extensions) - i
+            for i, ext in enumerate(extensions)
+        }
+        self._pool = pool
+        self._done = threading.Condition()
+        self._pending = 0
+        self._error: Optional[BaseException] = None
 
-    extensions_weight = {
-        ext: len(extensions) - i
-        for i, ext in enumerate(extensions)
-    }
+    def run(self, node: FilesystemNode, path: str) :
+        self._submit(node, path)
+        with self._done :
+            while self._pending > 0 :
+                self._done.wait()
+        if self._error is not None :
+            raise self._error
 
-    res = FilesystemNode(directory)
+    def _submit(self, node: FilesystemNode, path: str) :
+        with self._done :
+            self._pending += 1
+        self._pool.submit(self._scan, node, path)
+
+    def _scan(self, node: FilesystemNode, path: str) :
+        try :
+            if self._error is None :
+                self._scan_entries(node, path)
+        except BaseException as e :
+            with self._done :
+                if self._error is None :
+                    self._error = e
+        with self._done :
+            self._pending -= 1
+            if self._pending == 0 :
+                self._done.notify_all()
+
+    # The files of a directory are added to its node once it was listed, and sorted in the thread that scanned it
+    def _scan_entries(self, node: FilesystemNode, path: str) :
+        files: "dict[str, Tuple[str, int, int]]" = {}
+        with os.scandir(path) as it :
+            for entry in it :
+                if entry.is_dir(follow_symlinks = False) :
+                    self._submit(node.push_subfolder(entry.name), entry.path)
+                    continue
+                name, _, extension = entry.name.rpartition('.')
+                if len(name) == 0 or extension not in self.extensions_weight :
+                    continue
+                if not entry.is_file(follow_symlinks = False) :
+                    continue
+                registered_file = files.get(name)
+                if registered_file is not None :
+                    if self.extensions_weight[extension] < self.extensions_weight[registered_file[0]] :
+                        continue
+                stat = entry.stat(follow_symlinks = False)
+                logger.debug("(%d) %s", stat.st_mtime_ns, entry.path)
+                files[name] = (extension, stat.st_mtime_ns, stat.st_size)
+        for name, (extension, mtime_ns, size) in files.items() :
+            node._add_file(name, extension, mtime_ns, size)
+        if len(files) > 0 :
+            node._seal()
 
-    prefix_len = len(directory) + 1
-    lines = r.stdout.decode('utf8').rstrip('\n').split('\n')
-    if len(lines[0]) <= 1 : # Basically if there are no matching files in the directory
-        return res
-
-    for line in lines :
-        m = find_line_reg.fullmatch(line)
-        if m is None :
-            logger.warn(f"Bad format for line : \"{line}\"")
-            continue
-        date_repr = f"{m.group(1)} {m.group(2)}"
-        directory = m.group(3)[prefix_len:]
-        filename = m.group(4)
-        extension = m.group(5)
-        logger.debug("(%s) %s/%s.%s", date_repr, directory, filename, extension)
-        registered_file = res.get_file(directory, filename)
-        if registered_file is not None :
-            if extensions_weight[extension] < extensions_weight[registered_file.extension] :
-                continue
-        dt = datetime.strptime(date_repr, '%Y-%m-%d %H:%M:%S %z')
-        res.push_file(directory, filename, extension, dt)
 
+# Like with `find`, folders that do not contain any matching file are not part of the tree
+def __count_files(node: FilesystemNode) -> int :
+    for name, child in list(node.subfolders.items()) :
+        count = __count_files(child)
+        if count == 0 :
+            node.drop_folder(name)
+        node.file_count += count
+    return node.file_count
+
+
+def scan_directory(directory: str, extensions: Sequence[str], workers: int = SCAN_WORKERS) -> FilesystemNode :
+    res = FilesystemNode(directory)
+    with ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'scan') as pool :
+        _DirectoryScan(extensions, pool).run(res, directory)
+    __count_files(res)
     return res
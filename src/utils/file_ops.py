@@ -0,0 +1,221 @@
+
+import os
+import errno
+import fcntl
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from typing import Final, Iterator
+
+
+# ioctl(dest_fd, FICLONE, src_fd) shares the extents of the source on filesystems that support reflinks (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Files are written under a temporary name first, and renamed once complete
+PART_SUFFIX = '.part'
+
+# Errors meaning that an accelerated copy method is not available for these files
+_UNSUPPORTED = { errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM }
+
+
+class _Directory :
+    __slots__ = ('fd', 'users', 'detached')
+
+    def __init__(self, fd: int) :
+        self.fd = fd
+        self.users = 0
+        self.detached = False
+
+
+# Keeps file descriptors on the most recently used directories, so that files can be created and removed
+# relative to them instead of resolving their whole path each time
+class DirectoryCache :
+
+    def __init__(self, capacity: int = 64) :
+        self.capacity: Final[int] = capacity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Directory]" = OrderedDict()
+
+    @contextmanager
+    def borrow(self, path: str) -> Iterator[int] :
+        with self._lock :
+            entry = self._entries.get(path)
+            if entry is None :
+                entry = _Directory(os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC))
+                self._entries[path] = entry
+                self._evict()
+            else :
+                self._entries.move_to_end(path)
+            entry.users += 1
+        try :
+            yield entry.fd
+        finally :
+            with self._lock :
+                entry.users -= 1
+                if entry.detached and entry.users == 0 :
+                    os.close(entry.fd)
+
+    # Must be called when a directory is removed
+    def forget(self, path: str) :
+        with self._lock :
+            entry = self._entries.pop(path, None)
+            if entry is not None :
+                self._detach(entry)
+
+    def close(self) :
+        with self._lock :
+            for entry in self._entries.values() :
+                self._detach(entry)
+            self._entries.clear()
+
+    def _detach(self, entry: _Directory) :
+        entry.detached = True
+        if entry.users == 0 :
+            os.close(entry.fd)
+
+    def _evict(self) :
+        while len(self._entries) > self.capacity :
+            _, entry = self._entries.popitem(last = False)
+            self._detach(entry)
+
+
+directories = DirectoryCache()
+
+
+# A directory may already exist if it was created by an interrupted run
+def make_directory(path: str) :
+    parent, name = os.path.split(path)
+    with directories.borrow(parent) as parent_fd :
+        try :
+            os.mkdir(name, dir_fd = parent_fd)
+        except FileExistsError :
+            if not os.path.isdir(path) :
+                raise
+
+
+def remove_directory(path: str) :
+    parent, name = os.path.split(path)
+    directories.forget(path)
+    with directories.borrow(parent) as parent_fd :
+        os.rmdir(name, dir_fd = parent_fd)
+
+
+def remove_file(path: str) :
+    parent, name = os.path.split(path)
+    with directories.borrow(parent) as parent_fd :
+        os.unlink(name, dir_fd = parent_fd)
+
+
+def _unlink_if_exists(name: str, parent_fd: int) :
+    try :
+        os.unlink(name, dir_fd = parent_fd)
+    except FileNotFoundError :
+        pass
+
+
+def _copy_data(src_fd: int, dst_fd: int, size: int) :
+    try :
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return
+    except OSError as e :
+        if e.errno not in _UNSUPPORTED :
+            raise
+    copied = 0
+    try :
+        while copied < size :
+            n = os.copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE)
+            if n == 0 :
+                break
+            copied += n
+        return
+    except OSError as e :
+        if e.errno not in _UNSUPPORTED or copied > 0 :
+            raise
+    try :
+        while copied < size :
+            n = os.sendfile(dst_fd, src_fd, copied, COPY_CHUNK_SIZE)
+            if n == 0 :
+                break
+            copied += n
+        return
+    except OSError as e :
+        if e.errno not in _UNSUPPORTED or copied > 0 :
+            raise
+    with open(src_fd, 'rb', closefd = False) as fsrc, open(dst_fd, 'wb', closefd = False) as fdst :
+        shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+
+
+def move_file(source: str, dest: str) :
+    source_parent, source_name = os.path.split(source)
+    dest_parent, dest_name = os.path.split(dest)
+    with directories.borrow(source_parent) as source_fd, directories.borrow(dest_parent) as dest_fd :
+        os.replace(source_name, dest_name, src_dir_fd = source_fd, dst_dir_fd = dest_fd)
+
+
+def remove_part(path: str) :
+    try :
+        remove_file(path + PART_SUFFIX)
+    except FileNotFoundError :
+        pass
+
+
+# Makes a file written under its temporary name visible under its final name
+def commit_part(path: str) :
+    parent, name = os.path.split(path)
+    with directories.borrow(parent) as parent_fd :
+        os.replace(name + PART_SUFFIX, name, src_dir_fd = parent_fd, dst_dir_fd = parent_fd)
+
+
+# Like `cp`, the copy is a new file with the modification date of the copy.
+# The destination is replaced rather than overwritten, in case it is a hard link.
+def copy_file(source: str, dest: str) :
+    parent, name = os.path.split(dest)
+    part = name + PART_SUFFIX
+    with open(source, 'rb') as fsrc, directories.borrow(parent) as parent_fd :
+        _write_part(fsrc.fileno(), part, parent_fd)
+        try :
+            os.replace(part, name, src_dir_fd = parent_fd, dst_dir_fd = parent_fd)
+        except BaseException :
+            _unlink_if_exists(part, parent_fd)
+            raise
+
+
+# Copies a file under its temporary name, so that the copy can be modified and then committed in place of the original
+def copy_to_part(path: str) :
+    parent, name = os.path.split(path)
+    with open(path, 'rb') as fsrc, directories.borrow(parent) as parent_fd :
+        _write_part(fsrc.fileno(), name + PART_SUFFIX, parent_fd)
+
+
+def _write_part(src_fd: int, part: str, parent_fd: int) :
+    _unlink_if_exists(part, parent_fd)
+    dst_fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC, 0o666, dir_fd = parent_fd)
+    try :
+        try :
+            _copy_data(src_fd, dst_fd, os.fstat(src_fd).st_size)
+        finally :
+            os.close(dst_fd)
+    except BaseException :
+        _unlink_if_exists(part, parent_fd)
+        raise
+
+
+# Falls back to a copy if both files are not on the same filesystem
+def link_file(source: str, dest: str) :
+    parent, name = os.path.split(dest)
+    part = name + PART_SUFFIX
+    with directories.borrow(parent) as parent_fd :
+        _unlink_if_exists(part, parent_fd)
+        try :
+            os.link(source, part, dst_dir_fd = parent_fd)
+        except OSError as e :
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK) :
+                raise
+        else :
+            os.replace(part, name, src_dir_fd = parent_fd, dst_dir_fd = parent_fd)
+            return
+    copy_file(source, dest)
@@ -0,0 +1,73 @@
+
+import os
+import ctypes
+import ctypes.util
+import struct
+
+from typing import Final, Iterator, Optional, Tuple
+
+
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC  = os.O_CLOEXEC
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+_libc = None
+
+def _get_libc() :
+    global _libc
+    if _libc is None :
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+    return _libc
+
+
+# Minimal binding of the Linux inotify API
+class Inotify :
+
+    def __init__(self) :
+        self.fd: Final[int] = _get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0 :
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: str, mask: int) -> int :
+        wd = _get_libc().inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0 :
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    # Yields (watch descriptor, mask, cookie, name) for the events that are currently available
+    def read_events(self) -> "Iterator[Tuple[int, int, int, Optional[str]]]" :
+        while True :
+            try :
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError :
+                return
+            offset = 0
+            while offset < len(data) :
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = None
+                if length > 0 :
+                    name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                yield (wd, mask, cookie, name)
+
+    def close(self) :
+        os.close(self.fd)
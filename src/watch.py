@@ -0,0 +1,118 @@
+
+import os
+import time
+import select
+
+from src.conversion import INPUT_EXTENSIONS, collapse_subpaths, conversion
+from src.metrics import ConversionMetrics
+from src.metrics_server import MetricsServer
+from src.utils.inotify import Inotify, IN_ATTRIB, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_IGNORED, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW
+
+from typing import Final, Optional, Sequence
+
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+
+# A batch is processed once no event was received for this long...
+DEBOUNCE_SEC = 5.0
+# ... or once the oldest pending event is this old
+MAX_DELAY_SEC = 60.0
+
+
+# Keeps track of the directories of the source tree in which something changed
+class SourceWatcher :
+
+    def __init__(self, source_dir: str) :
+        self.source_dir: Final[str] = source_dir
+        self._inotify = Inotify()
+        self._watches: dict[int, str] = {}
+        self.changed: set[str] = set()
+        self.overflow = False
+        self._add_tree('')
+
+    def fileno(self) -> int :
+        return self._inotify.fd
+
+    def _add_tree(self, subpath: str) :
+        for dirpath, _, _ in os.walk(os.path.join(self.source_dir, subpath)) :
+            try :
+                wd = self._inotify.add_watch(dirpath, WATCH_MASK)
+            except FileNotFoundError :
+                continue
+            relpath = os.path.relpath(dirpath, self.source_dir)
+            self._watches[wd] = '' if relpath == '.' else relpath
+
+    def read_events(self) :
+        for wd, mask, _, name in self._inotify.read_events() :
+            if mask & IN_Q_OVERFLOW :
+                self.overflow = True
+                continue
+            if mask & IN_IGNORED :
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or name is None :
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR :
+                if mask & (IN_CREATE | IN_MOVED_TO) :
+                    self._add_tree(path)
+                self.changed.add(path)
+            elif name.rpartition('.')[2] in INPUT_EXTENSIONS :
+                self.changed.add(directory)
+
+    # Returns the changed subtrees (None if the whole tree must be processed again) and resets the state
+    def pop_changes(self) -> Optional[Sequence[str]] :
+        changed = self.changed
+        overflow = self.overflow
+        self.changed = set()
+        self.overflow = False
+        if overflow :
+            return None
+        return collapse_subpaths(changed)
+
+    def close(self) :
+        self._inotify.close()
+
+
+def watch(source_dir: str, dest_dir: str, server: Optional[MetricsServer] = None) :
+    watcher = SourceWatcher(source_dir)
+
+    def run(subpaths: Optional[Sequence[str]]) -> ConversionMetrics :
+        metrics = conversion(source_dir, dest_dir, subpaths)
+        print()
+        metrics.summary()
+        if server is not None :
+            server.publish(metrics)
+        return metrics
+
+    try :
+        if run(None).interrupted :
+            return
+        print('Watching', source_dir)
+        first_event = None
+        last_event = None
+        while True :
+            timeout = None
+            if last_event is not None :
+                now = time.monotonic()
+                timeout = max(0.0, min(last_event + DEBOUNCE_SEC, first_event + MAX_DELAY_SEC) - now)
+            readable, _, _ = select.select([ watcher ], [], [], timeout)
+            if len(readable) > 0 :
+                watcher.read_events()
+                if len(watcher.changed) > 0 or watcher.overflow :
+                    last_event = time.monotonic()
+                    if first_event is None :
+                        first_event = last_event
+                continue
+            if last_event is None :
+                continue
+            first_event = None
+            last_event = None
+            subpaths = watcher.pop_changes()
+            print()
+            print('Changes detected in', 'the whole tree' if subpaths is None else ', '.join(f"'{p}'" for p in subpaths))
+            if run(subpaths).interrupted :
+                return
+    finally :
+        watcher.close()
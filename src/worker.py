@@ -0,0 +1,143 @@
+
+import os
+import signal
+import threading
+
+from src.patches import BatchConvertPatch, ConvertPatch
+from src.patches.batch_convert import BatchConversionError, error_summary
+from src.profiles import OutputProfile
+from src.storage.work_queue import POLL_SEC, RENEW_SEC, WorkQueue
+
+from typing import Final, Optional, Sequence, Tuple
+
+
+# Renews the leases of the items being converted by the threads of a worker
+class LeaseKeeper :
+
+    def __init__(self, queue: WorkQueue) :
+        self._queue = queue
+        self._lock = threading.Lock()
+        self._claims: "set[Tuple[str, str]]" = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = 'lease-keeper', daemon = True)
+        self._thread.start()
+
+    def add(self, item_id: str, claim: str) :
+        with self._lock :
+            self._claims.add((item_id, claim))
+
+    def remove(self, item_id: str, claim: str) :
+        with self._lock :
+            self._claims.discard((item_id, claim))
+
+    def _run(self) :
+        while not self._stop.wait(RENEW_SEC) :
+            with self._lock :
+                claims = list(self._claims)
+            for item_id, claim in claims :
+                if not self._queue.renew(item_id, claim) :
+                    print(f"Lost the claim on {item_id}, its outputs will be discarded")
+                    self.remove(item_id, claim)
+
+    def close(self) :
+        self._stop.set()
+        self._thread.join()
+
+
+class Worker :
+
+    def __init__(self, queue_dir: str, jobs: int) :
+        self.queue : Final[WorkQueue] = WorkQueue(queue_dir)
+        self.jobs  : Final[int] = max(1, jobs)
+        self.stopping = threading.Event()
+        self._leases = LeaseKeeper(self.queue)
+        self._lock = threading.Lock()
+        self.converted = 0
+        self.failed = 0
+
+    def conversions(self, item_id: str, claim: str, item: dict) -> "Sequence[ConvertPatch]" :
+        res = []
+        for index, output in enumerate(item['outputs']) :
+            profile = OutputProfile(self.queue.directory, output['codec'], output['quality'])
+            res.append(ConvertPatch(output['source'], self.queue.output_path(item_id, claim, index, profile.extension), profile))
+        return res
+
+    # The result gives the error of each output, the coordinator keeps the outputs that were converted
+    def process(self, item_id: str, claim: str, item: dict) :
+        conversions = self.conversions(item_id, claim, item)
+        patch = conversions[0] if len(conversions) == 1 else BatchConvertPatch(conversions)
+        print(f"{patch.describe()} ({item_id})")
+        self._leases.add(item_id, claim)
+        error: Optional[str] = None
+        errors: "list[Optional[str]]" = [ None ] * len(conversions)
+        try :
+            patch.apply()
+        except BatchConversionError as e :
+            error = error_summary(e)
+            failed = { id(conversion): error_summary(failure) for conversion, failure in e.failures }
+            errors = [ failed.get(id(conversion)) for conversion in conversions ]
+        except Exception as e :
+            error = error_summary(e)
+            errors = [ error ] * len(conversions)
+        except BaseException :
+            self._discard(conversions)
+            self.queue.release(item_id, claim)
+            raise
+        finally :
+            self._leases.remove(item_id, claim)
+        result = { 'error': error, 'errors': errors, 'audio_hashes': [ conversion.audio_hash for conversion in conversions ] }
+        if not self.queue.acknowledge(item_id, claim, result) :
+            print(f"The claim on {item_id} expired, its outputs are discarded")
+            self._discard(conversions)
+            return
+        failures = sum(1 for output_error in errors if output_error is not None)
+        with self._lock :
+            if failures > 0 :
+                print(f"Failed to convert {item_id} : {error}")
+            self.converted += len(conversions) - failures
+            self.failed += failures
+
+    def _discard(self, conversions: "Sequence[ConvertPatch]") :
+        for conversion in conversions :
+            try :
+                os.unlink(conversion.dest_file)
+            except FileNotFoundError :
+                pass
+
+    # Errors of the shared filesystem (e.g. a network share that is briefly unavailable) do not stop the thread,
+    # an item whose result could not be written is not acknowledged and goes back in the queue when its claim expires
+    def _work(self) :
+        claim = WorkQueue.new_claim()
+        while not self.stopping.is_set() :
+            try :
+                claimed = self.queue.claim(claim)
+                if claimed is None :
+                    # Idle workers also put back in the queue the items of the workers that disappeared
+                    self.queue.requeue_expired()
+                    self.stopping.wait(POLL_SEC)
+                    continue
+                item_id, item = claimed
+                self.process(item_id, claim, item)
+            except OSError as e :
+                print(f"Error while accessing the queue in {self.queue.directory} : {e}")
+                self.stopping.wait(POLL_SEC)
+            claim = WorkQueue.new_claim()
+
+    # Runs until SIGINT or SIGTERM, the conversions that were started are completed
+    def run(self) :
+        threads = [ threading.Thread(target = self._work, name = f"queue-worker-{i}", daemon = True) for i in range(self.jobs) ]
+        previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: self.stopping.set())
+        print(f"Waiting for items in {self.queue.directory} ({self.jobs} jobs)")
+        try :
+            for thread in threads :
+                thread.start()
+            for thread in threads :
+                while thread.is_alive() :
+                    try :
+                        thread.join(POLL_SEC)
+                    except KeyboardInterrupt :
+                        self.stopping.set()
+        finally :
+            signal.signal(signal.SIGTERM, previous_handler)
+            self._leases.close()
+        print(f"Converted {self.converted} files, {self.failed} failures")